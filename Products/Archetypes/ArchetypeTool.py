@@ -1,5 +1,6 @@
 import os.path
 import sys
+import time
 from copy import deepcopy
 from DateTime import DateTime
 from StringIO import StringIO
@@ -18,6 +19,9 @@ from Products.Archetypes.ClassGen import generateZMICtor
 from Products.Archetypes.SQLStorageConfig import SQLStorageConfig
 from Products.Archetypes.config import TOOL_NAME
 from Products.Archetypes.config import UID_CATALOG
+from Products.Archetypes.config import REFERENCE_ANNOTATION
+from Products.Archetypes.checkpoint import Checkpoint
+from Products.Archetypes.checkpoint import processPartitions
 from Products.Archetypes.config import HAS_GRAPHVIZ
 from Products.Archetypes.log import log
 from Products.Archetypes.utils import findDict
@@ -36,9 +40,13 @@ from Products.CMFCore.ActionInformation import ActionInformation
 from Products.CMFCore.Expression import Expression
 
 from AccessControl import ClassSecurityInfo
+from Acquisition import aq_base
+from Acquisition import aq_inner
+from Acquisition import aq_parent
 from Acquisition import ImplicitAcquisitionWrapper
 from App.class_init import InitializeClass
 from Persistence import PersistentMapping
+from BTrees.OOBTree import OOBTree
 from OFS.Folder import Folder
 from Products.ZCatalog.interfaces import IZCatalog
 from Products.PageTemplates.PageTemplateFile import PageTemplateFile
@@ -947,6 +955,9 @@ class ArchetypeTool(UniqueObject, ActionProviderBase, \
                 # these objects (having no longer type information for them)
             else:
                 list.append((t, ourTypes[t] != currentTypes[t]['signature']))
+            if t in currentTypes and \
+               ourTypes.get(t) == currentTypes[t]['signature']:
+                self.recordSchema(currentTypes[t]['schema'])
         if modified:
             self._p_changed = True
         return list
@@ -984,6 +995,8 @@ class ArchetypeTool(UniqueObject, ActionProviderBase, \
             catalog = getToolByName(self, 'portal_catalog')
             portal = getToolByName(self, 'portal_url').getPortalObject()
             meta_types = [_types[t]['meta_type'] for t in update_types]
+            for t in update_types:
+                self.recordSchema(_types[t]['schema'])
             if remove_instance_schemas:
                 func_update_changed = self._removeSchemaAndUpdateChangedObject
                 func_update_all = self._removeSchemaAndUpdateObject
@@ -1003,12 +1016,193 @@ class ArchetypeTool(UniqueObject, ActionProviderBase, \
         print >> out, 'Done.'
         return out.getvalue()
 
+    security.declareProtected(permissions.ManagePortal, 'updateSchemas')
+    def updateSchemas(self, types=None, update_all=False,
+                      remove_instance_schemas=False, batch_size=1000,
+                      worker=None, restart=False, dry_run=False, out=None,
+                      claim_timeout=None):
+        """Update the schema of all objects of types in batches.
+
+        Like manage_updateSchema, but the objects are found in the
+        uid_catalog by meta_type and a transaction is committed after every
+        batch_size objects. The progress is kept in a checkpoint on the
+        tool: calling this method again resumes an interrupted update, and
+        several ZEO clients may call it at the same time to share the work.
+        The settings of the first call are used by all workers until the
+        update is done; pass restart=True to start over. The objects of a
+        worker that didn't commit for claim_timeout seconds
+        (checkpoint.CLAIM_TIMEOUT by default) are taken over by the next
+        worker.
+
+        types defaults to the types with changed schemas. With dry_run
+        nothing is changed, the objects that would be updated are counted.
+
+        Returns a dict mapping meta_type to (examined, updated, seconds).
+        """
+        uc = getToolByName(self, UID_CATALOG)
+        portal = getToolByName(self, 'portal_url').getPortalObject()
+        checkpoint = getattr(aq_base(self), '_schema_checkpoint', None)
+        if dry_run or restart or checkpoint is None:
+            if types is None:
+                types = [t for t, changed in self.getChangedSchema()
+                         if changed]
+            types = tuple([t for t in types if t in _types])
+            meta_types = tuple([_types[t]['meta_type'] for t in types])
+
+        stats = {}
+        def apply(obj, path, options):
+            start = time.time()
+            updated = 0
+            if options['update_all'] or not obj._isSchemaCurrent():
+                if not dry_run:
+                    obj._updateSchema(remove_instance_schemas=
+                                      options['remove_instance_schemas'],
+                                      full=options['update_all'])
+                updated = 1
+            examined, count, seconds = stats.get(obj.meta_type, (0, 0, 0.0))
+            stats[obj.meta_type] = (examined + 1, count + updated,
+                                    seconds + time.time() - start)
+
+        if dry_run:
+            options = {'update_all': update_all}
+            for path, obj in self._schemaCandidates(uc, portal, meta_types):
+                apply(obj, path, options)
+            self._reportSchemaStats(stats, out)
+            return stats
+
+        if restart or checkpoint is None:
+            for t in types:
+                self.recordSchema(_types[t]['schema'])
+            partitions = {}
+            for path in self._schemaCandidatePaths(uc, meta_types):
+                partitions[path.split('/')[0]] = True
+            partitions = partitions.keys()
+            partitions.sort()
+            checkpoint = Checkpoint('%s schema update' % self.getId(),
+                                    partitions, types=types,
+                                    meta_types=meta_types,
+                                    update_all=bool(update_all),
+                                    remove_instance_schemas=
+                                    bool(remove_instance_schemas))
+            self._schema_checkpoint = checkpoint
+            transaction.commit()
+
+        options = checkpoint.options
+        def items(partition, after):
+            return self._schemaCandidates(uc, portal, options['meta_types'],
+                                          partition, after)
+        processPartitions(checkpoint, items,
+                          lambda obj, path: apply(obj, path, options),
+                          batch_size=batch_size, worker=worker, out=out,
+                          claim_timeout=claim_timeout)
+        self._reportSchemaStats(stats, out)
+
+        if checkpoint.isDone() and \
+           getattr(aq_base(self), '_schema_checkpoint', None) is checkpoint:
+            for t in options['types']:
+                if t in _types:
+                    self._types[t] = _types[t]['signature']
+            self._p_changed = True
+            del self._schema_checkpoint
+            transaction.commit()
+        return stats
+
+    _field_signatures = None
+
+    security.declarePrivate('recordSchema')
+    def recordSchema(self, schema):
+        """Remember the fields of schema under its signature.
+
+        Objects whose schema signature is known can be updated field by
+        field (see BaseObject._updateSchema).
+        """
+        signature = schema.signature()
+        if self._field_signatures is None:
+            self._field_signatures = OOBTree()
+        elif signature in self._field_signatures:
+            return
+        self._field_signatures[signature] = \
+            schema.compiled().fieldSignatures().copy()
+
+    security.declarePrivate('getFieldSignatures')
+    def getFieldSignatures(self, signature):
+        """Return the fields recorded for a schema signature or None.
+        """
+        if self._field_signatures is None:
+            return None
+        return self._field_signatures.get(signature)
+
+    security.declareProtected(permissions.ManagePortal,
+                              'schemaUpdateProgress')
+    def schemaUpdateProgress(self):
+        """Return (done partitions, all partitions, examined objects) of a
+        running updateSchemas or None.
+        """
+        checkpoint = getattr(aq_base(self), '_schema_checkpoint', None)
+        if checkpoint is None:
+            return None
+        return checkpoint.progress()
+
+    def _schemaCandidatePaths(self, uc, meta_types, partition=None,
+                              after=None):
+        """Yield the uid_catalog paths of objects with one of meta_types.
+
+        The paths come in sorted order. If partition is given only paths
+        of the top-level object partition and its contents are returned,
+        starting after the path after.
+        """
+        _catalog = uc._catalog
+        pos = _catalog.schema.get('meta_type')
+        if partition is None:
+            keys = _catalog.uids.keys()
+        elif after is None:
+            keys = _catalog.uids.keys(partition, partition + '/\xff')
+        else:
+            keys = _catalog.uids.keys(after, partition + '/\xff',
+                                      excludemin=True)
+        marker = '/%s/' % REFERENCE_ANNOTATION
+        prefix = partition is not None and partition + '/'
+        for path in keys:
+            if prefix and path != partition and not path.startswith(prefix):
+                # e.g. 'news-archive' sorts between 'news' and 'news/'
+                continue
+            if marker in path:
+                continue
+            if pos is not None:
+                data = _catalog.data.get(_catalog.uids[path])
+                if data is not None and data[pos] not in meta_types:
+                    continue
+            yield path
+
+    def _schemaCandidates(self, uc, portal, meta_types, partition=None,
+                          after=None):
+        for path in self._schemaCandidatePaths(uc, meta_types, partition,
+                                               after):
+            obj = portal.unrestrictedTraverse(path, None)
+            if obj is not None and \
+               getattr(aq_base(obj), 'meta_type', None) in meta_types:
+                yield path, obj
+
+    def _reportSchemaStats(self, stats, out=None):
+        meta_types = stats.keys()
+        meta_types.sort()
+        for meta_type in meta_types:
+            examined, updated, seconds = stats[meta_type]
+            msg = ('Schema update of %s: %d examined, %d updated, '
+                   '%.1f objects/s' % (meta_type, examined, updated,
+                                       examined / max(seconds, 0.001)))
+            log(msg)
+            if out is not None:
+                print >> out, msg
+
     # A counter to ensure that in a given interval a subtransaction
     # commit is done.
     subtransactioncounter = 0
 
-    def _updateObject(self, o, path, remove_instance_schemas=None):
-        o._updateSchema(remove_instance_schemas=remove_instance_schemas)
+    def _updateObject(self, o, path, remove_instance_schemas=None,
+                      full=True):
+        o._updateSchema(remove_instance_schemas=remove_instance_schemas,
+                        full=full)
         # Subtransactions to avoid eating up RAM when used inside a
         # 'ZopeFindAndApply' like in manage_updateSchema
         self.subtransactioncounter += 1
@@ -1018,14 +1212,14 @@ class ArchetypeTool(UniqueObject, ActionProviderBase, \
 
     def _updateChangedObject(self, o, path):
         if not o._isSchemaCurrent():
-            self._updateObject(o, path)
+            self._updateObject(o, path, full=False)
 
-    def _removeSchemaAndUpdateObject(self, o, path):
-        self._updateObject(o, path, remove_instance_schemas=True)
+    def _removeSchemaAndUpdateObject(self, o, path, full=True):
+        self._updateObject(o, path, remove_instance_schemas=True, full=full)
 
     def _removeSchemaAndUpdateChangedObject(self, o, path):
         if not o._isSchemaCurrent():
-            self._removeSchemaAndUpdateObject(o, path)
+            self._removeSchemaAndUpdateObject(o, path, full=False)
 
     security.declareProtected(permissions.ManagePortal,
                               'manage_updateSchema')
@@ -1070,12 +1264,39 @@ class ArchetypeTool(UniqueObject, ActionProviderBase, \
             Each catalog is has to be a tool, means unique in site root.
         """
         self.catalog_map[portal_type] = catalogList
+        self._invalidateCatalogCache()
+
+    security.declarePrivate('_invalidateCatalogCache')
+    def _invalidateCatalogCache(self):
+        """Forget the catalogs resolved by getCatalogsByType.
 
+        The tool is marked as changed so other ZODB connections drop their
+        cached catalogs, too, once the transaction is committed.
+        """
+        self._v_catalogs_by_type = {}
+        self._p_changed = True
 
     security.declareProtected(permissions.View, 'getCatalogsByType')
     def getCatalogsByType(self, portal_type):
         """Return the catalog objects assoicated with a given type.
         """
+        cache = getattr(aq_base(self), '_v_catalogs_by_type', None)
+        if cache is None:
+            cache = self._v_catalogs_by_type = {}
+        cached = cache.get(portal_type)
+        if cached is not None:
+            # The catalogs live in the portal root like we do. Rewrap them
+            # in the current context, unless one was replaced or removed.
+            container = aq_parent(aq_inner(self))
+            base = aq_base(container)
+            catalogs = []
+            for name, catalog in cached:
+                if getattr(base, name, None) is not catalog:
+                    break
+                catalogs.append(catalog.__of__(container))
+            else:
+                return catalogs
+
         catalogs = []
         catalog_map = getattr(self, 'catalog_map', None)
         if catalog_map is not None:
@@ -1083,6 +1304,7 @@ class ArchetypeTool(UniqueObject, ActionProviderBase, \
         else:
             names = ['portal_catalog']
         portal = getToolByName(self, 'portal_url').getPortalObject()
+        resolved = True
         for name in names:
             try:
                 catalogs.append(getToolByName(portal, name))
@@ -1090,7 +1312,11 @@ class ArchetypeTool(UniqueObject, ActionProviderBase, \
                 raise
             except Exception, E:
                 log('No tool %s' % name, E)
-                pass
+                resolved = False
+        if resolved:
+            # Don't cache missing catalogs, they may be added later on
+            cache[portal_type] = [(name, aq_base(c))
+                                  for name, c in zip(names, catalogs)]
         return catalogs
 
     security.declareProtected(permissions.View, 'getCatalogsInSite')
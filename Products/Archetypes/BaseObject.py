@@ -1,7 +1,9 @@
 import sys
+import threading
 from App.class_init import InitializeClass
 
 from Products.Archetypes import PloneMessageFactory as _
+from Products.Archetypes import textcache
 from Products.Archetypes.debug import log_exc
 from Products.Archetypes.utils import DisplayList
 from Products.Archetypes.utils import mapply
@@ -12,15 +14,20 @@ from Products.Archetypes.Field import TextField
 from Products.Archetypes.Renderer import renderer
 from Products.Archetypes.Schema import Schema
 from Products.Archetypes.Schema import getSchemata
+from Products.Archetypes.Schema.compiled import diffFieldSignatures
+from Products.Archetypes.Schema.factory import lookupSchema
 from Products.Archetypes.Widget import IdWidget
 from Products.Archetypes.Widget import StringWidget
 from Products.Archetypes.Marshall import RFC822Marshaller
+from Products.Archetypes.mimetype_utils import classifyMimetype
 from Products.Archetypes.interfaces import IBaseObject
 from Products.Archetypes.interfaces import IReferenceable
 from Products.Archetypes.interfaces import ISchema
 from Products.Archetypes.interfaces.field import IFileField
 from Products.Archetypes.validator import AttributeValidator
+from Products.Archetypes import config
 from Products.Archetypes.config import ATTRIBUTE_SECURITY
+from Products.Archetypes.config import TOOL_NAME
 from Products.Archetypes.config import RENAME_AFTER_CREATION_ATTEMPTS
 
 from Products.Archetypes.event import ObjectInitializedEvent
@@ -73,6 +80,18 @@ except ImportError:
     HAS_LOCKING = False
 
 _marker = []
+_charsets = threading.local()
+
+
+def _transactionCharsets():
+    """Return the container -> charset cache of the current transaction.
+    """
+    txn = transaction.get()
+    if getattr(_charsets, 'txn', None) is not txn:
+        _charsets.txn = txn
+        _charsets.values = {}
+    return _charsets.values
+
 
 content_type = Schema((
 
@@ -124,6 +143,8 @@ class BaseObject(Referenceable):
 
     schema = content_type
     _signature = None
+    # field name -> size of the stored data, see get_size
+    _field_sizes = None
 
     installMode = ['type', 'actions', 'indexes']
 
@@ -528,6 +549,13 @@ class BaseObject(Referenceable):
         for field in self.Schema().fields():
             if not field.searchable:
                 continue
+            key = None
+            if textcache.isCacheable(field):
+                key = textcache.revisionKey(field, self)
+                datum = textcache.getText(key, _marker)
+                if datum is not _marker:
+                    data.extend(self._searchableDatum(field, datum, charset))
+                    continue
             method = field.getIndexAccessor(self)
             try:
                 datum =  method(mimetype="text/plain")
@@ -540,33 +568,62 @@ class BaseObject(Referenceable):
                     raise
                 except:
                     continue
-            if datum:
-                vocab = field.Vocabulary(self)
-                if isinstance(datum, (list, tuple)):
-                    # Unmangle vocabulary: we index key AND value
-                    vocab_values = map(lambda value, vocab=vocab: vocab.getValue(value, ''), datum)
-                    datum = list(datum)
-                    datum.extend(vocab_values)
-                    datum = ' '.join(datum)
-                elif isinstance(datum, basestring):
-                    if isinstance(datum, unicode):
-                        datum = datum.encode(charset)
-                    value = vocab.getValue(datum, '')
-                    if isinstance(value, unicode):
-                        value = value.encode(charset)
-                    datum = "%s %s" % (datum, value, )
+            textcache.setText(key, datum)
+            data.extend(self._searchableDatum(field, datum, charset))
+
+        data = ' '.join(data)
+        return data
 
+    security.declarePrivate('_searchableDatum')
+    def _searchableDatum(self, field, datum, charset):
+        """Return the list of strings to index for the value datum of
+        field.
+        """
+        data = []
+        if datum:
+            vocab = field.Vocabulary(self)
+            if isinstance(datum, (list, tuple)):
+                # Unmangle vocabulary: we index key AND value
+                vocab_values = map(lambda value, vocab=vocab: vocab.getValue(value, ''), datum)
+                datum = list(datum)
+                datum.extend(vocab_values)
+                datum = ' '.join(datum)
+            elif isinstance(datum, basestring):
                 if isinstance(datum, unicode):
                     datum = datum.encode(charset)
-                data.append(str(datum))
-
-        data = ' '.join(data)
+                value = vocab.getValue(datum, '')
+                if isinstance(value, unicode):
+                    value = value.encode(charset)
+                datum = "%s %s" % (datum, value, )
+
+            if isinstance(datum, unicode):
+                datum = datum.encode(charset)
+            data.append(str(datum))
         return data
 
     security.declareProtected(permissions.View, 'getCharset')
     def getCharset(self):
         """Returns the site default charset, or utf-8.
+
+        The charset is looked up once per container and transaction
+        (which in Zope is the request), as it is needed for every string
+        that is set or indexed.
         """
+        base = aq_base(self)
+        parent = aq_parent(aq_inner(self))
+        if parent is None or \
+           getattr(base, 'portal_properties', None) is not None:
+            # Not wrapped or with a properties tool of its own
+            return self._lookupCharset()
+        parent = aq_base(parent)
+        charsets = _transactionCharsets()
+        entry = charsets.get(id(parent))
+        if entry is None or entry[0] is not parent:
+            entry = charsets[id(parent)] = (parent, self._lookupCharset())
+        return entry[1]
+
+    security.declarePrivate('_lookupCharset')
+    def _lookupCharset(self):
         properties = getToolByName(self, 'portal_properties', None)
         if properties is not None:
             site_properties = getattr(properties, 'site_properties', None)
@@ -579,12 +636,37 @@ class BaseObject(Referenceable):
     security.declareProtected(permissions.View, 'get_size')
     def get_size(self):
         """Used for FTP and apparently the ZMI now too.
+
+        Uses the sizes the fields recorded when they stored their values,
+        the storages drop them when a value is stored or removed without
+        the field. Fields without a recorded size are asked.
         """
+        sizes = self._field_sizes or {}
         size = 0
         for field in self.Schema().fields():
-            size+=field.get_size(self)
+            field_size = sizes.get(field.getName())
+            if field_size is None:
+                field_size = field.get_size(self)
+            size += field_size
         return size
 
+    security.declarePrivate('_setFieldSize')
+    def _setFieldSize(self, name, size):
+        """Record the size of field name, called by the fields and the
+        storages when they store a value. A size of None drops the
+        recorded size.
+        """
+        sizes = self._field_sizes or {}
+        if sizes.get(name) == size:
+            return
+        # Replace the mapping so the sizes are kept on our own record
+        sizes = sizes.copy()
+        if size is None:
+            del sizes[name]
+        else:
+            sizes[name] = size
+        self._field_sizes = sizes
+
     security.declarePrivate('_processForm')
     def _processForm(self, data=1, metadata=None, REQUEST=None, values=None):
         request = REQUEST or self.REQUEST
@@ -818,7 +900,7 @@ class BaseObject(Referenceable):
     def Schema(self):
         """Return a (wrapped) schema instance for this object instance.
         """
-        return ImplicitAcquisitionWrapper(ISchema(self), self)
+        return ImplicitAcquisitionWrapper(lookupSchema(self), self)
 
     security.declarePrivate('_isSchemaCurrent')
     def _isSchemaCurrent(self):
@@ -828,13 +910,17 @@ class BaseObject(Referenceable):
 
     security.declarePrivate('_updateSchema')
     def _updateSchema(self, excluded_fields=[], out=None,
-                      remove_instance_schemas=False):
+                      remove_instance_schemas=False, full=False):
         """Updates an object's schema when the class schema changes.
 
         For each field we use the existing accessor to get its value,
         then we re-initialize the class, then use the new schema
         mutator for each field to set the values again.
 
+        If the archetype tool knows the fields of the schema the object
+        was last updated to, only the fields that were added, retyped or
+        moved to another storage are touched, unless full is given.
+
         We also copy over any class methods to handle product
         refreshes gracefully (when a product refreshes, you end up
         with both the old version of the class and the new in memory
@@ -850,6 +936,15 @@ class BaseObject(Referenceable):
             del self.schema
         new_schema = self.Schema()
 
+        if not full and config.INCREMENTAL_SCHEMA_UPDATE:
+            diff = self._schemaDiff(new_schema)
+            if diff is not None:
+                self._updateSchemaFields(new_schema, diff, excluded_fields,
+                                         out)
+                if out is not None:
+                    return out
+                return
+
         # Read all the old values into a dict
         values = {}
         mimes = {}
@@ -869,17 +964,7 @@ class BaseObject(Referenceable):
                 if shasattr(f, 'getContentType'):
                     mimes[name] = f.getContentType(self)
 
-        obj_class = self.__class__
-        current_class = getattr(sys.modules[self.__module__],
-                                self.__class__.__name__)
-        if obj_class.schema != current_class.schema:
-            # XXX This is kind of brutish.  We do this to make sure that old
-            # class instances have the proper methods after a refresh.  The
-            # best thing to do is to restart Zope after doing an update, and
-            # the old versions of the class will disappear.
-
-            for k in current_class.__dict__.keys():
-                obj_class.__dict__[k] = current_class.__dict__[k]
+        self._refreshClass()
 
         # Set a request variable to avoid resetting the newly created flag
         req = getattr(self, 'REQUEST', None)
@@ -905,6 +990,98 @@ class BaseObject(Referenceable):
         if out is not None:
             return out
 
+    security.declarePrivate('_refreshClass')
+    def _refreshClass(self):
+        obj_class = self.__class__
+        current_class = getattr(sys.modules[self.__module__],
+                                self.__class__.__name__)
+        if obj_class.schema != current_class.schema:
+            # XXX This is kind of brutish.  We do this to make sure that old
+            # class instances have the proper methods after a refresh.  The
+            # best thing to do is to restart Zope after doing an update, and
+            # the old versions of the class will disappear.
+
+            for k in current_class.__dict__.keys():
+                obj_class.__dict__[k] = current_class.__dict__[k]
+
+    security.declarePrivate('_schemaDiff')
+    def _schemaDiff(self, new_schema):
+        """Compare the fields of the schema this object was last updated
+        to with new_schema.
+
+        Returns (added, removed, changed) field names, or None if the old
+        fields are unknown and a full update is needed.
+        """
+        if not self._signature:
+            return None
+        if not shasattr(new_schema, '_initializeFieldLayers'):
+            return None
+        tool = getToolByName(self, TOOL_NAME, None)
+        if tool is None:
+            return None
+        old = tool.getFieldSignatures(self._signature)
+        if old is None:
+            return None
+        new = new_schema.compiled().fieldSignatures()
+        return diffFieldSignatures(old, new)
+
+    security.declarePrivate('_updateSchemaFields')
+    def _updateSchemaFields(self, new_schema, diff, excluded_fields=[],
+                            out=None):
+        """Update only the fields listed in diff, see _schemaDiff.
+
+        Added fields get their default value unless they take over the
+        value of an old field (old_field_name), the values of changed
+        fields are read and set again. The values of removed fields are
+        left alone, like a full update does.
+        """
+        added, removed, changed = diff
+        defaults = []
+        values = {}
+        mimes = {}
+        for name in added + changed:
+            if name in excluded_fields:
+                continue
+            f = new_schema[name]
+            if f.type == "reference":
+                continue
+            old_name = getattr(f, 'old_field_name', None)
+            if name in added and not (old_name and old_name in removed):
+                defaults.append(f)
+                continue
+            try:
+                values[name] = self._migrateGetValue(name, new_schema)
+            except ValueError:
+                if out is not None:
+                    print >> out, ('Unable to get %s.%s'
+                                   % (str(self.getId()), name))
+                defaults.append(f)
+            else:
+                if shasattr(f, 'getContentType'):
+                    mimes[name] = f.getContentType(self)
+
+        self._refreshClass()
+
+        touched = defaults + [new_schema[name] for name in values]
+        if touched:
+            new_schema._initializeFieldLayers(self, touched)
+        for f in defaults:
+            new_schema._setFieldDefault(self, f)
+        for name, value in values.items():
+            kw = {}
+            if mimes.has_key(name):
+                kw['mimetype'] = mimes[name]
+            try:
+                self._migrateSetValue(name, value, **kw)
+            except ValueError:
+                if out is not None:
+                    print >> out, ('Unable to set %s.%s to '
+                                   '%s' % (str(self.getId()),
+                                           name, str(value)))
+        self._signature = new_schema.signature()
+        # Make sure the changes are persisted
+        self._p_changed = 1
+
     security.declarePrivate('_migrateGetValue')
     def _migrateGetValue(self, name, new_schema=None):
         """Try to get a value from an object using a variety of methods."""
@@ -1089,8 +1266,8 @@ class BaseObject(Referenceable):
             return None
 
         mtr = self.mimetypes_registry
-        mt = mtr.classify(data, filename=name)
-        return Wrapper(data, name, str(mt) or 'application/octet-stream').__of__(self)
+        mt = classifyMimetype(mtr, data, filename=name)
+        return Wrapper(data, name, mt or 'application/octet-stream').__of__(self)
 
     def __bobo_traverse__(self, REQUEST, name):
         """Allows transparent access to session subobjects.
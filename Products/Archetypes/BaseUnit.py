@@ -3,6 +3,9 @@ from zope.interface import implements
 
 from Products.Archetypes.interfaces import IBaseUnit
 from Products.Archetypes.config import *
+from Products.Archetypes.download import sendData
+from Products.Archetypes.download import storedETag
+from Products.Archetypes.download import storedModificationTime
 from Products.Archetypes.log import log
 from Products.Archetypes.utils import shasattr
 from logging import ERROR
@@ -231,11 +234,10 @@ class BaseUnit(File):
         if filename:
             RESPONSE.setHeader('Content-Disposition',
                                'attachment; filename=%s' % filename)
-        RESPONSE.setHeader('Content-Type', self.getContentType())
-        RESPONSE.setHeader('Content-Length', self.get_size())
-
-        RESPONSE.write(self.getRaw(encoding=self.original_encoding))
-        return ''
+        return sendData(REQUEST, RESPONSE,
+                        lambda: self.getRaw(encoding=self.original_encoding),
+                        self.getContentType(), etag=storedETag(self),
+                        mtime=storedModificationTime(self))
 
     ### webDAV me this, webDAV me that
     security.declareProtected( permissions.ModifyPortalContent, 'PUT')
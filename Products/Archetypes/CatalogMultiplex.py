@@ -1,5 +1,10 @@
+from hashlib import md5
 from logging import WARNING
 
+from zope.component import queryMultiAdapter
+from plone.indexer.interfaces import IIndexableObject
+from ZODB.POSException import ConflictError
+
 from Acquisition import aq_base
 from AccessControl import ClassSecurityInfo
 from App.class_init import InitializeClass
@@ -7,11 +12,17 @@ from Products.CMFCore.utils import getToolByName
 from Products.CMFCore.interfaces import ICatalogTool
 from Products.CMFCore.permissions import ModifyPortalContent
 from Products.CMFCore.CMFCatalogAware import CatalogAware, WorkflowAware, OpaqueItemManager
+from Products.Archetypes import config
 from Products.Archetypes.config import CATALOGMAP_USES_PORTALTYPE, TOOL_NAME
+from Products.Archetypes.catalogqueue import getQueue
 from Products.Archetypes.log import log
 from Products.Archetypes.Referenceable import Referenceable
 from Products.Archetypes.utils import shasattr, isFactoryContained
 
+_marker = []
+# Stands in for values that could not be computed when fingerprinting
+_error = 'Products.Archetypes.CatalogMultiplex:error'
+
 class CatalogMultiplex(CatalogAware, WorkflowAware, OpaqueItemManager):
     security = ClassSecurityInfo()
 
@@ -32,8 +43,16 @@ class CatalogMultiplex(CatalogAware, WorkflowAware, OpaqueItemManager):
     def indexObject(self):
         if isFactoryContained(self):
             return
-        catalogs = self.getCatalogs()
         url = self.__url()
+        if config.QUEUE_CATALOG_OPERATIONS:
+            getQueue().index(self, url)
+            return
+        self._indexObject(url)
+
+    security.declarePrivate('_indexObject')
+    def _indexObject(self, url):
+        self._clearCatalogFingerprints()
+        catalogs = self.getCatalogs()
         for c in catalogs:
             c.catalog_object(self, url)
 
@@ -41,8 +60,12 @@ class CatalogMultiplex(CatalogAware, WorkflowAware, OpaqueItemManager):
     def unindexObject(self):
         if isFactoryContained(self):
             return
-        catalogs = self.getCatalogs()
         url = self.__url()
+        if config.QUEUE_CATALOG_OPERATIONS:
+            # Pending writes for this path must not survive the unindexing
+            getQueue().discard(url)
+        self._clearCatalogFingerprints()
+        catalogs = self.getCatalogs()
         for c in catalogs:
             if c._catalog.uids.get(url, None) is not None:
                 c.uncatalog_object(url)
@@ -84,6 +107,11 @@ class CatalogMultiplex(CatalogAware, WorkflowAware, OpaqueItemManager):
                 # Recatalog with the same catalog uid.
                 catalog.reindexObject(ob, idxs=self._cmf_security_indexes,
                                         update_metadata=0, uid=brain_path)
+                # The fingerprints of these indexes are outdated now
+                forget = getattr(aq_base(ob), '_forgetCatalogFingerprints',
+                                 None)
+                if forget is not None:
+                    ob._forgetCatalogFingerprints(self._cmf_security_indexes)
 
 
 
@@ -106,12 +134,20 @@ class CatalogMultiplex(CatalogAware, WorkflowAware, OpaqueItemManager):
 
         self.http__refreshEtag()
 
+        url = self.__url()
+        if config.QUEUE_CATALOG_OPERATIONS:
+            getQueue().reindex(self, url, idxs)
+            return
+        self._reindexObject(url, idxs)
+
+    security.declarePrivate('_reindexObject')
+    def _reindexObject(self, url, idxs=[]):
+        """Write the catalog entries of this object, see reindexObject.
+        """
         catalogs = self.getCatalogs()
         if not catalogs:
             return
 
-        url = self.__url()
-
         for c in catalogs:
             if c is not None:
                 # We want the intersection of the catalogs idxs
@@ -120,7 +156,10 @@ class CatalogMultiplex(CatalogAware, WorkflowAware, OpaqueItemManager):
                 indexes = c.indexes()
                 if idxs:
                     lst = [i for i in idxs if i in indexes]
-                c.catalog_object(self, url, idxs=lst)
+                if config.CATALOG_CHANGE_DETECTION:
+                    self._catalogChanged(c, url, lst or indexes)
+                else:
+                    c.catalog_object(self, url, idxs=lst)
 
         # We only make this call if idxs is not passed.
         #
@@ -134,4 +173,104 @@ class CatalogMultiplex(CatalogAware, WorkflowAware, OpaqueItemManager):
                 if isCopy is None:
                     self._catalogUID(self)
 
+    def _catalogChanged(self, catalog, url, idxs):
+        """Catalog only the indexes and metadata whose values changed.
+
+        A fingerprint of every index value and of the metadata record is
+        kept on the object per catalog. Unchanged indexes are skipped and
+        the catalog is not touched at all if nothing changed.
+        """
+        cid = catalog.getId()
+        stored = getattr(aq_base(self), '_at_catalog_fingerprints', None) or {}
+        old_url, old_prints, old_md = stored.get(cid, (None, {}, None))
+        new_prints, md = self._catalogFingerprint(catalog, idxs)
+
+        if old_url != url or catalog._catalog.uids.get(url) is None:
+            # Not (yet) cataloged at this path, do the full work
+            changed = list(idxs)
+        else:
+            changed = [i for i in idxs if old_prints.get(i) != new_prints[i]]
+        update_metadata = md != old_md
+        if not changed and not update_metadata:
+            return
+
+        prints = old_prints.copy()
+        prints.update(new_prints)
+        stored = stored.copy()
+        stored[cid] = (url, prints, md)
+        self._at_catalog_fingerprints = stored
+
+        if not changed:
+            # An empty idxs list means 'all indexes' to the catalog, so
+            # pass one index along with the metadata update.
+            changed = list(idxs[:1])
+        catalog.catalog_object(self, url, idxs=changed,
+                               update_metadata=update_metadata)
+
+    def _catalogFingerprint(self, catalog, idxs):
+        """Compute fingerprints of the values catalog would index for idxs.
+
+        Returns a tuple of a mapping index name -> fingerprint and the
+        fingerprint of the metadata record.
+        """
+        w = self
+        if not IIndexableObject.providedBy(self):
+            wrapper = queryMultiAdapter((self, catalog), IIndexableObject)
+            if wrapper is not None:
+                w = wrapper
+        _catalog = catalog._catalog
+        values = {}
+        def value(attr):
+            if attr not in values:
+                values[attr] = self._catalogDatum(w, attr)
+            return values[attr]
+
+        prints = {}
+        for name in idxs:
+            index = _catalog.getIndex(name)
+            getSources = getattr(aq_base(index), 'getIndexSourceNames', None)
+            if getSources is not None:
+                sources = getSources()
+            else:
+                sources = (name,)
+            data = [value(attr) for attr in sources]
+            prints[name] = md5(repr(data)).digest()
+        md = md5(repr([value(attr) for attr in _catalog.names])).digest()
+        return prints, md
+
+    def _catalogDatum(self, w, attr):
+        # Mirrors how PluginIndexes fetch their values from an object
+        try:
+            datum = getattr(w, attr, _marker)
+            if datum is _marker:
+                return None
+            if callable(datum):
+                datum = datum()
+            return datum
+        except (ConflictError, KeyboardInterrupt):
+            raise
+        except Exception:
+            return _error
+
+    def _clearCatalogFingerprints(self):
+        if getattr(aq_base(self), '_at_catalog_fingerprints', None):
+            self._at_catalog_fingerprints = None
+
+    def _forgetCatalogFingerprints(self, idxs):
+        """Drop the fingerprints of idxs, after the indexes were written
+        without going through _catalogChanged.
+        """
+        stored = getattr(aq_base(self), '_at_catalog_fingerprints', None)
+        if not stored:
+            return
+        changed = False
+        result = {}
+        for cid, (url, prints, md) in stored.items():
+            kept = dict([(name, value) for name, value in prints.items()
+                         if name not in idxs])
+            changed = changed or len(kept) != len(prints)
+            result[cid] = (url, kept, md)
+        if changed:
+            self._at_catalog_fingerprints = result
+
 InitializeClass(CatalogMultiplex)
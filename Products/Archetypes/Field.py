@@ -4,6 +4,8 @@ from cStringIO import StringIO
 from logging import ERROR
 from types import ClassType, FileType, StringType, UnicodeType
 
+import transaction
+
 from zope.contenttype import guess_content_type
 from zope.i18n import translate
 from zope.i18nmessageid import Message
@@ -69,6 +71,9 @@ from Products.Archetypes.Widget import StringWidget
 from Products.Archetypes.Widget import ReferenceWidget
 from Products.Archetypes.BaseUnit import BaseUnit
 from Products.Archetypes.ReferenceEngine import Reference
+from Products.Archetypes.download import sendData
+from Products.Archetypes.download import storedETag
+from Products.Archetypes.download import storedModificationTime
 from Products.Archetypes.log import log
 from Products.Archetypes.utils import DisplayList
 from Products.Archetypes.utils import Vocabulary
@@ -76,7 +81,9 @@ from Products.Archetypes.utils import className
 from Products.Archetypes.utils import mapply
 from Products.Archetypes.utils import shasattr
 from Products.Archetypes.utils import contentDispositionHeader
+from Products.Archetypes.utils import readData
 from Products.Archetypes.mimetype_utils import getAllowedContentTypes as getAllowedContentTypesProperty
+from Products.Archetypes.mimetype_utils import classifyMimetype
 from Products.Archetypes import config
 from Products.Archetypes.Storage import AttributeStorage
 from Products.Archetypes.Storage import ObjectManagedStorage
@@ -117,6 +124,8 @@ STRING_TYPES = [StringType, UnicodeType]
 
 _marker = []
 CHUNK = 1 << 14
+# Size of the Pdata chunks OFS.Image.File splits uploads into
+UPLOAD_CHUNK_SIZE = 1 << 16
 
 __docformat__ = 'reStructuredText'
 
@@ -225,6 +234,26 @@ class Field(DefaultLayerContainer):
 
         self.registerLayer('storage', self.storage)
 
+    # Stamped by __setattr__, compiled schemas compare it to find out
+    # whether they are stale (see Schema.compiled)
+    _version = 0
+
+    def __setattr__(self, name, value):
+        from Products.Archetypes.Schema.compiled import fieldChanged
+        DefaultLayerContainer.__setattr__(self, name, value)
+        self.__dict__['_version'] = fieldChanged()
+
+    def __delattr__(self, name):
+        from Products.Archetypes.Schema.compiled import fieldChanged
+        DefaultLayerContainer.__delattr__(self, name)
+        self.__dict__['_version'] = fieldChanged()
+
+    def __getstate__(self):
+        # The version is only meaningful in this process
+        state = self.__dict__.copy()
+        state.pop('_version', None)
+        return state
+
     security.declarePrivate('copy')
     def copy(self, name=None):
         """
@@ -233,6 +262,7 @@ class Field(DefaultLayerContainer):
         """
         cdict = dict(vars(self))
         cdict.pop('__name__')
+        cdict.pop('_version', None)
         # Widget must be copied separatedly
         widget = cdict['widget']
         del cdict['widget']
@@ -740,6 +770,7 @@ class ObjectField(Field):
         value = aq_base(value)
         __traceback_info__ = (self.getName(), instance, value, kwargs)
         self.getStorage(instance).set(self.getName(), instance, value, **kwargs)
+        self._updateSize(instance)
 
     security.declarePrivate('unset')
     def unset(self, instance, **kwargs):
@@ -747,6 +778,23 @@ class ObjectField(Field):
         __traceback_info__ = (self.getName(), instance, kwargs)
         self.getStorage(instance).unset(self.getName(), instance, **kwargs)
 
+    security.declarePrivate('_updateSize')
+    def _updateSize(self, instance):
+        """Record the size of the stored data on instance, so that
+        BaseObject.get_size doesn't have to ask every field for it.
+        The storage dropped the previous size when storing the value.
+        """
+        setFieldSize = getattr(aq_base(instance), '_setFieldSize', None)
+        if setFieldSize is None:
+            return
+        try:
+            size = self.get_size(instance)
+        except (ConflictError, KeyboardInterrupt):
+            raise
+        except:
+            return
+        instance._setFieldSize(self.getName(), size)
+
     security.declarePrivate('setStorage')
     def setStorage(self, instance, storage):
         if not IStorage.providedBy(storage):
@@ -858,6 +906,7 @@ class StringField(ObjectField):
         if not getattr(self, 'raw', False):
             value = decode(aq_base(value), instance, **kwargs)
         self.getStorage(instance).set(self.getName(), instance, value, **kwargs)
+        self._updateSize(instance)
 
 class FileField(ObjectField):
     """Something that may be a file, but is not an image and doesn't
@@ -944,6 +993,9 @@ class FileField(ObjectField):
                                 filename.rfind('\\'),
                                 filename.rfind(':'),
                                 )+1:]
+        if (shasattr(value, 'read') and shasattr(value, 'seek')
+            and getattr(aq_base(file), '_p_jar', None) is None):
+            self._addToConnection(instance, file, value)
         file.manage_upload(value)
         if mimetype is None or mimetype == 'text/x-unknown-content-type':
             body = file.data
@@ -951,13 +1003,9 @@ class FileField(ObjectField):
                 body = body.data
             mtr = getToolByName(instance, 'mimetypes_registry', None)
             if mtr is not None:
-                kw = {'mimetype':None,
-                      'filename':filename}
-                # this may split the encoded file inside a multibyte character
-                try:
-                    d, f, mimetype = mtr(body[:8096], **kw)
-                except UnicodeDecodeError:
-                    d, f, mimetype = mtr(len(body) < 8096 and body or '', **kw)
+                mimetype = classifyMimetype(mtr, body[:8096], filename)
+                if mimetype is None:
+                    mimetype = self.default_content_type
             else:
                 mimetype = getattr(file, 'content_type', None)
                 if mimetype is None:
@@ -995,6 +1043,31 @@ class FileField(ObjectField):
 
         return '', mimetype, filename
 
+    def _addToConnection(self, instance, file, upload):
+        """Add a new file object to the ZODB connection of instance.
+
+        OFS.Image.File only saves big uploads to the database in chunks
+        while reading them if it has a connection, otherwise it reads the
+        whole upload into memory. Only done for the attribute storage,
+        which stores the file object as it is.
+        """
+        if instance is None or \
+           not isinstance(self.getStorage(instance), AttributeStorage):
+            return
+        upload.seek(0, 2)
+        size = upload.tell()
+        upload.seek(0)
+        if size <= UPLOAD_CHUNK_SIZE * 2:
+            # Small uploads are kept in memory anyway
+            return
+        jar = getattr(aq_base(instance), '_p_jar', None)
+        if jar is None:
+            # New objects get their connection with a savepoint
+            transaction.savepoint(optimistic=True)
+            jar = getattr(aq_base(instance), '_p_jar', None)
+        if jar is not None:
+            jar.add(aq_base(file))
+
     def _make_file(self, id, title='', file='', instance=None):
         """File content factory"""
         return self.content_class(id, title, file)
@@ -1173,7 +1246,12 @@ class FileField(ObjectField):
             RESPONSE.setHeader("Content-Disposition", header_value)
         if no_output:
             return file
-        return file.index_html(REQUEST, RESPONSE)
+        if not isinstance(aq_base(file), File) or IBaseUnit.providedBy(file):
+            return file.index_html(REQUEST, RESPONSE)
+        return sendData(REQUEST, RESPONSE, lambda: file.data,
+                        file.getContentType(), file.get_size(),
+                        etag=storedETag(file),
+                        mtime=storedModificationTime(file))
 
     security.declarePublic('get_size')
     def get_size(self, instance):
@@ -1195,10 +1273,9 @@ class FileField(ObjectField):
 
     security.declarePrivate('getIndexable')
     def getIndexable(self, instance):
-        # XXX Naive implementation that loads all data contents into
-        # memory.  To have this not happening set your field to not
-        # 'searchable' (the default) or define your own 'index_method'
-        # property.
+        # The transforms need the whole file as a string, so files bigger
+        # than config.INDEXABLE_FILE_MAX_SIZE are not converted at all.
+        # Plain text is read chunk by chunk up to the maximum text size.
         orig_mt = self.getContentType(instance)
 
         # If there's no path to text/plain, don't do anything
@@ -1206,25 +1283,61 @@ class FileField(ObjectField):
         if transforms._findPath(orig_mt, 'text/plain') is None:
             return ''
 
-        f = self.get(instance)
-
-        datastream = ''
+        max_text = config.INDEXABLE_TEXT_MAX_SIZE
+        data, size = self._indexableData(self.get(instance))
         try:
-            datastream = transforms.convertTo(
-                "text/plain",
-                str(f),
-                mimetype = orig_mt,
-                filename = self.getFilename(instance, 0),
-                )
-        except (ConflictError, KeyboardInterrupt):
-            raise
-        except Exception, e:
-            log("Error while trying to convert file contents to 'text/plain' "
-                "in %r.getIndexable() of %r: %s" % (self, instance, e))
+            if orig_mt == 'text/plain':
+                return readData(data, max_text)
+
+            max_size = config.INDEXABLE_FILE_MAX_SIZE
+            if max_size and size > max_size:
+                log("Not converting %d bytes of %s to 'text/plain' in "
+                    "%r.getIndexable() of %r: the file is bigger than "
+                    "INDEXABLE_FILE_MAX_SIZE" % (size, orig_mt, self,
+                                                 instance))
+                return ''
+
+            datastream = ''
+            try:
+                datastream = transforms.convertTo(
+                    "text/plain",
+                    readData(data),
+                    mimetype = orig_mt,
+                    filename = self.getFilename(instance, 0),
+                    )
+            except (ConflictError, KeyboardInterrupt):
+                raise
+            except Exception, e:
+                log("Error while trying to convert file contents to "
+                    "'text/plain' in %r.getIndexable() of %r: %s" % (
+                    self, instance, e))
+        finally:
+            if shasattr(data, 'close'):
+                data.close()
 
         value = str(datastream)
+        if max_text:
+            value = value[:max_text]
         return value
 
+    def _indexableData(self, value):
+        """Return the data of value for getIndexable and its size.
+
+        The data is a string, the Pdata chain of an OFS File or, for values
+        keeping their data in a blob (e.g. from plone.app.blob), the open
+        blob file, which is closed by the caller. Blobs are not read here.
+        """
+        if isinstance(aq_base(value), File):
+            return value.data, value.get_size()
+        if shasattr(value, 'getBlob'):
+            f = value.getBlob().open('r')
+            f.seek(0, 2)
+            size = f.tell()
+            f.seek(0)
+            return f, size
+        data = str(value)
+        return data, len(data)
+
 class TextField(FileField):
     """Base Class for Field objects that rely on some type of
     transformation"""
@@ -1857,7 +1970,8 @@ class ReferenceField(ObjectField):
         """
         tool = getToolByName(instance, REFERENCE_CATALOG)
         targetUIDs = [ref.targetUID for ref in
-                      tool.getReferences(instance, self.relationship)]
+                      tool.getReferences(instance, self.relationship,
+                                         objects=False)]
 
         if value is None:
             value = ()
@@ -1884,13 +1998,13 @@ class ReferenceField(ObjectField):
         addRef_kw.setdefault('referenceClass', self.referenceClass)
         if addRef_kw.has_key('schema'): del addRef_kw['schema']
 
-        for uid in add:
-            __traceback_info__ = (instance, uid, value, targetUIDs)
-            # throws IndexError if uid is invalid
-            tool.addReference(instance, uid, self.relationship, **addRef_kw)
+        if add:
+            __traceback_info__ = (instance, add, value, targetUIDs)
+            # throws ReferenceException if a uid is invalid
+            tool.addReferences(instance, add, self.relationship, **addRef_kw)
 
-        for uid in sub:
-            tool.deleteReference(instance, uid, self.relationship)
+        if sub:
+            tool.deleteReferences(instance, self.relationship, targets=sub)
 
         if self.referencesSortable:
             if not hasattr( aq_base(instance), 'at_ordered_refs'):
@@ -2181,6 +2295,7 @@ class CMFObjectField(ObjectField):
         # The object should be already stored, so we dont 'set' it,
         # but just change instead.
         # ObjectField.set(self, instance, obj, **kwargs)
+        self._updateSize(instance)
 
 
 # ImageField.py
@@ -2334,6 +2449,8 @@ class ImageField(FileField):
         # TODO add self.ZCacheable_invalidate() later
         self.createOriginal(instance, data, **kwargs)
         self.createScales(instance, value=data)
+        # The size includes the scales
+        self._updateSize(instance)
 
     security.declareProtected(permissions.View, 'getAvailableSizes')
     def getAvailableSizes(self, instance):
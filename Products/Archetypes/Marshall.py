@@ -17,6 +17,7 @@ from Products.Archetypes.interfaces.base import IBaseUnit
 from Products.Archetypes.log import log
 from Products.Archetypes.utils import shasattr
 from Products.Archetypes.utils import mapply
+from Products.Archetypes.utils import OffsetFile
 
 sample_data = r"""title: a title
 content-type: text/plain
@@ -101,6 +102,31 @@ def parseRFC822(body):
 
     return headers, buffer.read()
 
+def parseRFC822File(file):
+    """Parse the headers of a RFC 822 style file
+
+    Returns the headers and the body as a file positioned at its start,
+    without reading the body.
+
+    >>> from cStringIO import StringIO
+    >>> headers, body = parseRFC822File(StringIO(sample_data))
+    >>> headers['title']
+    'a title'
+    >>> body.read()
+    'This is the body.\\n'
+    >>> body.seek(0)
+    >>> body.read(4)
+    'This'
+    """
+    file.seek(0)
+    message = NonLoweringMessage(file)
+    headers = {}
+
+    for key in message.keys():
+        headers[key] = '\n'.join(message.getheaders(key))
+
+    return headers, OffsetFile(file, file.tell())
+
 class Marshaller:
     implements(IMarshall, ILayer)
 
@@ -212,16 +238,21 @@ class RFC822Marshaller(Marshaller):
     security.setDefaultAccess('deny')
 
     def demarshall(self, instance, data, **kwargs):
+        p = instance.getPrimaryField()
         # We don't want to pass file forward.
         if kwargs.has_key('file'):
-            if not data:
-                # TODO Yuck! Shouldn't read the whole file, never.
-                # OTOH, if you care about large files, you should be
-                # using the PrimaryFieldMarshaller or something
-                # similar.
-                data = kwargs['file'].read()
+            file = kwargs['file']
             del kwargs['file']
-        headers, body = parseRFC822(data)
+        else:
+            file = None
+        if not data and file is not None:
+            # Only read the headers; a file or text primary field reads
+            # the body from the request file in chunks.
+            headers, body = parseRFC822File(file)
+            if not isinstance(p, FileField):
+                body = body.read()
+        else:
+            headers, body = parseRFC822(data)
         for k, v in headers.items():
             if v.strip() == 'None':
                 v = None
@@ -233,7 +264,6 @@ class RFC822Marshaller(Marshaller):
         content_type = headers.get('Content-Type')
         if not kwargs.get('mimetype', None):
             kwargs.update({'mimetype': content_type})
-        p = instance.getPrimaryField()
         if p is not None:
             mutator = p.getMutator(instance)
             if mutator is not None:
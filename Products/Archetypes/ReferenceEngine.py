@@ -2,6 +2,7 @@ import os
 from types import StringType, UnicodeType
 import time
 import urllib
+import transaction
 from zope.interface import implements
 
 from Products.CMFCore.utils import getToolByName
@@ -12,10 +13,14 @@ from Products.Archetypes.interfaces import IReferenceCatalog
 
 from Products.Archetypes.utils import make_uuid, getRelURL, shasattr
 from Products.Archetypes.config import (
-    TOOL_NAME, UID_CATALOG, REFERENCE_CATALOG, UUID_ATTR)
+    TOOL_NAME, UID_CATALOG, REFERENCE_CATALOG, UUID_ATTR, REFERENCE_ANNOTATION)
+from Products.Archetypes.checkpoint import walk
+from Products.Archetypes.adjacency import AdjacencyIndex
+from Products.Archetypes.adjacency import CatalogAdjacency
+from Products.Archetypes.log import log
 from Products.Archetypes.exceptions import ReferenceException
 
-from Acquisition import aq_base, aq_parent
+from Acquisition import aq_base, aq_parent, aq_inner
 from AccessControl import ClassSecurityInfo
 from OFS.SimpleItem import SimpleItem
 from OFS.ObjectManager import ObjectManager
@@ -290,6 +295,10 @@ class ReferenceCatalog(UniqueObject, UIDResolver, ZCatalog):
     manage_catalogFind = DTMLFile('catalogFind', _catalog_dtml)
     manage_options = ZCatalog.manage_options
 
+    # Created by the Archetypes profile or rebuildAdjacency, see
+    # _getAdjacency for catalogs that don't have one yet
+    _adjacency = None
+
     def __init__(self, id, title='', vocab_id=None, container=None):
         """We hook up the brains now"""
         ZCatalog.__init__(self, id, title, vocab_id, container)
@@ -348,13 +357,87 @@ class ReferenceCatalog(UniqueObject, UIDResolver, ZCatalog):
         if objects:
             self._deleteReference(objects[0])
 
-    def deleteReferences(self, object, relationship=None):
-        # delete all the references held by an object
-        for b in self.getReferences(object, relationship):
-            self._deleteReference(b)
+    def addReferences(self, source, targets, relationship=None,
+                      referenceClass=None, updateReferences=True, **kwargs):
+        """Add references from source to all targets at once.
+
+        Works like addReference, but the target UIDs are resolved in one
+        pass and the existing references of source are looked up once.
+        Returns the list of added reference objects.
+        """
+        sID, sobj = self._uidFor(source)
+        if not sID or sobj is None:
+            raise ReferenceException('Invalid source UID')
+        resolved = self._uidsFor(targets)
+        # Check all targets before changing anything
+        for tID, tobj in resolved:
+            if not tID or tobj is None:
+                raise ReferenceException('Invalid target UID')
+
+        existing = {}
+        if updateReferences:
+            for brain in self._optimizedQuery(sID, 'sourceUID', relationship):
+                existing.setdefault(brain.targetUID, []).append(brain.UID)
+
+        if not referenceClass:
+            referenceClass = Reference
+        annotation = sobj._getReferenceAnnotations()
+        added = []
+        done = set()
+        for tID, tobj in resolved:
+            if updateReferences:
+                if tID in done:
+                    continue
+                done.add(tID)
+            # We want to update the existing references
+            for rID in existing.pop(tID, ()):
+                annotation._delObject(rID)
+
+            rID = self._makeName(sID, tID)
+            referenceObject = referenceClass(rID, sID, tID, relationship,
+                                             **kwargs)
+            referenceObject = referenceObject.__of__(annotation)
+            try:
+                referenceObject.addHook(self, sobj, tobj)
+            except ReferenceException:
+                continue
+            # This should call manage_afterAdd
+            annotation._setObject(rID, referenceObject)
+            added.append(referenceObject)
+        return added
+
+    def deleteReferences(self, object, relationship=None, targets=None):
+        """Delete references held by object.
+
+        Without targets all references from and to object are deleted.
+        Otherwise only the references from object to the given targets
+        are, in one pass: the targets are resolved at once and the
+        references of object are looked up once.
+        """
+        if targets is None:
+            for b in self.getReferences(object, relationship):
+                self._deleteReference(b)
+
+            for b in self.getBackReferences(object, relationship):
+                self._deleteReference(b)
+            return
 
-        for b in self.getBackReferences(object, relationship):
-            self._deleteReference(b)
+        sID, sobj = self._uidFor(object)
+        if not sID or sobj is None:
+            return
+        resolved = dict(self._uidsFor(targets))
+        annotation = sobj._getReferenceAnnotations()
+        for brain in self._optimizedQuery(sID, 'sourceUID', relationship):
+            if brain.targetUID not in resolved:
+                continue
+            ref = annotation._getOb(brain.UID, None)
+            if ref is None:
+                continue
+            try:
+                ref.delHook(self, sobj, resolved[brain.targetUID])
+            except ReferenceException:
+                continue
+            annotation._delObject(brain.UID)
 
     def getReferences(self, object, relationship=None, targetObject=None,
                       objects=True):
@@ -429,36 +512,86 @@ class ReferenceCatalog(UniqueObject, UIDResolver, ZCatalog):
         return LazyMap(_catalog.__getitem__,
                        list(result_rids), len(result_rids))
 
-    def hasRelationshipTo(self, source, target, relationship):
+    def getTargetUIDs(self, object, relationship=None):
+        """Return the UIDs of the objects referenced by object.
+
+        Answered from the adjacency index, if the catalog has one, without
+        creating brains.
+        """
+        sID, sobj = self._uidFor(object)
+        if not sID:
+            return []
+        return self._getAdjacency().targets(sID, relationship)
+
+    def getSourceUIDs(self, object, relationship=None):
+        """Return the UIDs of the objects referring to object.
+        """
+        tID, tobj = self._uidFor(object)
+        if not tID:
+            return []
+        return self._getAdjacency().sources(tID, relationship)
+
+    def traverseReferences(self, object, relationship=None, depth=None,
+                           backwards=False, depth_first=False,
+                           objects=False):
+        """Return everything reachable from object through references.
+
+        Follows references with the given relationship(s) (all if None),
+        or back references if backwards is true, at most depth hops away.
+        The graph is walked on UIDs only, breadth first unless depth_first
+        is given; every object is returned once, object itself is not.
+
+        Returns a list of UIDs, or a lazy sequence resolving them to
+        objects when objects is true.
+        """
+        uid, obj = self._uidFor(object)
+        if not uid:
+            return []
+        steps = self._getAdjacency().traverse(uid, relationship, depth,
+                                              backwards, depth_first)
+        uids = [other for other, distance in steps]
+        if objects:
+            return LazyMap(self._objectByUUID, uids, len(uids))
+        return uids
+
+    def findReferencePath(self, source, target, relationship=None,
+                          depth=None, backwards=False, objects=False):
+        """Return the shortest chain of references from source to target.
+
+        The result starts with source and ends with target, as UIDs or, if
+        objects is true, as a lazy sequence of objects. Returns None if
+        there is no such chain of at most depth references.
+        """
         sID, sobj = self._uidFor(source)
         tID, tobj = self._uidFor(target)
+        if not sID or not tID:
+            return None
+        uids = self._getAdjacency().shortestPath(sID, tID, relationship,
+                                                 depth, backwards)
+        if uids is not None and objects:
+            return LazyMap(self._objectByUUID, uids, len(uids))
+        return uids
 
-        brains = self._queryFor(sID, tID, relationship)
-        for brain in brains:
-            obj = brain.getObject()
-            if obj is not None:
-                return True
-        return False
+    def hasRelationshipTo(self, source, target, relationship):
+        sID, sobj = self._uidFor(source)
+        tID, tobj = self._uidFor(target)
+        if not sID or not tID:
+            return False
+        return self._getAdjacency().hasRelationship(sID, tID, relationship)
 
     def getRelationships(self, object):
         # Get all relationship types this object has TO other objects
         sID, sobj = self._uidFor(object)
-        brains = self._queryFor(sid=sID)
-        res = {}
-        for brain in brains:
-            res[brain.relationship] = 1
-
-        return res.keys()
+        if not sID:
+            return []
+        return self._getAdjacency().relationships(sID)
 
     def getBackRelationships(self, object):
         # Get all relationship types this object has FROM other objects
         sID, sobj = self._uidFor(object)
-        brains = self._queryFor(tid=sID)
-        res = {}
-        for b in brains:
-            res[b.relationship]=1
-
-        return res.keys()
+        if not sID:
+            return []
+        return self._getAdjacency().backRelationships(sID)
 
 
     def isReferenceable(self, object):
@@ -545,6 +678,28 @@ class ReferenceCatalog(UniqueObject, UIDResolver, ZCatalog):
                     obj = res
         return uuid, obj
 
+    def _uidsFor(self, objs):
+        """Bulk version of _uidFor, returns a list of (uid, object).
+
+        UIDs are resolved with uid_catalog.resolveUIDs in one pass.
+        """
+        result = []
+        lookup = []
+        for obj in objs:
+            if isinstance(obj, basestring):
+                result.append([obj, None])
+                lookup.append(obj)
+            else:
+                result.append(list(self._uidFor(obj)))
+
+        if lookup:
+            uc = getToolByName(self, UID_CATALOG)
+            resolved = uc.resolveUIDs(lookup)
+            for item in result:
+                if item[1] is None:
+                    item[1] = resolved.get(item[0])
+        return [tuple(item) for item in result]
+
     def _getUUIDFor(self, object):
         """generate and attach a new uid to the object returning it"""
         uuid = make_uuid(object.getId())
@@ -581,6 +736,62 @@ class ReferenceCatalog(UniqueObject, UIDResolver, ZCatalog):
     def __nonzero__(self):
         return 1
 
+    ###
+    ## Adjacency index
+
+    def catalog_object(self, obj, uid=None, **kwargs):
+        UIDResolver.catalog_object(self, obj, uid, **kwargs)
+        adjacency = self._adjacency
+        if adjacency is not None:
+            base = aq_base(obj)
+            adjacency.add(self._relativePath(obj),
+                          getattr(base, 'sourceUID', None),
+                          getattr(base, 'targetUID', None),
+                          getattr(base, 'relationship', None))
+
+    def uncatalog_object(self, uid):
+        ZCatalog.uncatalog_object(self, uid)
+        adjacency = self._adjacency
+        if adjacency is not None:
+            adjacency.remove(uid)
+
+    def manage_catalogClear(self, *args, **kw):
+        """Clear the catalog and the adjacency index
+        """
+        result = ZCatalog.manage_catalogClear(self, *args, **kw)
+        self._adjacency = AdjacencyIndex()
+        return result
+
+    def _getAdjacency(self):
+        """Return the adjacency index.
+
+        Catalogs without one, until the upgrade step or rebuildAdjacency
+        has run, are queried the old way. The index is never built here.
+        """
+        adjacency = self._adjacency
+        if adjacency is None:
+            return CatalogAdjacency(self)
+        return adjacency
+
+    security.declareProtected(permissions.ManagePortal, 'rebuildAdjacency')
+    def rebuildAdjacency(self):
+        """Rebuild the adjacency index from the catalog indexes.
+        """
+        return len(self._buildAdjacency())
+
+    def _buildAdjacency(self):
+        adjacency = AdjacencyIndex()
+        _catalog = self._catalog
+        indexes = _catalog.indexes
+        sources = indexes['sourceUID']._unindex
+        targets = indexes['targetUID']._unindex
+        relationships = indexes['relationship']._unindex
+        for rid, path in _catalog.paths.items():
+            adjacency.add(path, sources.get(rid), targets.get(rid),
+                          relationships.get(rid))
+        self._adjacency = adjacency
+        return adjacency
+
     def _catalogReferencesFor(self,obj,path):
         if IReferenceable.providedBy(obj):
             obj._catalogRefs(self)
@@ -601,6 +812,111 @@ class ReferenceCatalog(UniqueObject, UIDResolver, ZCatalog):
 
 
 
+    security.declareProtected(permissions.ManagePortal, 'rebuildReferences')
+    def rebuildReferences(self, batch_size=1000, clear=False, walk_site=False,
+                          out=None):
+        """Rebuild the catalog from the reference annotations of objects.
+
+        Only objects carrying reference annotations are visited. They are
+        found in the uid_catalog, which also catalogs the references, so
+        the uid_catalog has to be up to date; pass walk_site=True to find
+        them by walking the whole site instead.
+
+        Unless clear is given the catalog is updated in place: sources
+        whose references already match the catalog are skipped, stale
+        entries, i.e. those not found on any visited source, are removed. A
+        savepoint is made every batch_size cataloged references.
+
+        Returns a tuple of (cataloged references, skipped sources).
+        """
+        uc = getToolByName(self, UID_CATALOG)
+        portal = aq_parent(aq_inner(self))
+        if clear:
+            self.manage_catalogClear()
+
+        if walk_site:
+            hasRefs = lambda obj: getattr(aq_base(obj), REFERENCE_ANNOTATION,
+                                          None)
+            sources = (obj for path, obj in walk(portal, predicate=hasRefs))
+        else:
+            sources = self._referenceSources(uc, portal)
+
+        stats = {'count': 0, 'skipped': 0}
+        found = set()
+        for source in sources:
+            self._rebuildSourceReferences(source, uc, stats, batch_size,
+                                          check=not clear, found=found)
+
+        if not clear:
+            # Remove references whose source is gone
+            stale = [path for path in self._catalog.uids.keys()
+                     if path not in found]
+            for path in stale:
+                self.uncatalog_object(path)
+
+        msg = ('%s: %d references cataloged, %d sources skipped'
+               % (self.getId(), stats['count'], stats['skipped']))
+        log(msg)
+        if out is not None:
+            print >> out, msg
+        return stats['count'], stats['skipped']
+
+    def _referenceSources(self, uc, portal):
+        """Yield the objects holding references according to uid_catalog.
+
+        Reference paths look like 'source/at_references/refid', so the
+        paths of one source are adjacent in the sorted uids BTree.
+        """
+        marker = '/%s/' % REFERENCE_ANNOTATION
+        last = None
+        for path in uc._catalog.uids.keys():
+            pos = path.find(marker)
+            if pos == -1:
+                continue
+            source_path = path[:pos]
+            if source_path == last:
+                continue
+            last = source_path
+            source = portal.unrestrictedTraverse(source_path, None)
+            if source is not None:
+                yield source
+
+    def _rebuildSourceReferences(self, source, uc, stats, batch_size,
+                                 check=True, found=None):
+        annotations = getattr(aq_base(source), REFERENCE_ANNOTATION, None)
+        if not annotations:
+            return
+        refs = {}
+        for ref in source._getReferenceAnnotations().objectValues():
+            refs[getRelURL(uc, ref.getPhysicalPath())] = ref
+        if found is not None:
+            found.update(refs.keys())
+
+        if check:
+            uid = IUUID(source, None)
+            rids = ()
+            if uid is not None:
+                rids = self._catalog.indexes['sourceUID']._index.get(uid, ())
+            if isinstance(rids, int):
+                rids = (rids, )
+            cataloged = set([self._catalog.paths[rid] for rid in rids])
+            if cataloged == set(refs.keys()):
+                stats['skipped'] += 1
+                refs = {}
+            else:
+                for path in cataloged.difference(refs.keys()):
+                    self.uncatalog_object(path)
+
+        for path, ref in refs.items():
+            self.catalog_object(ref, path)
+            stats['count'] += 1
+            if not stats['count'] % batch_size:
+                transaction.savepoint(optimistic=True)
+
+        # References may carry references themselves
+        for ref in source._getReferenceAnnotations().objectValues():
+            self._rebuildSourceReferences(ref, uc, stats, batch_size, check)
+
     security.declareProtected(permissions.ManagePortal, 'manage_catalogFoundItems')
     def manage_catalogFoundItems(self, REQUEST, RESPONSE, URL2, URL1,
                                  obj_metatypes=None,
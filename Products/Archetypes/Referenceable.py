@@ -3,6 +3,7 @@ from zope.interface import implements
 from plone.uuid.interfaces import IUUID
 
 from Products.Archetypes import config
+from Products.Archetypes import uidcache
 from Products.Archetypes.exceptions import ReferenceException
 from Products.Archetypes.interfaces import IReferenceable
 from Products.Archetypes.utils import shasattr, isFactoryContained
@@ -74,11 +75,14 @@ class Referenceable(CopySource):
     def getRefs(self, relationship=None, targetObject=None):
         # get all the referenced objects for this object
         tool = getToolByName(self, 'reference_catalog')
-        brains = tool.getReferences(self, relationship, targetObject=targetObject,
-                                    objects=False)
-        if brains:
-            return [self._optimizedGetObject(b.targetUID) for b in brains]
-        return []
+        if targetObject is None:
+            uids = tool.getTargetUIDs(self, relationship)
+        else:
+            brains = tool.getReferences(self, relationship,
+                                        targetObject=targetObject,
+                                        objects=False)
+            uids = [b.targetUID for b in brains]
+        return self._optimizedGetObjects(uids)
 
     def _getURL(self):
         # the url used as the relative path based uid in the catalogs
@@ -87,11 +91,14 @@ class Referenceable(CopySource):
     def getBRefs(self, relationship=None, targetObject=None):
         # get all the back referenced objects for this object
         tool = getToolByName(self, 'reference_catalog')
-        brains = tool.getBackReferences(self, relationship,
-                                        targetObject=targetObject, objects=False)
-        if brains:
-            return [self._optimizedGetObject(b.sourceUID) for b in brains]
-        return []
+        if targetObject is None:
+            uids = tool.getSourceUIDs(self, relationship)
+        else:
+            brains = tool.getBackReferences(self, relationship,
+                                            targetObject=targetObject,
+                                            objects=False)
+            uids = [b.sourceUID for b in brains]
+        return self._optimizedGetObjects(uids)
 
     #aliases
     getReferences=getRefs
@@ -113,23 +120,21 @@ class Referenceable(CopySource):
             return refs
         return []
 
+    def _optimizedGetObjects(self, uids):
+        # resolve uids in one pass, keeping their order
+        if not uids:
+            return []
+        tool = getToolByName(self, 'uid_catalog', None)
+        if tool is None: # pragma: no cover
+            return ['' for uid in uids]
+        objects = tool.resolveUIDs(uids)
+        return [objects[uid] for uid in uids]
+
     def _optimizedGetObject(self, uid):
         tool = getToolByName(self, 'uid_catalog', None)
         if tool is None: # pragma: no cover
             return ''
-        tool = aq_inner(tool)
-        traverse = aq_parent(tool).unrestrictedTraverse
-
-        _catalog = tool._catalog
-        rids = _catalog.indexes['UID']._index.get(uid, ())
-        if isinstance(rids, int):
-            rids = (rids, )
-
-        for rid in rids:
-            path = _catalog.paths[rid]
-            obj = traverse(path, default=None)
-            if obj is not None:
-                return obj
+        return uidcache.resolveUID(tool, uid)
 
     def _register(self, reference_manager=None):
         # register with the archetype tool for a unique id
@@ -168,6 +173,7 @@ class Referenceable(CopySource):
         if old_uid is None:
             # Nothing to be done.
             return
+        uidcache.invalidate(old_uid)
         # Update forward references
         fw_refs = self.getReferenceImpl()
         for ref in fw_refs:
@@ -313,6 +319,7 @@ class Referenceable(CopySource):
             uc = getToolByName(aq, config.UID_CATALOG)
         url = self._getURL()
         uc.catalog_object(self, url)
+        uidcache.invalidate(IUUID(self, None))
 
     def _uncatalogUID(self, aq, uc=None):
         if isFactoryContained(self):
@@ -326,6 +333,7 @@ class Referenceable(CopySource):
         rid = uc.getrid(url)
         if rid is not None:
             uc.uncatalog_object(url)
+        uidcache.invalidate(IUUID(self, None))
 
     def _catalogRefs(self, aq, uc=None, rc=None):
         annotations = self._getReferenceAnnotations()
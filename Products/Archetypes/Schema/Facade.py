@@ -1,6 +1,7 @@
 __metaclass__ = type
 
 from Products.Archetypes.Schema import BasicSchema
+from Products.Archetypes.Schema.compiled import CompiledSchema
 from Products.Archetypes.Field import *
 from Products.Archetypes.interfaces.schema import IBindableSchema
 from Products.Archetypes.Storage.Facade import FacadeMetadataStorage
@@ -119,6 +120,10 @@ class FacadeMetadataSchema(BasicSchema):
     def bind(self, context):
         self.context = context
 
+    def compiled(self):
+        # The fields are computed on every access, don't keep them
+        return CompiledSchema(self)
+
     security.declareProtected(View, 'validate')
     def validate(self, instance=None, REQUEST=None,
                  errors=None, data=None, metadata=None):
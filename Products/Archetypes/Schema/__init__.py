@@ -1,7 +1,9 @@
+from hashlib import md5
 from types import ListType, TupleType, StringType
 from warnings import warn
 
 from Products.Archetypes.Storage import MetadataStorage
+from Products.Archetypes.Schema.compiled import CompiledSchema
 from Products.Archetypes.Layer import DefaultLayerContainer
 from Products.Archetypes.interfaces.field import IField
 from Products.Archetypes.interfaces.layer import ILayerContainer, \
@@ -52,12 +54,16 @@ class Schemata(Base):
 
     implements(ISchemata)
 
+    # CompiledSchema of the current fields, see compiled()
+    _v_compiled = None
+
     def __init__(self, name='default', fields=None):
         """Initialize Schemata and add optional fields."""
 
         self.__name__ = name
         self._names = []
         self._fields = {}
+        self._invalidateCompiled()
 
         if fields is not None:
             if type(fields) not in [ListType, TupleType]:
@@ -66,11 +72,29 @@ class Schemata(Base):
             for field in fields:
                 self.addField(field)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_v_compiled', None)
+        return state
+
     security.declareProtected(permissions.View, 'getName')
     def getName(self):
         """Returns the Schemata's name."""
         return self.__name__
 
+    security.declarePrivate('compiled')
+    def compiled(self):
+        """Returns the CompiledSchema of my current fields."""
+        compiled = self._v_compiled
+        if compiled is None or not compiled.isCurrent():
+            compiled = self._v_compiled = CompiledSchema(self)
+        return compiled
+
+    security.declarePrivate('_invalidateCompiled')
+    def _invalidateCompiled(self):
+        """Drop the compiled view, to be called after any change."""
+        self._v_compiled = None
+
 
     def __add__(self, other):
         """Returns a new Schemata object that contains all fields and layers
@@ -99,7 +123,7 @@ class Schemata(Base):
     security.declareProtected(permissions.View, 'fields')
     def fields(self):
         """Returns a list of my fields in order of their indices."""
-        return [self._fields[name] for name in self._names]
+        return list(self.compiled().fields)
 
 
     security.declareProtected(permissions.View, 'values')
@@ -152,6 +176,8 @@ class Schemata(Base):
         A field must have the attribute ``attr`` and field.attr must be equal
         to value ``val`` for it to be in the returned list.
         """
+        if not predicates:
+            return list(self.compiled().filter(**values))
 
         results = []
 
@@ -189,6 +215,7 @@ class Schemata(Base):
         if name not in self._names:
             self._names.append(name)
         self._fields[name] = field
+        self._invalidateCompiled()
 
     def _validateOnAdd(self, field):
         """Validates fields on adding and bootstrapping
@@ -232,6 +259,7 @@ class Schemata(Base):
             raise KeyError("Schemata has no field '%s'" % name)
         del self._fields[name]
         self._names.remove(name)
+        self._invalidateCompiled()
 
     def __getitem__(self, name):
         return self._fields[name]
@@ -261,15 +289,11 @@ class Schemata(Base):
     security.declareProtected(permissions.View, 'searchable')
     def searchable(self):
         """Returns a list containing names of all searchable fields."""
-
-        return [f.getName() for f in self.fields() if f.searchable]
+        return list(self.compiled().searchable())
 
     def hasPrimary(self):
         """Returns the first primary field or False"""
-        for f in self.fields():
-            if getattr(f, 'primary', False):
-                return f
-        return False
+        return self.compiled().primary()
 
     def _checkPropertyDupe(self, field, propname):
         check_value = getattr(field, propname, _marker)
@@ -318,13 +342,33 @@ class SchemaLayerContainer(DefaultLayerContainer):
     security.declareProtected(permissions.ModifyPortalContent,
                               'initializeLayers')
     def initializeLayers(self, instance, item=None, container=None):
+        initializedLayers = self._initializeFieldLayers(
+            instance, self.fields(), item, container)
+        called = lambda x: x in initializedLayers
+
+        # Now do the same for objects registered at this level
+        if ILayerContainer.providedBy(self):
+            for layer, obj in self.registeredLayers():
+                if (not called((layer, obj)) and
+                    ILayer.providedBy(obj)):
+                    obj.initializeInstance(instance, item, container)
+                    initializedLayers.append((layer, obj))
+
+
+    security.declarePrivate('_initializeFieldLayers')
+    def _initializeFieldLayers(self, instance, fields, item=None,
+                               container=None):
+        """Initializes the layers of the given fields only.
+
+        Returns the list of (name, layer) that were initialized.
+        """
         # scan each field looking for registered layers optionally
         # call its initializeInstance method and then the
         # initializeField method
         initializedLayers = []
         called = lambda x: x in initializedLayers
 
-        for field in self.fields():
+        for field in fields:
             if ILayerContainer.providedBy(field):
                 layers = field.registeredLayers()
                 for layer, obj in layers:
@@ -336,15 +380,7 @@ class SchemaLayerContainer(DefaultLayerContainer):
                             # need to be initialized
                             initializedLayers.append((layer, obj))
                         obj.initializeField(instance, field)
-
-        # Now do the same for objects registered at this level
-        if ILayerContainer.providedBy(self):
-            for layer, obj in self.registeredLayers():
-                if (not called((layer, obj)) and
-                    ILayer.providedBy(obj)):
-                    obj.initializeInstance(instance, item, container)
-                    initializedLayers.append((layer, obj))
-
+        return initializedLayers
 
     security.declareProtected(permissions.ModifyPortalContent,
                               'cleanupLayers')
@@ -477,28 +513,35 @@ class BasicSchema(Schemata):
         """
         ## TODO think about layout/vs dyn defaults
         for field in self.values():
-            if field.getName().lower() == 'id': continue
-            if field.type == "reference": continue
-
-            # always set defaults on writable fields
-            mutator = field.getMutator(instance)
-            if mutator is None:
-                continue
-            default = field.getDefault(instance)
-
-            args = (default,)
-            kw = {'field': field.__name__,
-                  '_initializing_': True}
-            if shasattr(field, 'default_content_type'):
-                # specify a mimetype if the mutator takes a
-                # mimetype argument
-                # if the schema supplies a default, we honour that,
-                # otherwise we use the site property
-                default_content_type = field.default_content_type
-                if default_content_type is None:
-                    default_content_type = getDefaultContentType(instance)
-                kw['mimetype'] = default_content_type
-            mapply(mutator, *args, **kw)
+            self._setFieldDefault(instance, field)
+
+    security.declarePrivate('_setFieldDefault')
+    def _setFieldDefault(self, instance, field):
+        """Sets a single field of instance to its default."""
+        if field.getName().lower() == 'id':
+            return
+        if field.type == "reference":
+            return
+
+        # always set defaults on writable fields
+        mutator = field.getMutator(instance)
+        if mutator is None:
+            return
+        default = field.getDefault(instance)
+
+        args = (default,)
+        kw = {'field': field.__name__,
+              '_initializing_': True}
+        if shasattr(field, 'default_content_type'):
+            # specify a mimetype if the mutator takes a
+            # mimetype argument
+            # if the schema supplies a default, we honour that,
+            # otherwise we use the site property
+            default_content_type = field.default_content_type
+            if default_content_type is None:
+                default_content_type = getDefaultContentType(instance)
+            kw['mimetype'] = default_content_type
+        mapply(mutator, *args, **kw)
 
     security.declareProtected(permissions.ModifyPortalContent,
                               'updateAll')
@@ -617,23 +660,32 @@ class BasicSchema(Schemata):
     # determining whether a schema has changed in the auto update
     # function.  Right now it's pretty crude.
     # TODO FIXME!
+    #
+    # Both are computed once per compiled view of the schema, which is
+    # replaced when a field changes.
     security.declareProtected(permissions.View,
                               'toString')
     def toString(self):
-        s = '%s: {' % self.__class__.__name__
-        for f in self.fields():
-            s = s + '%s,' % (f.toString())
-        s = s + '}'
-        return s
+        return self.compiled().memo('toString', self._toString)
+
+    def _toString(self):
+        parts = ['%s,' % f.toString() for f in self.compiled().fields]
+        return '%s: {%s}' % (self.__class__.__name__, ''.join(parts))
 
     security.declareProtected(permissions.View,
                               'signature')
     def signature(self):
-        try:
-            from hashlib import md5
-        except:
-            from md5 import md5
-        return md5(self.toString()).digest()
+        return self.compiled().memo('signature',
+                                    lambda: md5(self.toString()).digest())
+
+    security.declareProtected(permissions.View,
+                              'structureSignature')
+    def structureSignature(self):
+        """Returns a hash of the field names, classes, storages and
+        schematas. Cheaper than signature(), but blind to changes of other
+        field properties.
+        """
+        return self.compiled().structure()
 
     security.declareProtected(permissions.ModifyPortalContent,
                               'changeSchemataForField')
@@ -647,18 +699,14 @@ class BasicSchema(Schemata):
     security.declareProtected(permissions.View, 'getSchemataNames')
     def getSchemataNames(self):
         """Return list of schemata names in order of appearing"""
-        lst = []
-        for f in self.fields():
-            if not f.schemata in lst:
-                lst.append(f.schemata)
-        return lst
+        return list(self.compiled().schemataNames())
 
     security.declareProtected(permissions.View, 'getSchemataFields')
     def getSchemataFields(self, name):
         """Return list of fields belong to schema 'name'
         in order of appearing
         """
-        return [f for f in self.fields() if f.schemata == name]
+        return list(self.compiled().bySchemata().get(name, ()))
 
     security.declareProtected(permissions.ModifyPortalContent,
                               'replaceField')
@@ -669,6 +717,7 @@ class BasicSchema(Schemata):
             self._names[oidx] = new_name
             del self._fields[name]
             self._fields[new_name] = field
+            self._invalidateCompiled()
         else:
             raise ValueError, "Object doesn't implement IField: %r" % field
 
@@ -852,6 +901,7 @@ class Schema(BasicSchema, SchemaLayerContainer):
         else:
            keys.insert(pos - 1, name)
         self._names = keys
+        self._invalidateCompiled()
 
     def _moveFieldInSchemata(self, name, direction):
         """Moves a field with the name 'name' inside its schemata
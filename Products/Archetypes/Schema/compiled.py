@@ -0,0 +1,205 @@
+"""Precomputed, read-only views of a schema.
+
+Schemas are asked for the same subsets of their fields over and over: the
+searchable fields when indexing, the (non-)metadata fields when
+validating and processing forms, the reference fields whenever an object
+is added. ``CompiledSchema`` takes a snapshot of the fields of a schema and
+computes these groupings once, the first time they are needed.
+
+A schema keeps its compiled view until one of its mutators (addField,
+delField, replaceField, moveField, ...) is called or one of its fields
+changes. Setting an attribute of a field stamps it with a new number from
+the process wide counter of field changes (``fieldChanged``); a compiled
+view remembers the counter it was built at and is current as long as no
+field of it carries a newer stamp. While no field changes at all, which is
+the normal case after startup, this check is a single comparison.
+"""
+
+from hashlib import md5
+
+from Products.Archetypes.utils import shasattr
+
+_marker = []
+
+# Number of field attribute changes in this process, see fieldChanged
+_field_changes = 0
+
+
+def fieldChanged():
+    """Count a change of a field attribute and return the new count.
+
+    Called by Field.__setattr__, the result is the field's new version.
+    """
+    global _field_changes
+    _field_changes += 1
+    return _field_changes
+
+
+class CompiledSchema(object):
+    """Frozen groupings of the fields of a schema.
+    """
+
+    def __init__(self, schema):
+        self.changes = _field_changes
+        fields = schema._fields
+        self.names = tuple(schema._names)
+        self.fields = tuple([fields[name] for name in self.names])
+        self._groups = {}
+        self._filters = {}
+
+    def isCurrent(self):
+        """Whether none of the fields changed since the snapshot."""
+        changes = _field_changes
+        if changes == self.changes:
+            return True
+        for f in self.fields:
+            if getattr(f, '_version', 0) > self.changes:
+                return False
+        # Other fields changed, no need to look at ours again until then
+        self.changes = changes
+        return True
+
+    def memo(self, key, compute):
+        """Return compute(), computed once for this snapshot."""
+        result = self._groups.get(key, _marker)
+        if result is _marker:
+            result = self._groups[key] = compute()
+        return result
+
+    def searchable(self):
+        """Names of the searchable fields."""
+        return self.memo('searchable', lambda: tuple(
+            [f.getName() for f in self.fields if f.searchable]))
+
+    def dataFields(self):
+        """Fields that are not metadata."""
+        return self.filter(isMetadata=0)
+
+    def metadataFields(self):
+        return self.filter(isMetadata=1)
+
+    def primary(self):
+        """The first primary field or False."""
+        def compute():
+            for f in self.fields:
+                if getattr(f, 'primary', False):
+                    return f
+            return False
+        return self.memo('primary', compute)
+
+    def byType(self):
+        """Mapping of field type to fields."""
+        def compute():
+            result = {}
+            for f in self.fields:
+                result.setdefault(f.type, []).append(f)
+            return dict([(k, tuple(v)) for k, v in result.items()])
+        return self.memo('type', compute)
+
+    def byStorage(self):
+        """Mapping of storage class to fields."""
+        def compute():
+            result = {}
+            for f in self.fields:
+                klass = getattr(f, 'storage', None).__class__
+                result.setdefault(klass, []).append(f)
+            return dict([(k, tuple(v)) for k, v in result.items()])
+        return self.memo('storage', compute)
+
+    def schemataNames(self):
+        """Names of the schematas in order of appearance."""
+        def compute():
+            names = []
+            for f in self.fields:
+                if f.schemata not in names:
+                    names.append(f.schemata)
+            return tuple(names)
+        return self.memo('schematanames', compute)
+
+    def bySchemata(self):
+        """Mapping of schemata name to fields."""
+        def compute():
+            result = {}
+            for f in self.fields:
+                result.setdefault(f.schemata, []).append(f)
+            return dict([(k, tuple(v)) for k, v in result.items()])
+        return self.memo('schemata', compute)
+
+    def structure(self):
+        """A hash of the names, classes, storages and schematas of the
+        fields.
+
+        Much cheaper than the schema signature, which covers all field
+        properties, but blind to changes of any other property.
+        """
+        def compute():
+            parts = []
+            for f in self.fields:
+                klass = f.__class__
+                storage = getattr(f, 'storage', None).__class__
+                parts.append('%s:%s.%s:%s.%s:%s' % (
+                    f.getName(), klass.__module__, klass.__name__,
+                    storage.__module__, storage.__name__, f.schemata))
+            return md5('\n'.join(parts)).hexdigest()
+        return self.memo('structure', compute)
+
+    def fieldSignatures(self):
+        """Mapping of field name to (field class, storage class).
+
+        Recorded by the archetype tool for every schema version, so that a
+        schema update can find out which fields actually changed (see
+        ``diffFieldSignatures``).
+        """
+        def compute():
+            result = {}
+            for f in self.fields:
+                result[f.getName()] = (_dotted(f.__class__),
+                    _dotted(getattr(f, 'storage', None).__class__))
+            return result
+        return self.memo('fieldsignatures', compute)
+
+    def filter(self, **values):
+        """Fields having all the given attribute values.
+
+        Works like Schemata.filterFields without predicates. Results are
+        cached per set of values, unless a value is unhashable.
+        """
+        try:
+            key = tuple(sorted(values.items()))
+            result = self._filters.get(key, _marker)
+        except TypeError:
+            return self._filter(values)
+        if result is _marker:
+            result = self._filters[key] = self._filter(values)
+        return result
+
+    def _filter(self, values):
+        results = []
+        for field in self.fields:
+            for attr, value in values.items():
+                if not shasattr(field, attr) or \
+                   getattr(field, attr) != value:
+                    break
+            else:
+                results.append(field)
+        return tuple(results)
+
+
+def _dotted(klass):
+    return '%s.%s' % (klass.__module__, klass.__name__)
+
+
+def diffFieldSignatures(old, new):
+    """Compare two results of ``CompiledSchema.fieldSignatures``.
+
+    Returns the sorted lists ``(added, removed, changed)`` of field names,
+    where changed fields have a different field class or storage.
+    """
+    added = [name for name in new if name not in old]
+    removed = [name for name in old if name not in new]
+    changed = [name for name in new
+               if name in old and old[name] != new[name]]
+    added.sort()
+    removed.sort()
+    changed.sort()
+    return added, removed, changed
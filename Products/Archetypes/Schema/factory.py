@@ -1,6 +1,15 @@
+import threading
+
+import transaction
+from Acquisition import aq_base
+from Products.Archetypes import config
 from Products.Archetypes.interfaces import ISchema, IBaseObject
 from zope.component import adapter
+from zope.component import getSiteManager
 from zope.interface import implementer
+from zope.interface import providedBy
+
+_local = threading.local()
 
 @implementer(ISchema)
 @adapter(IBaseObject)
@@ -44,6 +53,41 @@ def instanceSchemaFactory(context):
     return context.schema
 
 
+def lookupSchema(context):
+    """Return ISchema(context), taking shortcuts where possible.
+
+    If the default instanceSchemaFactory is the adapter for context, the
+    schema attribute is returned without calling the adapter. Schemas of
+    other adapters, e.g. schema extenders, are cached for the current
+    transaction (which in Zope is the current request) if
+    config.CACHE_ADAPTED_SCHEMAS is set. The cache is keyed by the object,
+    the interfaces it provides and the generation of the adapter registry,
+    so marker interfaces and new registrations are honoured, but changes
+    of the object or the request are not: adapters whose fields depend on
+    them must not be cached, which is why the cache is off by default.
+    """
+    registry = getSiteManager().adapters
+    spec = providedBy(context)
+    factory = registry.lookup((spec, ), ISchema, '')
+    if factory is instanceSchemaFactory:
+        return context.schema
+    if factory is None or not config.CACHE_ADAPTED_SCHEMAS:
+        return ISchema(context)
 
+    base = aq_base(context)
+    key = (id(base), spec, getattr(registry, '_generation', None))
+    schemas = _schemas()
+    entry = schemas.get(key)
+    if entry is not None and entry[0] is base:
+        return entry[1]
+    schema = ISchema(context)
+    schemas[key] = (base, schema)
+    return schema
 
 
+def _schemas():
+    txn = transaction.get()
+    if getattr(_local, 'txn', None) is not txn:
+        _local.txn = txn
+        _local.schemas = {}
+    return _local.schemas
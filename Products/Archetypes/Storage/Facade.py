@@ -1,5 +1,6 @@
 from Products.CMFCore.utils import getToolByName
 from Products.Archetypes.Storage import StorageLayer
+from Products.Archetypes.Storage import forgetSize
 from Products.Archetypes.interfaces.storage import IStorage
 from Products.Archetypes.interfaces.layer import ILayer
 from Products.Archetypes.Field import encode
@@ -52,6 +53,7 @@ class FacadeMetadataStorage(StorageLayer):
         # validation, which prevents us from setting
         # values.
         mdata._setData(data, set_id=self.metadata_set)
+        forgetSize(name, instance)
 
     security.declarePrivate('unset')
     def unset(self, name, instance, **kwargs):
@@ -18,6 +18,15 @@ type_map = {'text':'string',
 
 _marker = []
 
+def forgetSize(name, instance):
+    """Drop the size recorded on instance for the value stored under
+    name, see BaseObject.get_size. Storages call this when they store or
+    remove a value, the field records the new size afterwards.
+    """
+    setFieldSize = getattr(aq_base(instance), '_setFieldSize', None)
+    if setFieldSize is not None:
+        setFieldSize(name, None)
+
 #XXX subclass from Base?
 class Storage:
     """Basic, abstract class for Storages. You need to implement
@@ -100,6 +109,7 @@ class AttributeStorage(Storage):
         # Remove acquisition wrappers
         value = aq_base(value)
         setattr(aq_base(instance), name, value)
+        forgetSize(name, instance)
         instance._p_changed = 1
 
     security.declarePrivate('unset')
@@ -108,6 +118,7 @@ class AttributeStorage(Storage):
             delattr(aq_base(instance), name)
         except AttributeError:
             pass
+        forgetSize(name, instance)
         instance._p_changed = 1
 
 class ObjectManagedStorage(Storage):
@@ -132,11 +143,13 @@ class ObjectManagedStorage(Storage):
         except (AttributeError, KeyError):
             pass
         instance._setObject(name, value)
+        forgetSize(name, instance)
         instance._p_changed = 1
 
     security.declarePrivate('unset')
     def unset(self, name, instance, **kwargs):
         instance._delObject(name)
+        forgetSize(name, instance)
         instance._p_changed = 1
 
 class MetadataStorage(StorageLayer):
@@ -179,6 +192,7 @@ class MetadataStorage(StorageLayer):
 	            base._md=PersistentMapping()
 
         base._md[name] = aq_base(value)
+        forgetSize(name, instance)
         base._p_changed = 1
 
     security.declarePrivate('unset')
@@ -187,6 +201,7 @@ class MetadataStorage(StorageLayer):
             log("Broken instance %s, no _md" % instance)
         else:
             del instance._md[name]
+            forgetSize(name, instance)
             instance._p_changed = 1
 
     security.declarePrivate('cleanupField')
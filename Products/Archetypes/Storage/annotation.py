@@ -31,6 +31,7 @@ from Products.Archetypes.interfaces.layer import ILayer
 from Products.Archetypes.Storage import Storage
 from Products.Archetypes.Storage import StorageLayer
 from Products.Archetypes.Storage import _marker
+from Products.Archetypes.Storage import forgetSize
 from Products.Archetypes.annotations import AT_ANN_STORAGE
 from Products.Archetypes.annotations import AT_MD_STORAGE
 from Products.Archetypes.annotations import getAnnotation
@@ -77,6 +78,7 @@ class BaseAnnotationStorage(Storage):
         value = aq_base(value)
         ann = getAnnotation(instance)
         ann.setSubkey(self._key, value, subkey=name)
+        forgetSize(name, instance)
         if self._migrate:
             self._cleanup(name, instance, value, **kwargs)
 
@@ -87,6 +89,7 @@ class BaseAnnotationStorage(Storage):
             ann.delSubkey(self._key, subkey=name)
         except KeyError:
             pass
+        forgetSize(name, instance)
 
 setSecurity(BaseAnnotationStorage)
 
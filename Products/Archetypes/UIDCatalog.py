@@ -2,6 +2,7 @@ import logging
 import os
 import time
 import urllib
+import transaction
 from zope.interface import implements
 from zope import component
 from zope import interface
@@ -20,8 +21,12 @@ from Products.ZCatalog.CatalogBrains import AbstractCatalogBrain
 from Products import CMFCore
 from Products.CMFCore.utils import UniqueObject
 from Products.CMFCore.utils import getToolByName
+from Products.Archetypes import uidcache
 from Products.Archetypes.config import UID_CATALOG
 from Products.Archetypes.config import TOOL_NAME
+from Products.Archetypes.checkpoint import Checkpoint
+from Products.Archetypes.checkpoint import iterPartition
+from Products.Archetypes.checkpoint import processPartitions
 from Products.Archetypes.interfaces import IUIDCatalog
 from Products.Archetypes.utils import getRelURL
 from plone.indexer.interfaces import IIndexableObject
@@ -89,6 +94,15 @@ class UIDCatalogBrains(AbstractCatalogBrain):
         Thus annotation objects store the path to the source object
         """
         obj = None
+        uid = getattr(aq_base(self), 'UID', None)
+        if uid:
+            # Several records may share a UID, e.g. while an object is
+            # being copied, so the cached object must live at our path
+            obj = uidcache.cachedObject(aq_parent(self), uid)
+            if obj is not None:
+                if aq_parent(self)._relativePath(obj) == self.getPath():
+                    return obj
+                obj = None
         try:
             path = self.getPath()
             try:
@@ -105,6 +119,8 @@ class UIDCatalogBrains(AbstractCatalogBrain):
                     REQUEST = self.REQUEST
                 obj = self.aq_parent.resolve_url(self.getPath(), REQUEST)
 
+            if obj is not None and uid:
+                uidcache.cacheObject(aq_parent(self), uid, obj)
             return obj
         except (ConflictError, KeyboardInterrupt):
             raise
@@ -180,6 +196,13 @@ class UIDResolver(Base):
               relative path like storing the portal root physical path in a
               _v_ var.
         """
+        uid = self._relativePath(obj)
+        __traceback_info__ = (repr(obj), uid)
+        ZCatalog.catalog_object(self, obj, uid, **kwargs)
+
+    def _relativePath(self, obj):
+        """Return the path of obj relative to the portal root
+        """
         portal_path_len = getattr(aq_base(self), '_v_portal_path_len', None)
 
         if not portal_path_len:
@@ -190,9 +213,7 @@ class UIDResolver(Base):
             self._v_portal_path_len = portal_path_len
 
         relpath = obj.getPhysicalPath()[portal_path_len:]
-        uid = '/'.join(relpath)
-        __traceback_info__ = (repr(obj), uid)
-        ZCatalog.catalog_object(self, obj, uid, **kwargs)
+        return '/'.join(relpath)
 
 InitializeClass(UIDResolver)
 
@@ -230,6 +251,15 @@ class UIDCatalog(UniqueObject, UIDResolver, ZCatalog):
         ZCatalog.catalog_object(self, w, uid, idxs,
                                 update_metadata, pghandler=pghandler)
 
+    security.declarePrivate('resolveUIDs')
+    def resolveUIDs(self, uids):
+        """Return a dict of uid -> object (or None) for all uids.
+
+        The UID index is read in one pass and the objects are traversed
+        in path order, so shared containers are loaded only once.
+        """
+        return uidcache.resolveUIDs(self, uids)
+
     def _catalogObject(self, obj, path):
         """Catalog the object. The object will be cataloged with the absolute
            path in case we don't pass the relative url.
@@ -277,4 +307,58 @@ class UIDCatalog(UniqueObject, UIDResolver, ZCatalog):
                          % (`elapse`, `c_elapse`))
             )
 
+    security.declareProtected(CMFCore.permissions.ManagePortal, 'rebuildCatalog')
+    def rebuildCatalog(self, batch_size=1000, worker=None, restart=False,
+                       out=None, claim_timeout=None):
+        """Rebuild the catalog in batches, resumable and in parallel.
+
+        Unlike manage_rebuildCatalog this commits a transaction after every
+        batch_size objects. The site is partitioned by its top-level
+        objects and the progress is kept in a checkpoint on the catalog:
+        calling this method again after a crash resumes the rebuild, and
+        several ZEO clients may call it at the same time to share the work.
+        Pass restart=True to throw away a previous, unfinished rebuild.
+        The partition of a worker that didn't commit for claim_timeout
+        seconds (checkpoint.CLAIM_TIMEOUT by default) is taken over by the
+        next worker, so the work of a crashed worker is resumed too.
+
+        Returns the number of objects cataloged by this worker.
+        """
+        portal = aq_parent(aq_inner(self))
+        checkpoint = getattr(aq_base(self), '_rebuild_checkpoint', None)
+        if restart or checkpoint is None:
+            atool = getToolByName(self, TOOL_NAME)
+            mt = tuple([typ['meta_type']
+                        for typ in atool.listRegisteredTypes()])
+            checkpoint = Checkpoint('%s rebuild' % self.getId(),
+                                    portal.objectIds(), meta_types=mt)
+            self._rebuild_checkpoint = checkpoint
+            self.manage_catalogClear()
+            transaction.commit()
+
+        meta_types = checkpoint.options['meta_types']
+        def predicate(obj):
+            return getattr(aq_base(obj), 'meta_type', None) in meta_types
+        def items(partition, after):
+            return iterPartition(portal, partition, after, predicate)
+
+        count = processPartitions(checkpoint, items, self._catalogObject,
+                                  batch_size=batch_size, worker=worker,
+                                  out=out, claim_timeout=claim_timeout)
+        if checkpoint.isDone() and \
+           getattr(aq_base(self), '_rebuild_checkpoint', None) is checkpoint:
+            del self._rebuild_checkpoint
+            transaction.commit()
+        return count
+
+    security.declareProtected(CMFCore.permissions.ManagePortal, 'rebuildProgress')
+    def rebuildProgress(self):
+        """Return (done partitions, all partitions, cataloged objects) of a
+        running rebuild or None.
+        """
+        checkpoint = getattr(aq_base(self), '_rebuild_checkpoint', None)
+        if checkpoint is None:
+            return None
+        return checkpoint.progress()
+
 InitializeClass(UIDCatalog)
@@ -1,9 +1,6 @@
-try:
-    from hashlib import sha1 as sha
-except:
-    from sha import new as sha
-
+from Products.Archetypes import config
 from Products.Archetypes.ClassGen import ClassGenerator
+from Products.Archetypes.utils import LRUCache
 
 from AccessControl import ClassSecurityInfo
 from Acquisition import ImplicitAcquisitionWrapper
@@ -34,15 +31,17 @@ class VarClassGen(ClassGenerator):
 # do different schemas per-*instance*)
 #
 
-schemadict={}
+# Prepared schemas by (class, schema version)
+_schemas = LRUCache(config.VARIABLE_SCHEMA_CACHE_SIZE)
 
 class VariableSchemaSupport(Base):
     """
     Mixin class to support instance-based schemas
 
-    NOTE: This implementation has been found to be quite slow, because the
-    hash is expensive to calculate and does not appear to work very well as
-    a cache key.
+    Prepared schemas are kept in a bounded cache by getSchemaVersion, which
+    defaults to the signature of the schema. The signature is computed once
+    per schema object and kept until its fields change, so if getSchema
+    builds a new schema on every call, override getSchemaVersion.
 
     Attention: must be before BaseFolder or BaseContent in
     the inheritance list, e.g:
@@ -62,21 +61,28 @@ class VariableSchemaSupport(Base):
     security.declareProtected(permissions.ManagePortal, 'getAndPrepareSchema')
     def getAndPrepareSchema(self):
         s = self.getSchema()
+        klass = self.__class__
 
-        # create a hash value out of the schema
-        hash=sha(str([f.__dict__ for f in s.values()]) +
-                 str(self.__class__)).hexdigest()
-
-        if schemadict.has_key(hash): #ok we had that schema already, so take it
-            schema=schemadict[hash]
-        else: #make a new one and store it using the hash key
-            schemadict[hash]=s
-            schema=schemadict[hash]
+        key = (klass, self.getSchemaVersion(s))
+        schema = _schemas.get(key)
+        if schema is None: #make a new one and store it using the version
+            schema = s
+            _schemas.set(key, schema)
             g=VarClassGen(schema)
-            g.updateMethods(self.__class__) #generate the methods
-
+            g.updateMethods(klass) #generate the methods
         return schema
 
+    security.declarePrivate('getSchemaVersion')
+    def getSchemaVersion(self, schema):
+        """Return a token identifying the fields of schema.
+
+        Schemas with equal tokens share their generated methods. Override
+        this if getSchema builds new schemas, or if your schemas carry a
+        cheaper version marker: the signature of a new schema costs a full
+        toString.
+        """
+        return schema.signature()
+
     # supposed to be overloaded. here the object can return its own schema
     security.declareProtected(permissions.View, 'getSchema')
     def getSchema(self):
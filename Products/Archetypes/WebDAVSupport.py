@@ -1,42 +1,75 @@
 import tempfile
 import posixpath
 
+import transaction
 from zope import event
 from zExceptions import MethodNotAllowed
+from ZODB.interfaces import BlobError
+from ZODB.utils import z64
+from ZPublisher.HTTPRangeSupport import expandRanges
+from ZPublisher.HTTPRangeSupport import parseRange
 from ZPublisher.Iterators import IStreamIterator
 from Products.CMFCore.utils import getToolByName
 
 from Products.Archetypes.event import WebDAVObjectInitializedEvent
 from Products.Archetypes.event import WebDAVObjectEditedEvent
+from Products.Archetypes.utils import iterData
 from Products.Archetypes.utils import shasattr, mapply
 from zope.interface import implements, Interface
 
 class PdataStreamIterator(object):
+    """Streams a Pdata chain, as used by OFS.Image.File, in chunks of
+    streamsize bytes.
+
+    The server consumes a stream iterator after the request is finished
+    and its ZODB connection is closed, so the chain can't be loaded
+    through that connection anymore. A committed chain is loaded in
+    windows of about a megabyte, each through a connection taken from the
+    pool and closed again before the window is sent, so no connection is
+    held while the client reads. Chains that are not committed yet are
+    copied to a temporary file up front.
+
+    start and end select the bytes to stream, like a slice.
+    """
 
     implements(IStreamIterator)
 
-    def __init__(self, data, size, streamsize=1<<16):
-        # Consume the whole data into a TemporaryFile when
-        # constructing, otherwise we might end up loading the whole
-        # file in memory or worse, loading objects after the
-        # connection is closed.
-        f = tempfile.TemporaryFile(mode='w+b')
-
-        while data is not None:
-            f.write(data.data)
-            data = data.next
-
-        assert size == f.tell(), 'Informed length does not match real length'
-        f.seek(0)
-
-        self.file = f
-        self.size = size
+    def __init__(self, data, size, streamsize=1<<16, start=0, end=None):
+        # blob imports Field, which uses this module to send files
+        from Products.Archetypes.blob import BlobChunk
+        if end is None or end > size:
+            end = size
+        start = min(start, end)
+        self.size = end - start
         self.streamsize = streamsize
+        self.file = None
+        if isinstance(data, BlobChunk):
+            try:
+                path = data._blob.committed()
+            except BlobError:
+                self.file = _spool(iterData(data), start, end)
+                self._chunks = None
+            else:
+                offset = data._offset
+                self._chunks = _readFile(path, offset + start, offset + end)
+        elif getattr(data, '_p_jar', None) is None:
+            # Only in memory, nothing can be unloaded
+            self._chunks = _window(iterData(data), start, end)
+        elif _isCommitted(data):
+            self._chunks = _loadChain(data._p_jar.db(), data._p_oid,
+                                      start, end)
+        else:
+            self.file = _spool(iterData(data), start, end)
+            self._chunks = None
+        if self._chunks is not None:
+            self._chunks = _rechunk(self._chunks, streamsize)
 
     def __iter__(self):
         return self
 
     def next(self):
+        if self.file is None:
+            return self._chunks.next()
         data = self.file.read(self.streamsize)
         if not data:
             self.file.close()
@@ -46,6 +79,107 @@ class PdataStreamIterator(object):
     def __len__(self):
         return self.size
 
+
+def _isCommitted(data):
+    if data._p_oid is None:
+        return False
+    # The serial of a ghost is only known after loading it
+    data._p_activate()
+    return not data._p_changed and data._p_serial != z64
+
+
+def _window(chunks, start, end):
+    """Yield the bytes from start to end of the chunks."""
+    pos = 0
+    for chunk in chunks:
+        if pos >= end:
+            break
+        size = len(chunk)
+        if pos + size > start:
+            yield chunk[max(start - pos, 0):end - pos]
+        pos += size
+
+
+def _rechunk(chunks, streamsize):
+    """Yield the chunks joined or split into streamsize bytes."""
+    pending = ''
+    for chunk in chunks:
+        pending += chunk
+        while len(pending) >= streamsize:
+            yield pending[:streamsize]
+            pending = pending[streamsize:]
+    if pending:
+        yield pending
+
+
+def _loadChain(db, oid, start, end, window=1<<20):
+    """Walk the chain starting at oid in windows of about window bytes,
+    every window through a connection of its own.
+    """
+    pos = 0
+    while oid is not None and pos < end:
+        chunks = []
+        size = 0
+        tm = transaction.TransactionManager()
+        conn = db.open(transaction_manager=tm)
+        try:
+            pdata = conn.get(oid)
+            while pdata is not None and size < window:
+                chunks.append(pdata.data)
+                size += len(pdata.data)
+                pdata = pdata.next
+            oid = pdata is not None and pdata._p_oid or None
+        finally:
+            tm.abort()
+            conn.close()
+        for chunk in _window(chunks, start - pos, end - pos):
+            yield chunk
+        pos += size
+
+
+def _readFile(path, start, end):
+    f = open(path, 'rb')
+    try:
+        f.seek(start)
+        while start < end:
+            chunk = f.read(min(end - start, 1<<16))
+            if not chunk:
+                break
+            start += len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _spool(chunks, start, end):
+    f = tempfile.TemporaryFile(mode='w+b')
+    for chunk in _window(chunks, start, end):
+        f.write(chunk)
+    assert end - start == f.tell(), \
+           'Informed length does not match real length'
+    f.seek(0)
+    return f
+
+
+def _byteRange(REQUEST, size):
+    """Return the (start, end) of the single byte range requested or None
+    if the whole body should be sent.
+
+    Requests for several ranges and conditional range requests get the
+    whole body, which HTTP allows. Raises ValueError if the range can't
+    be satisfied.
+    """
+    header = REQUEST.get_header('Range', None)
+    if not header or REQUEST.get_header('If-Range', None):
+        return None
+    ranges = parseRange(header)
+    if not ranges or len(ranges) > 1:
+        return None
+    ranges = expandRanges(ranges, size)
+    if not ranges:
+        raise ValueError(header)
+    return ranges[0]
+
 _marker = []
 
 def collection_check(self):
@@ -163,16 +297,34 @@ def manage_FTPget(self, REQUEST=None, RESPONSE=None):
     if length is not None:
         RESPONSE.setHeader('Content-Length', length)
 
-    if type(data) is type(''):
+    if (issubclass(IStreamIterator, Interface) and IStreamIterator.providedBy(data)
+        or not issubclass(IStreamIterator, Interface) and IStreamIterator.IsImplementedBy(data)):
         return data
 
+    start, end = 0, length
+    if length is not None:
+        RESPONSE.setHeader('Accept-Ranges', 'bytes')
+        try:
+            byte_range = _byteRange(REQUEST, length)
+        except ValueError:
+            RESPONSE.setStatus(416)
+            RESPONSE.setHeader('Content-Range', 'bytes */%d' % length)
+            RESPONSE.setHeader('Content-Length', 0)
+            return ''
+        if byte_range is not None:
+            start, end = byte_range
+            RESPONSE.setStatus(206)
+            RESPONSE.setHeader('Content-Range',
+                               'bytes %d-%d/%d' % (start, end - 1, length))
+            RESPONSE.setHeader('Content-Length', end - start)
+
+    if type(data) is type(''):
+        return data[start:end]
+
     # We assume 'data' is a 'Pdata chain' as used by OFS.File and
     # return a StreamIterator.
     assert length is not None, 'Could not figure out length of Pdata chain'
-    if (issubclass(IStreamIterator, Interface) and IStreamIterator.providedBy(data)
-        or not issubclass(IStreamIterator, Interface) and IStreamIterator.IsImplementedBy(data)):
-        return data
-    return PdataStreamIterator(data, length)
+    return PdataStreamIterator(data, length, start=start, end=end)
 
 def manage_afterPUT(self, data, marshall_data, file, context, mimetype,
                     filename, REQUEST, RESPONSE):
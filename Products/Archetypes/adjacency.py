@@ -0,0 +1,329 @@
+"""Adjacency index of the reference catalog.
+
+The reference catalog answers questions like "which objects does X refer
+to" through its ``sourceUID``, ``targetUID`` and ``relationship`` indexes,
+which means creating brains and reading the relationship unindex for every
+matching record. ``AdjacencyIndex`` keeps the same information as plain
+uid mappings::
+
+    forward[source uid][relationship] -> {target uid: count}
+    backward[target uid][relationship] -> {source uid: count}
+
+so the uids of referenced objects and the relationships of an object can
+be looked up without touching the catalog. The counts take care of several
+references between the same objects with the same relationship.
+
+The index is maintained by ``ReferenceCatalog.catalog_object`` and
+``uncatalog_object`` and keyed by the catalog path of the reference,
+relative to the portal. It is created by the Archetypes profile (or its
+upgrade step) and can be rebuilt with ``ReferenceCatalog.rebuildAdjacency``;
+it is never built on a read. Until it exists ``CatalogAdjacency`` answers
+the same questions from the catalog indexes.
+
+``traverse`` and ``shortestPath`` walk the reference graph on uids only,
+without waking up any of the objects on the way.
+"""
+
+from collections import deque
+
+from Persistence import Persistent
+from BTrees.OOBTree import OOBTree
+from BTrees.Length import Length
+
+# BTrees don't like None as key
+NO_RELATIONSHIP = ''
+
+
+def _relKey(relationship):
+    if relationship is None:
+        return NO_RELATIONSHIP
+    return relationship
+
+
+def _relationships(relationship):
+    """Normalize a relationship filter to a list of keys or None (all).
+    """
+    if relationship is None:
+        return None
+    if isinstance(relationship, basestring):
+        return [relationship]
+    return [_relKey(r) for r in relationship]
+
+
+class GraphWalker:
+    """Graph walks on top of a ``neighbours`` method.
+    """
+
+    def neighbours(self, uid, relationship=None, backwards=False):
+        raise NotImplementedError
+
+    def traverse(self, uid, relationship=None, depth=None, backwards=False,
+                 depth_first=False):
+        """Walk the reference graph starting at uid.
+
+        Yields ``(uid, distance)`` for every uid reachable from uid by
+        following references with the given relationship(s), at most depth
+        references away (no limit if depth is None). Every uid is visited
+        once, so cycles are harmless; the start uid is not yielded. The walk
+        is breadth first unless depth_first is given.
+        """
+        seen = set([uid])
+        pending = deque([(uid, 0)])
+        while pending:
+            if depth_first:
+                current, distance = pending.pop()
+            else:
+                current, distance = pending.popleft()
+            if depth_first and current != uid:
+                yield current, distance
+            # The depth only limits which uids are expanded
+            if depth is not None and distance >= depth:
+                continue
+            neighbours = self.neighbours(current, relationship, backwards)
+            if depth_first:
+                # Visit neighbours in sorted order
+                neighbours = neighbours[::-1]
+            for other in neighbours:
+                if other in seen:
+                    continue
+                seen.add(other)
+                if not depth_first:
+                    yield other, distance + 1
+                pending.append((other, distance + 1))
+
+    def shortestPath(self, sid, tid, relationship=None, depth=None,
+                     backwards=False):
+        """Return the shortest list of uids leading from sid to tid.
+
+        The list starts with sid and ends with tid. Returns None if tid
+        can't be reached within depth references.
+        """
+        if sid == tid:
+            return [sid]
+        parents = {sid: None}
+        pending = deque([(sid, 0)])
+        while pending:
+            current, distance = pending.popleft()
+            if depth is not None and distance >= depth:
+                continue
+            for other in self.neighbours(current, relationship, backwards):
+                if other in parents:
+                    continue
+                parents[other] = current
+                if other == tid:
+                    path = [tid]
+                    while parents[path[-1]] is not None:
+                        path.append(parents[path[-1]])
+                    path.reverse()
+                    return path
+                pending.append((other, distance + 1))
+        return None
+
+
+class AdjacencyIndex(GraphWalker, Persistent):
+    """Forward and backward references between uids.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._refs = OOBTree()
+        self._forward = OOBTree()
+        self._backward = OOBTree()
+        self._length = Length()
+
+    def __len__(self):
+        return self._length()
+
+    def add(self, key, sid, tid, relationship):
+        """Record the reference cataloged under key.
+        """
+        if not sid or not tid:
+            self.remove(key)
+            return
+        entry = (sid, tid, _relKey(relationship))
+        old = self._refs.get(key)
+        if old == entry:
+            return
+        if old is not None:
+            self.remove(key)
+        self._refs[key] = entry
+        self._length.change(1)
+        _increment(self._forward, sid, entry[2], tid)
+        _increment(self._backward, tid, entry[2], sid)
+
+    def remove(self, key):
+        """Forget the reference cataloged under key, if any.
+        """
+        entry = self._refs.get(key)
+        if entry is None:
+            return
+        sid, tid, rel = entry
+        del self._refs[key]
+        self._length.change(-1)
+        _decrement(self._forward, sid, rel, tid)
+        _decrement(self._backward, tid, rel, sid)
+
+    def targets(self, sid, relationship=None):
+        """Return the uids referenced by sid, one per reference.
+        """
+        return _neighbours(self._forward, sid, relationship)
+
+    def sources(self, tid, relationship=None):
+        """Return the uids referring to tid, one per reference.
+        """
+        return _neighbours(self._backward, tid, relationship)
+
+    def relationships(self, sid):
+        """Return the relationships of references from sid.
+        """
+        return _relationshipNames(self._forward, sid)
+
+    def backRelationships(self, tid):
+        """Return the relationships of references to tid.
+        """
+        return _relationshipNames(self._backward, tid)
+
+    def neighbours(self, uid, relationship=None, backwards=False):
+        """Return the distinct uids adjacent to uid.
+        """
+        tree = backwards and self._backward or self._forward
+        rels = tree.get(uid)
+        if rels is None:
+            return []
+        names = _relationships(relationship)
+        if names is None:
+            names = rels.keys()
+        if len(names) == 1:
+            uids = rels.get(names[0])
+            return uids is not None and list(uids.keys()) or []
+        result = set()
+        for name in names:
+            uids = rels.get(name)
+            if uids is not None:
+                result.update(uids.keys())
+        return sorted(result)
+
+    def hasRelationship(self, sid, tid, relationship=None):
+        rels = self._forward.get(sid)
+        if rels is None:
+            return False
+        names = _relationships(relationship)
+        if names is None:
+            names = rels.keys()
+        for name in names:
+            uids = rels.get(name)
+            if uids is not None and tid in uids:
+                return True
+        return False
+
+
+class CatalogAdjacency(GraphWalker):
+    """Answers like an ``AdjacencyIndex`` from the reference catalog.
+
+    Used while a reference catalog has no adjacency index yet.
+    """
+
+    def __init__(self, catalog):
+        self._catalog = catalog
+
+    def _brains(self, uid, relationship, backwards):
+        if backwards:
+            indexname = 'targetUID'
+        else:
+            indexname = 'sourceUID'
+        return self._catalog._optimizedQuery(uid, indexname, relationship)
+
+    def targets(self, sid, relationship=None):
+        return [b.targetUID for b in self._brains(sid, relationship, False)]
+
+    def sources(self, tid, relationship=None):
+        return [b.sourceUID for b in self._brains(tid, relationship, True)]
+
+    def relationships(self, sid):
+        res = {}
+        for brain in self._brains(sid, None, False):
+            res[brain.relationship] = 1
+        return res.keys()
+
+    def backRelationships(self, tid):
+        res = {}
+        for brain in self._brains(tid, None, True):
+            res[brain.relationship] = 1
+        return res.keys()
+
+    def neighbours(self, uid, relationship=None, backwards=False):
+        if backwards:
+            uids = self.sources(uid, relationship)
+        else:
+            uids = self.targets(uid, relationship)
+        return sorted(set(uids))
+
+    def hasRelationship(self, sid, tid, relationship=None):
+        brains = self._catalog._queryFor(sid, tid, relationship)
+        for brain in brains:
+            if brain.getObject() is not None:
+                return True
+        return False
+
+
+def _increment(tree, uid, rel, other):
+    rels = tree.get(uid)
+    if rels is None:
+        rels = tree[uid] = OOBTree()
+    uids = rels.get(rel)
+    if uids is None:
+        uids = rels[rel] = OOBTree()
+    uids[other] = uids.get(other, 0) + 1
+
+
+def _decrement(tree, uid, rel, other):
+    rels = tree.get(uid)
+    if rels is None:
+        return
+    uids = rels.get(rel)
+    if uids is None:
+        return
+    count = uids.get(other, 0) - 1
+    if count > 0:
+        uids[other] = count
+        return
+    if other in uids:
+        del uids[other]
+    if not len(uids):
+        del rels[rel]
+        if not len(rels):
+            del tree[uid]
+
+
+def _neighbours(tree, uid, relationship):
+    rels = tree.get(uid)
+    if rels is None:
+        return []
+    names = _relationships(relationship)
+    if names is None:
+        names = rels.keys()
+    result = []
+    for name in names:
+        uids = rels.get(name)
+        if uids is None:
+            continue
+        for other, count in uids.items():
+            if count == 1:
+                result.append(other)
+            else:
+                result.extend([other] * count)
+    return result
+
+
+def _relationshipNames(tree, uid):
+    rels = tree.get(uid)
+    if rels is None:
+        return []
+    result = []
+    for rel in rels.keys():
+        if rel == NO_RELATIONSHIP:
+            rel = None
+        result.append(rel)
+    return result
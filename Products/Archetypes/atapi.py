@@ -58,6 +58,8 @@ from Products.Archetypes.Marshall import PrimaryFieldMarshaller
 from Products.Archetypes.Marshall import RFC822Marshaller
 # fields
 from Products.Archetypes.Field import *
+from Products.Archetypes.blob import BlobFileField
+from Products.Archetypes.blob import BlobImageField
 # widgets
 from Products.Archetypes.Widget import *
 # storage
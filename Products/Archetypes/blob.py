@@ -0,0 +1,317 @@
+"""File and image fields that keep their data in ZODB blobs.
+
+``FileField`` and ``ImageField`` store an ``OFS.Image.File`` whose data is
+a chain of ``Pdata`` objects in the object database: every upload is cut
+into database records and every download loads them through the ZODB
+cache. ``BlobFileField`` and ``BlobImageField`` store a ``BlobFile`` or
+``BlobImage`` instead, which keep the data in a ``ZODB.blob.Blob``:
+
+- uploads are copied to the blob file in chunks, without building Pdata
+  objects or reading the upload into memory;
+
+- downloads of committed data are served straight from the blob file by a
+  ``filestream_iterator``;
+
+- size, content type and file name are plain attributes.
+
+The ``data`` attribute of these classes is a read-only stand-in for a
+Pdata chain (``BlobChunk``), so code that expects an OFS File, like
+``str(file.data)`` or walking ``data.next``, keeps working.
+
+Blob support has to be enabled in the ZODB storage (``blob-dir``) for these
+fields to be used.
+"""
+
+from AccessControl import ClassSecurityInfo
+from Acquisition import aq_base
+from App.class_init import InitializeClass
+from App.Common import rfc1123_date
+from ComputedAttribute import ComputedAttribute
+from ExtensionClass import Base
+from OFS.Image import File
+from OFS.Image import getImageInfo
+from ZODB.blob import Blob
+from ZODB.interfaces import BlobError
+from ZPublisher.Iterators import filestream_iterator
+from zExceptions import ResourceLockedError
+
+from Products.CMFCore import permissions
+from Products.Archetypes.Field import FileField
+from Products.Archetypes.Field import Image
+from Products.Archetypes.Field import ImageField
+from Products.Archetypes.Field import ObjectField
+from Products.Archetypes.Registry import registerField
+from Products.Archetypes.utils import iterData
+from Products.Archetypes.utils import shasattr
+
+# Size of the chunks blobs are read and written in
+CHUNK_SIZE = 1 << 16
+# Number of leading bytes used to guess content types and image sizes
+HEAD_SIZE = 1 << 16
+# Number of leading bytes searched for the size of an image if the first
+# HEAD_SIZE bytes don't tell
+IMAGE_HEAD_SIZE = 1 << 20
+
+
+class _BlobReader(object):
+    """The open blob file shared by the chunks of one chain.
+    """
+
+    def __init__(self, blob):
+        self._blob = blob
+        self._file = None
+
+    def _open(self):
+        if self._file is None:
+            self._file = self._blob.open('r')
+        return self._file
+
+    def size(self):
+        f = self._open()
+        f.seek(0, 2)
+        return f.tell()
+
+    def read(self, offset, size=-1):
+        f = self._open()
+        if f.tell() != offset:
+            f.seek(offset)
+        return f.read(size)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class BlobChunk(object):
+    """A chunk of the data of a blob, looking like a Pdata object.
+
+    ``data`` is the chunk, ``next`` the following chunk or None. The
+    chunks of a chain share one open blob file, which is closed once the
+    last chunk was read (or when the chain is dropped), so a walk over the
+    chain opens the blob once.
+    """
+
+    def __init__(self, blob, offset=0, size=None, reader=None):
+        if reader is None:
+            reader = _BlobReader(blob)
+        self._blob = blob
+        self._reader = reader
+        self._offset = offset
+        if size is None:
+            size = reader.size()
+        self._size = size
+        self.data = reader.read(offset, CHUNK_SIZE)
+        if offset + len(self.data) >= size:
+            reader.close()
+
+    @property
+    def next(self):
+        end = self._offset + len(self.data)
+        if end >= self._size:
+            return None
+        return BlobChunk(self._blob, end, self._size, self._reader)
+
+    def __len__(self):
+        return self._size - self._offset
+
+    def __str__(self):
+        try:
+            return self._reader.read(self._offset)
+        finally:
+            self._reader.close()
+
+
+class BlobDataMixin(Base):
+    """Keeps the data of an OFS File or Image in a blob.
+    """
+
+    security = ClassSecurityInfo()
+
+    size = 0
+
+    def __init__(self, id, title, file, content_type='', precondition=''):
+        self.__name__ = id
+        self.title = title
+        self.precondition = precondition
+        self._blob = Blob()
+        head, size = self._writeBlob(file)
+        content_type = self._get_content_type(file, head, id, content_type)
+        self._setData(head, size, content_type)
+
+    def _getData(self):
+        return BlobChunk(self._blob, 0, self.size)
+
+    data = ComputedAttribute(_getData, 1)
+
+    security.declareProtected(permissions.ModifyPortalContent,
+                              'manage_upload')
+    def manage_upload(self, file='', REQUEST=None):
+        """Replaces the data with the contents of file.
+        """
+        if self.wl_isLocked():
+            raise ResourceLockedError("File is locked via WebDAV")
+        head, size = self._writeBlob(file)
+        content_type = self._get_content_type(file, head, self.__name__,
+                                              'application/octet-stream')
+        self._setData(head, size, content_type)
+        if REQUEST:
+            message = "Saved changes."
+            return self.manage_main(self, REQUEST,
+                                    manage_tabs_message=message)
+
+    security.declarePrivate('update_data')
+    def update_data(self, data, content_type=None, size=None):
+        if isinstance(data, unicode):
+            raise TypeError('Data can only be str or file-like.  '
+                            'Unicode objects are expressly forbidden.')
+        head, size = self._writeBlob(data)
+        self._setData(head, size, content_type)
+
+    def _writeBlob(self, value):
+        """Copy value (a string, file, Pdata chain or OFS File) to the
+        blob in chunks. Returns the first HEAD_SIZE bytes and the size.
+        """
+        if isinstance(aq_base(value), File):
+            value = value.data
+        if isinstance(value, basestring):
+            chunks = [value]
+        elif shasattr(value, 'read'):
+            if shasattr(value, 'seek'):
+                value.seek(0)
+            chunks = iter(lambda: value.read(CHUNK_SIZE), '')
+        else:
+            chunks = iterData(value)
+        head = ''
+        size = 0
+        f = self._blob.open('w')
+        try:
+            for chunk in chunks:
+                if len(head) < HEAD_SIZE:
+                    head += chunk[:HEAD_SIZE - len(head)]
+                f.write(chunk)
+                size += len(chunk)
+        finally:
+            f.close()
+        return head, size
+
+    def _setData(self, head, size, content_type=None):
+        if content_type is not None:
+            self.content_type = content_type
+        self.size = size
+        self.ZCacheable_invalidate()
+        self.ZCacheable_set(None)
+        self.http__refreshEtag()
+
+    security.declareProtected(permissions.View, 'getIterator')
+    def getIterator(self):
+        """Returns a stream iterator over the blob file, or the data as a
+        string if it isn't committed yet.
+        """
+        try:
+            path = self._blob.committed()
+        except BlobError:
+            return str(self.data)
+        return filestream_iterator(path, 'rb')
+
+    security.declareProtected(permissions.View, 'index_html')
+    def index_html(self, REQUEST, RESPONSE):
+        """Download the data, streamed from the blob file.
+        """
+        if self._if_modified_since_request_handler(REQUEST, RESPONSE):
+            self.ZCacheable_set(None)
+            return ''
+        if self._range_request_handler(REQUEST, RESPONSE):
+            return ''
+        RESPONSE.setHeader('Last-Modified', rfc1123_date(self._p_mtime))
+        RESPONSE.setHeader('Content-Type', self.content_type)
+        RESPONSE.setHeader('Content-Length', self.size)
+        RESPONSE.setHeader('Accept-Ranges', 'bytes')
+        return self.getIterator()
+
+InitializeClass(BlobDataMixin)
+
+
+class BlobFile(BlobDataMixin, File):
+    """An OFS File keeping its data in a blob.
+    """
+
+    security = ClassSecurityInfo()
+
+InitializeClass(BlobFile)
+
+
+class BlobImage(BlobDataMixin, Image):
+    """An image keeping its data in a blob.
+    """
+
+    security = ClassSecurityInfo()
+
+    width = height = -1
+
+    def _setData(self, head, size, content_type=None):
+        ct, width, height = getImageInfo(head)
+        if width < 0 and size > len(head):
+            # The size may come late, e.g. in JPEGs with big EXIF data
+            f = self._blob.open('r')
+            try:
+                ct, width, height = getImageInfo(f.read(IMAGE_HEAD_SIZE))
+            finally:
+                f.close()
+        if ct:
+            content_type = ct
+        if width >= 0 and height >= 0:
+            self.width = width
+            self.height = height
+        BlobDataMixin._setData(self, head, size, content_type)
+
+InitializeClass(BlobImage)
+
+
+class BlobFieldMixin:
+    """Takes OFS Files stored before the field was switched to blobs as
+    they are, instead of copying them to a blob on every access. They are
+    converted when a new value is set.
+    """
+
+    def get(self, instance, **kwargs):
+        value = ObjectField.get(self, instance, **kwargs)
+        if value and not isinstance(aq_base(value), File):
+            value = self._wrapValue(instance, value)
+        if (shasattr(value, '__of__', acquire=True)
+            and not kwargs.get('unwrapped', False)):
+            return value.__of__(instance)
+        return value
+
+
+class BlobFileField(BlobFieldMixin, FileField):
+    """A file field keeping its data in a blob."""
+
+    _properties = FileField._properties.copy()
+    _properties.update({
+        'content_class': BlobFile,
+        })
+
+    security = ClassSecurityInfo()
+
+
+class BlobImageField(BlobFieldMixin, ImageField):
+    """An image field keeping the original image and its scales in
+    blobs."""
+
+    _properties = ImageField._properties.copy()
+    _properties.update({
+        'content_class': BlobImage,
+        })
+
+    security = ClassSecurityInfo()
+
+
+registerField(BlobFileField,
+              title='Blob File',
+              description='Used for storing files in ZODB blobs')
+
+registerField(BlobImageField,
+              title='Blob Image',
+              description=('Used for storing images and their scales in '
+                           'ZODB blobs'))
@@ -0,0 +1,116 @@
+"""Transaction scoped queue for deferred catalog operations.
+
+When ``config.QUEUE_CATALOG_OPERATIONS`` is enabled, CatalogMultiplex does
+not write to the catalogs immediately. Index and reindex operations are
+collected per object path for the duration of a transaction, the ``idxs``
+of repeated reindex calls are merged and the resulting operations are
+processed once, in a before-commit hook.
+
+Unindexing is never deferred: it drops whatever is pending for the path and
+runs immediately, so that moved or deleted objects are not written back to
+the catalogs under their old path.
+
+Code that needs to query the catalogs for changes made in the current
+transaction has to call ``processQueue()`` first.
+"""
+
+import threading
+
+import transaction
+
+INDEX = 'index'
+REINDEX = 'reindex'
+
+_local = threading.local()
+
+
+class CatalogQueue(object):
+    """Pending catalog operations of one transaction, keyed by path.
+    """
+
+    def __init__(self):
+        self._paths = []
+        self._ops = {}
+
+    def __len__(self):
+        return len(self._paths)
+
+    def index(self, obj, url):
+        """Queue a full indexing of obj under url.
+        """
+        pending = self._ops.get(url)
+        if pending is None:
+            self._paths.append(url)
+        elif pending[0] == REINDEX and not pending[2]:
+            # A full reindex already covers indexing
+            self._ops[url] = (REINDEX, obj, [])
+            return
+        self._ops[url] = (INDEX, obj, [])
+
+    def reindex(self, obj, url, idxs=[]):
+        """Queue a reindex of obj, merging idxs with pending operations.
+
+        An empty idxs list means 'all indexes' and wins over any subset.
+        """
+        pending = self._ops.get(url)
+        if pending is None:
+            self._ops[url] = (REINDEX, obj, list(idxs))
+            self._paths.append(url)
+            return
+        op, old, old_idxs = pending
+        if not idxs:
+            op, merged = REINDEX, []
+        elif op == INDEX or not old_idxs:
+            merged = []
+        else:
+            merged = old_idxs + [i for i in idxs if i not in old_idxs]
+        # Always keep the most recent wrapper of the object
+        self._ops[url] = (op, obj, merged)
+
+    def discard(self, url):
+        """Forget pending operations for url.
+        """
+        if self._ops.pop(url, None) is not None:
+            self._paths.remove(url)
+
+    def process(self):
+        """Run all pending operations. Returns the number of operations.
+        """
+        count = 0
+        # Indexing may queue further operations, e.g. through event
+        # subscribers, so we loop until the queue is drained.
+        while self._paths:
+            paths, ops = self._paths, self._ops
+            self._paths, self._ops = [], {}
+            for url in paths:
+                op, obj, idxs = ops[url]
+                if op == INDEX:
+                    obj._indexObject(url)
+                else:
+                    obj._reindexObject(url, idxs)
+                count += 1
+        return count
+
+
+def getQueue():
+    """Return the queue of the current transaction.
+
+    A new queue is created and hooked into the transaction on first use.
+    """
+    txn = transaction.get()
+    queue = getattr(_local, 'queue', None)
+    if queue is None or getattr(_local, 'txn', None) is not txn:
+        queue = CatalogQueue()
+        _local.queue = queue
+        _local.txn = txn
+        txn.addBeforeCommitHook(queue.process)
+    return queue
+
+
+def processQueue():
+    """Flush the queue of the current transaction, if there is one.
+    """
+    queue = getattr(_local, 'queue', None)
+    if queue is None or getattr(_local, 'txn', None) is not transaction.get():
+        return 0
+    return queue.process()
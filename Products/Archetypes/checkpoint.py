@@ -0,0 +1,283 @@
+"""Resumable, partitioned batch jobs.
+
+Long running maintenance jobs (catalog rebuilds, schema updates) split their
+work into partitions, e.g. the top-level containers of a site. The progress
+of a job is kept in a persistent ``Checkpoint`` which records which worker
+claimed a partition, the last processed position inside of it and which
+partitions are done. Work is committed in batches, so a job that crashed or
+was stopped picks up where it left off when it is run again.
+
+Several worker processes, each with its own ZODB connection (e.g. a number
+of ZEO clients started with ``bin/instance run``), can run the same job at
+the same time: each of them claims the next free partition from the shared
+checkpoint until all partitions are done.
+
+A claim records when its worker last committed a batch. A partition whose
+worker didn't commit for ``CLAIM_TIMEOUT`` seconds is considered orphaned,
+e.g. because the worker crashed and was restarted under a new process id,
+and is handed to the next worker asking for work. The new worker resumes
+at the last committed position.
+"""
+
+import os
+import socket
+import time
+
+import transaction
+from Acquisition import aq_base
+from Persistence import Persistent
+from BTrees.OOBTree import OOBTree
+from ZODB.POSException import ConflictError
+
+from Products.Archetypes.log import log
+
+# Give up on a batch that conflicted this many times in a row
+MAX_CONFLICT_RETRIES = 5
+# Seconds after which a claim without a committed batch may be taken over
+CLAIM_TIMEOUT = 30 * 60
+
+
+def defaultWorkerName():
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+class Checkpoint(Persistent):
+    """Persistent progress information of a partitioned job.
+    """
+
+    def __init__(self, name, partitions, **options):
+        self.name = name
+        self.partitions = tuple(partitions)
+        # Job specific settings every worker has to use
+        self.options = options
+        self.started = time.time()
+        self._claims = OOBTree()
+        self._positions = OOBTree()
+        self._counts = OOBTree()
+        self._done = OOBTree()
+
+    def claim(self, worker, timeout=None):
+        """Claim the next partition for worker and return it.
+
+        Partitions claimed by the same worker before, but not finished,
+        are handed out first so a restarted worker resumes its own work.
+        Then free partitions, then partitions whose worker didn't show a
+        sign of life for timeout seconds (CLAIM_TIMEOUT by default).
+        Returns None if there is nothing left to do.
+        """
+        if timeout is None:
+            timeout = CLAIM_TIMEOUT
+        now = time.time()
+        free = stale = None
+        for partition in self.partitions:
+            if partition in self._done:
+                continue
+            claim = self._claims.get(partition)
+            if claim is None:
+                if free is None:
+                    free = partition
+                continue
+            owner, seen = _claim(claim)
+            if owner == worker:
+                self._claims[partition] = (worker, now)
+                return partition
+            if stale is None and seen + timeout <= now:
+                stale = partition
+        partition = free
+        if partition is None and stale is not None:
+            partition = stale
+            log('%s: %s takes over partition %s from %s'
+                % (self.name, worker, partition,
+                   self.owner(partition)))
+        if partition is not None:
+            self._claims[partition] = (worker, now)
+        return partition
+
+    def owner(self, partition):
+        """Return the worker that claimed partition or None.
+        """
+        claim = self._claims.get(partition)
+        if claim is None:
+            return None
+        return _claim(claim)[0]
+
+    def release(self, worker=None):
+        """Release unfinished partitions of worker (or of all workers).
+
+        Used to take over the work of workers that died.
+        """
+        for partition, claim in list(self._claims.items()):
+            if partition in self._done:
+                continue
+            if worker is None or _claim(claim)[0] == worker:
+                del self._claims[partition]
+
+    def position(self, partition):
+        """Return the last processed position in partition or None.
+        """
+        return self._positions.get(partition)
+
+    def advance(self, partition, position, count):
+        """Record that count more items up to position were processed.
+        """
+        self._positions[partition] = position
+        self._counts[partition] = self._counts.get(partition, 0) + count
+        owner = self.owner(partition)
+        if owner is not None:
+            # Keeps the claim from being taken over
+            self._claims[partition] = (owner, time.time())
+
+    def finish(self, partition):
+        self._done[partition] = time.time()
+
+    def isDone(self):
+        return len(self._done) == len(self.partitions)
+
+    def processed(self):
+        return sum(self._counts.values())
+
+    def progress(self):
+        """Return (done partitions, all partitions, processed items).
+        """
+        return len(self._done), len(self.partitions), self.processed()
+
+
+def _claim(claim):
+    """Return (worker, last sign of life) of a claim."""
+    if isinstance(claim, tuple):
+        return claim
+    # Claims of older versions only recorded the worker
+    return claim, 0
+
+
+def processPartitions(checkpoint, items, apply, batch_size=1000,
+                      worker=None, out=None, claim_timeout=None):
+    """Process all partitions of checkpoint that this worker can claim.
+
+    ``items(partition, after)`` must yield ``(position, obj)`` pairs of a
+    partition in a stable order, skipping everything up to and including
+    the position ``after``. ``apply(obj, position)`` does the actual work.
+
+    A transaction is committed after every ``batch_size`` items, together
+    with the new position in the checkpoint. Batches that fail with a
+    ConflictError are retried from the last committed position. Partitions
+    of workers that didn't commit a batch for claim_timeout seconds are
+    taken over (see ``Checkpoint.claim``).
+
+    Returns the number of items this worker processed.
+    """
+    if worker is None:
+        worker = defaultWorkerName()
+    total = 0
+    started = time.time()
+    while True:
+        try:
+            partition = checkpoint.claim(worker, claim_timeout)
+            transaction.commit()
+        except ConflictError:
+            # Another worker claimed a partition at the same time
+            transaction.abort()
+            continue
+        if partition is None:
+            break
+        retries = 0
+        while True:
+            try:
+                count = _processPartition(checkpoint, partition, items,
+                                          apply, batch_size, worker)
+            except ConflictError:
+                transaction.abort()
+                retries += 1
+                if retries > MAX_CONFLICT_RETRIES:
+                    raise
+                log('%s: conflict in partition %s, retrying'
+                    % (checkpoint.name, partition))
+                continue
+            break
+        if count is None:
+            continue
+        total += count
+        elapsed = time.time() - started
+        done, of, processed = checkpoint.progress()
+        msg = ('%s: %s finished partition %s (%d/%d), %d items, '
+               '%.1f items/s, %d items overall'
+               % (checkpoint.name, worker, partition, done, of, total,
+                  total / max(elapsed, 0.001), processed))
+        log(msg)
+        if out is not None:
+            print >> out, msg
+    return total
+
+
+def _processPartition(checkpoint, partition, items, apply, batch_size,
+                      worker):
+    count = 0
+    batch = 0
+    position = None
+    if checkpoint.owner(partition) != worker:
+        # Taken over by another worker while we were stalled. Committing
+        # a batch after a takeover conflicts, so this is seen on retry.
+        log('%s: %s lost partition %s'
+            % (checkpoint.name, worker, partition))
+        return None
+    for position, obj in items(partition, checkpoint.position(partition)):
+        apply(obj, position)
+        batch += 1
+        if batch >= batch_size:
+            checkpoint.advance(partition, position, batch)
+            transaction.commit()
+            count += batch
+            batch = 0
+    if batch:
+        checkpoint.advance(partition, position, batch)
+        count += batch
+    checkpoint.finish(partition)
+    transaction.commit()
+    return count
+
+
+def iterPartition(root, partition, after=None, predicate=None):
+    """Iterate over the top-level object partition of root and its contents.
+
+    Adapts ``walk`` to the ``items`` protocol of ``processPartitions``.
+    """
+    obj = root._getOb(partition, None)
+    if obj is None:
+        return
+    start = (partition,)
+    if after is None and (predicate is None or predicate(obj)):
+        yield start, obj
+    for item in walk(obj, start, after, predicate):
+        yield item
+
+
+def walk(container, path=(), after=None, predicate=None):
+    """Walk the object tree below container in a stable order.
+
+    Yields ``(path, obj)`` pairs where path is a tuple of ids relative to
+    the starting point. Children are visited sorted by id, depth first, so
+    the paths come in tuple order; everything up to and including ``after``
+    is skipped without loading skipped subtrees. Only objects matching
+    ``predicate`` are yielded, but all object managers are descended into.
+    """
+    # Don't acquire objectIds from the parent of non-folderish objects
+    if getattr(aq_base(container), 'objectIds', None) is None:
+        return
+    ids = list(container.objectIds())
+    ids.sort()
+    for id in ids:
+        child_path = path + (id,)
+        if after is not None and child_path <= after:
+            if after[:len(child_path)] != child_path:
+                # The whole subtree comes before 'after'
+                continue
+            descend_after = after
+        else:
+            descend_after = None
+        obj = container._getOb(id, None)
+        if obj is None:
+            continue
+        if descend_after is None and (predicate is None or predicate(obj)):
+            yield child_path, obj
+        for item in walk(obj, child_path, descend_after, predicate):
+            yield item
@@ -45,3 +45,55 @@ LANGUAGE_DEFAULT=u''
 ## Archetypes before 1.4 managed the catalog map using meta types instead of
 ## portal types. If you need this old behaviour change this setting to False.
 CATALOGMAP_USES_PORTALTYPE = True
+
+## Defer catalog writes of CatalogMultiplex until the end of the transaction.
+## Repeated (re)index calls for an object are merged and processed once in a
+## before-commit hook. Catalog queries made in the same transaction will not
+## see the pending changes unless catalogqueue.processQueue() is called.
+QUEUE_CATALOG_OPERATIONS = False
+
+## Only write the indexes and metadata of an object whose values changed
+## since the last reindex. Fingerprints of the indexed values are stored on
+## each object to detect unchanged indexes.
+CATALOG_CHANGE_DETECTION = False
+
+## Number of UID -> path entries kept per process to resolve UIDs to objects
+## without querying the uid_catalog. 0 disables the cache.
+UID_PATH_CACHE_SIZE = 10000
+
+## Number of prepared instance schemas VariableSchemaSupport keeps per
+## process.
+VARIABLE_SCHEMA_CACHE_SIZE = 1000
+
+## Cache the schemas that BaseObject.Schema() gets from custom ISchema
+## adapters (e.g. schema extenders) for the duration of a transaction.
+## Only switch this on if the fields of all such adapters depend on the
+## class and interfaces of the object alone: extenders whose fields depend
+## on the state of the object or on the request would see stale schemas.
+CACHE_ADAPTED_SCHEMAS = False
+
+## Let schema updates only touch the fields that were added, retyped or
+## moved to another storage, when archetype_tool knows the fields of the
+## schema an object was last updated to. Otherwise all fields are re-set.
+INCREMENTAL_SCHEMA_UPDATE = True
+
+## Number of texts extracted from searchable file and text fields that
+## SearchableText keeps per process, keyed by the revision of the stored
+## file. 0 disables the cache.
+SEARCHABLE_TEXT_CACHE_SIZE = 1000
+
+## Total number of bytes of the texts in that cache. Texts longer than this
+## are not cached. 0 means no limit.
+SEARCHABLE_TEXT_CACHE_BYTES = 32 * 1024 * 1024
+
+## FileField.getIndexable doesn't convert files bigger than this many bytes
+## to text, since the transforms need the whole file in memory. The
+## extracted text is cut after INDEXABLE_TEXT_MAX_SIZE bytes, plain text
+## files are only read that far. 0 means no limit, which is the default:
+## setting a limit leaves (the end of) big files out of SearchableText.
+INDEXABLE_FILE_MAX_SIZE = 0
+INDEXABLE_TEXT_MAX_SIZE = 0
+
+## Number of mimetype classifications of uploaded data kept per process,
+## keyed by a hash of the data. 0 disables the cache.
+MIMETYPE_CACHE_SIZE = 1000
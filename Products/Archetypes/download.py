@@ -0,0 +1,193 @@
+"""Conditional and byte range requests for file downloads.
+
+``FileField.download`` and ``BaseUnit.index_html`` send their data through
+``sendData``, which
+
+- answers ``If-None-Match`` and ``If-Modified-Since`` requests with a 304
+  before the data is loaded;
+
+- answers ``Range`` requests, single or multiple ranges, with the
+  requested bytes only, unless an ``If-Range`` condition fails.
+
+The ETag and Last-Modified date are taken from the persistent object the
+data is stored in (see ``storedETag``): its oid and serial change whenever
+the data does.
+"""
+
+from mimetools import choose_boundary
+
+from Acquisition import aq_base
+from App.Common import rfc1123_date
+from DateTime import DateTime
+from DateTime.interfaces import DateTimeError
+from ZODB.utils import u64
+from ZODB.utils import z64
+from ZPublisher.HTTPRangeSupport import expandRanges
+from ZPublisher.HTTPRangeSupport import parseRange
+from ZPublisher.Iterators import IStreamIterator
+from zope.interface import implements
+
+from Products.Archetypes.WebDAVSupport import PdataStreamIterator
+
+
+def storedETag(obj):
+    """Return an ETag for the stored revision of the persistent obj, or
+    None if it isn't committed.
+    """
+    obj = aq_base(obj)
+    if getattr(obj, '_p_jar', None) is None or obj._p_oid is None:
+        return None
+    # The serial of a ghost is only known after loading it
+    obj._p_activate()
+    if obj._p_changed or obj._p_serial == z64:
+        return None
+    return '"%x.%x"' % (u64(obj._p_oid), u64(obj._p_serial))
+
+
+def storedModificationTime(obj):
+    """Return the time obj was committed or None."""
+    if storedETag(obj) is None:
+        return None
+    return aq_base(obj)._p_mtime
+
+
+def _parseDate(value):
+    try:
+        return long(DateTime(value.split(';')[0]).timeTime())
+    except (DateTimeError, ValueError, IndexError):
+        return None
+
+
+def _matchETag(header, etag):
+    if etag is None:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+
+def isNotModified(REQUEST, etag=None, mtime=None):
+    """Return whether the client's copy is still up to date.
+
+    If-None-Match takes precedence over If-Modified-Since.
+    """
+    header = REQUEST.get_header('If-None-Match', None)
+    if header is not None:
+        return _matchETag(header, etag)
+    header = REQUEST.get_header('If-Modified-Since', None)
+    if header is None or mtime is None:
+        return False
+    since = _parseDate(header)
+    return since is not None and long(mtime) <= since
+
+
+def _ifRange(REQUEST, etag=None, mtime=None):
+    """Return whether a Range header should be honoured."""
+    header = REQUEST.get_header('If-Range', None)
+    if header is None:
+        return True
+    header = header.strip()
+    if header.startswith('"') or header.startswith('W/'):
+        # Only strong ETags may be used with ranges
+        return etag is not None and header == etag
+    since = _parseDate(header)
+    return since is not None and mtime is not None and long(mtime) <= since
+
+
+def _slice(data, size, start, end):
+    if isinstance(data, str):
+        return data[start:end]
+    return PdataStreamIterator(data, size, start=start, end=end)
+
+
+class MultiPartStreamIterator(object):
+    """Streams the strings and stream iterators of a multipart body in
+    turn.
+    """
+
+    implements(IStreamIterator)
+
+    def __init__(self, parts):
+        self.size = sum([len(part) for part in parts])
+        self._parts = iter(parts)
+        self._current = iter(())
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while True:
+            try:
+                return self._current.next()
+            except StopIteration:
+                # Raises StopIteration after the last part
+                part = self._parts.next()
+                if isinstance(part, str):
+                    part = [part]
+                self._current = iter(part)
+
+    def __len__(self):
+        return self.size
+
+
+def sendData(REQUEST, RESPONSE, getData, content_type, size=None,
+             etag=None, mtime=None):
+    """Send the data returned by getData(), a string or a Pdata chain.
+
+    getData is only called if the body is sent. size is the length of the
+    data, it is computed from a string if not given. etag and mtime
+    describe the stored revision of the data and are used to answer
+    conditional requests.
+    """
+    if etag is not None:
+        RESPONSE.setHeader('ETag', etag)
+    if mtime is not None:
+        RESPONSE.setHeader('Last-Modified', rfc1123_date(mtime))
+    if isNotModified(REQUEST, etag, mtime):
+        RESPONSE.setStatus(304)
+        return ''
+
+    data = getData()
+    if size is None:
+        size = len(data)
+    RESPONSE.setHeader('Accept-Ranges', 'bytes')
+
+    header = REQUEST.get_header('Range', None)
+    ranges = header and _ifRange(REQUEST, etag, mtime) and parseRange(header)
+    if not ranges:
+        RESPONSE.setHeader('Content-Type', content_type)
+        RESPONSE.setHeader('Content-Length', size)
+        return _slice(data, size, 0, size)
+
+    ranges = expandRanges(ranges, size)
+    if not ranges:
+        RESPONSE.setStatus(416)
+        RESPONSE.setHeader('Content-Range', 'bytes */%d' % size)
+        RESPONSE.setHeader('Content-Length', 0)
+        return ''
+
+    RESPONSE.setStatus(206)
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        RESPONSE.setHeader('Content-Type', content_type)
+        RESPONSE.setHeader('Content-Range',
+                           'bytes %d-%d/%d' % (start, end - 1, size))
+        RESPONSE.setHeader('Content-Length', end - start)
+        return _slice(data, size, start, end)
+
+    boundary = choose_boundary()
+    parts = []
+    for start, end in ranges:
+        parts.append('\r\n--%s\r\nContent-Type: %s\r\n'
+                     'Content-Range: bytes %d-%d/%d\r\n\r\n' % (
+            boundary, content_type, start, end - 1, size))
+        parts.append(_slice(data, size, start, end))
+    parts.append('\r\n--%s--\r\n' % boundary)
+    RESPONSE.setHeader('Content-Type',
+                       'multipart/byteranges; boundary=%s' % boundary)
+    if isinstance(data, str):
+        body = ''.join(parts)
+        RESPONSE.setHeader('Content-Length', len(body))
+        return body
+    body = MultiPartStreamIterator(parts)
+    RESPONSE.setHeader('Content-Length', len(body))
+    return body
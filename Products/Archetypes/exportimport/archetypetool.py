@@ -35,6 +35,7 @@ class ArchetypeToolXMLAdapter(XMLAdapterBase):
 
     def _purgeCatalogSettings(self):
         self.context.catalog_map.clear()
+        self.context._invalidateCatalogCache()
 
     def _initCatalogSettings(self, node):
         for child in node.childNodes:
@@ -72,6 +73,8 @@ def importArchetypeTool(context):
         return
 
     importObjects(tool, '', context)
+    # Catalogs may have been added or removed by other steps
+    tool._invalidateCatalogCache()
     logger.info("Archetype tool imported.")
 
 
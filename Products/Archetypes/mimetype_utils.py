@@ -1,4 +1,9 @@
+import os.path
+from hashlib import md5
+
 from Products.CMFCore.utils import getToolByName
+from Products.Archetypes import config
+from Products.Archetypes.utils import LRUCache
 
 #
 # default- and allowable content type handling
@@ -50,3 +55,59 @@ def getForbiddenContentTypes(context):
             if site_properties.hasProperty('forbidden_contenttypes'):
                 return list(site_properties.getProperty('forbidden_contenttypes'))
     return []
+
+#
+# mimetype detection
+#
+
+# Leading bytes of common binary formats which can't be mistaken for
+# anything else.
+MAGIC_NUMBERS = (
+    ('%PDF-', 'application/pdf'),
+    ('\x89PNG\r\n\x1a\n', 'image/png'),
+    ('GIF87a', 'image/gif'),
+    ('GIF89a', 'image/gif'),
+    ('\xff\xd8\xff', 'image/jpeg'),
+    ('II*\x00', 'image/tiff'),
+    ('MM\x00*', 'image/tiff'),
+    ('\x1f\x8b\x08', 'application/x-gzip'),
+    )
+
+_classified = LRUCache(config.MIMETYPE_CACHE_SIZE)
+
+def sniffMimetype(data):
+    """ returns the mimetype of data if it starts with one of the
+        MAGIC_NUMBERS, otherwise None."""
+    for magic, mimetype in MAGIC_NUMBERS:
+        if data.startswith(magic):
+            return mimetype
+    return None
+
+def classifyMimetype(mtr, data, filename=None):
+    """ returns the name of the mimetype of data like mtr.classify.
+
+        A mimetype known for the extension of filename wins, like in the
+        registry. Otherwise data is sniffed for MAGIC_NUMBERS before asking
+        the registry, and the result is cached per process by a hash of
+        data and the extension.
+    """
+    if filename:
+        mimetype = mtr.lookupExtension(filename)
+        if mimetype is not None:
+            return str(mimetype)
+    if not isinstance(data, str):
+        mimetype = mtr.classify(data, filename=filename)
+        return mimetype and str(mimetype) or None
+    extension = os.path.splitext(filename or '')[1].lower()
+    key = (md5(data).digest(), extension)
+    result = _classified.get(key)
+    if result is None:
+        result = sniffMimetype(data)
+        if result is None:
+            mimetype = mtr.classify(data, filename=filename)
+            result = mimetype and str(mimetype) or ''
+        _classified.set(key, result)
+    return result or None
+
+def clearMimetypeCache():
+    _classified.clear()
@@ -46,6 +46,16 @@ def install_referenceCatalog(out, site, rebuild=False):
             reindex = True
     if reindex:
         catalog.manage_reindexIndex()
+    if catalog._adjacency is None:
+        catalog.rebuildAdjacency()
+
+
+def upgradeAdjacency(context):
+    """Upgrade step from 1.6: build the adjacency index of the reference
+    catalog from its indexes.
+    """
+    catalog = getToolByName(context, REFERENCE_CATALOG)
+    catalog.rebuildAdjacency()
 
 
 def install_templates(out, site):
@@ -0,0 +1,66 @@
+from Products.Archetypes.adjacency import AdjacencyIndex
+from Products.Archetypes.tests.attestcase import ATTestCase
+
+
+class AdjacencyIndexTest(ATTestCase):
+
+    def afterSetUp(self):
+        self.index = index = AdjacencyIndex()
+        # a -> b -> c -> a is a cycle, d hangs off c, e is reached by
+        # another relationship
+        index.add('r1', 'a', 'b', 'rel')
+        index.add('r2', 'b', 'c', 'rel')
+        index.add('r3', 'c', 'a', 'rel')
+        index.add('r4', 'c', 'd', 'rel')
+        index.add('r5', 'a', 'e', 'other')
+
+    def uids(self, *args, **kw):
+        return [uid for uid, distance in self.index.traverse(*args, **kw)]
+
+    def test_add_remove(self):
+        index = self.index
+        index.add('r6', 'a', 'b', 'rel')
+        self.assertEquals(len(index), 6)
+        self.assertEquals(index.targets('a', 'rel'), ['b', 'b'])
+        index.remove('r6')
+        index.remove('r6')
+        self.assertEquals(index.targets('a'), ['e', 'b'])
+        self.assertEquals(sorted(index.relationships('a')), ['other', 'rel'])
+        index.remove('r5')
+        self.assertEquals(index.relationships('a'), ['rel'])
+        self.assertEquals(index.backRelationships('e'), [])
+
+    def test_traverse(self):
+        self.assertEquals(list(self.index.traverse('a', 'rel')),
+                          [('b', 1), ('c', 2), ('d', 3)])
+        self.assertEquals(self.uids('a'), ['b', 'e', 'c', 'd'])
+        self.assertEquals(self.uids('a', 'rel', depth=2), ['b', 'c'])
+        self.assertEquals(self.uids('d', backwards=True), ['c', 'b', 'a'])
+        self.assertEquals(self.uids('a', depth_first=True),
+                          ['b', 'c', 'd', 'e'])
+
+    def test_traverse_depth_first_with_depth(self):
+        # uids at the depth limit are yielded, but not expanded
+        self.assertEquals(list(self.index.traverse('a', depth=1,
+                                                   depth_first=True)),
+                          [('b', 1), ('e', 1)])
+        self.assertEquals(list(self.index.traverse('a', 'rel', depth=2,
+                                                   depth_first=True)),
+                          [('b', 1), ('c', 2)])
+        self.assertEquals(self.uids('a', 'rel', depth=3, depth_first=True),
+                          ['b', 'c', 'd'])
+
+    def test_shortest_path(self):
+        index = self.index
+        self.assertEquals(index.shortestPath('a', 'd'), ['a', 'b', 'c', 'd'])
+        self.assertEquals(index.shortestPath('a', 'd', depth=2), None)
+        self.assertEquals(index.shortestPath('a', 'e', 'rel'), None)
+        self.assertEquals(index.shortestPath('d', 'b', backwards=True),
+                          ['d', 'c', 'b'])
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(AdjacencyIndexTest))
+    return suite
@@ -25,6 +25,7 @@
 
 from Products.Archetypes.tests.atsitetestcase import ATSiteTestCase
 from Products.Archetypes.tests.utils import mkDummyInContext
+from Products.Archetypes.tests.utils import makeContent
 
 from Products.Archetypes import PloneMessageFactory as _
 from Products.Archetypes.atapi import *
@@ -115,6 +116,50 @@ class BaseObjectTest(ATSiteTestCase):
         self.failUnless(searchable.startswith("What do you expect of a Dummy"))
         del Dummy.myMethod
 
+    def test_charsetIsCachedPerTransaction(self):
+        from Products.Archetypes.BaseObject import _transactionCharsets
+        doc = makeContent(self.folder, portal_type='SimpleType', id='doc')
+        props = self.portal.portal_properties.site_properties
+        charset = props.getProperty('default_charset')
+        self.assertEqual(doc.getCharset(), charset)
+        props.manage_changeProperties(default_charset='latin-1')
+        self.assertEqual(doc.getCharset(), charset)
+        # A new transaction starts with an empty cache
+        _transactionCharsets().clear()
+        self.assertEqual(doc.getCharset(), 'latin-1')
+
+    def test_getSizeUsesRecordedSizes(self):
+        doc = makeContent(self.folder, portal_type='SimpleType', id='doc')
+        doc.setTitle('abc')
+        self.assertEqual(doc._field_sizes['title'], 3)
+        expected = 0
+        for field in doc.Schema().fields():
+            expected += field.get_size(doc)
+        self.assertEqual(doc.get_size(), expected)
+        # Recorded sizes are used without asking the field
+        doc._setFieldSize('title', 1000)
+        self.assertEqual(doc.get_size(), expected - 3 + 1000)
+        # Fields without a recorded size are asked
+        doc._setFieldSize('title', None)
+        self.failIf('title' in doc._field_sizes)
+        self.assertEqual(doc.get_size(), expected)
+
+    def test_storageDropsRecordedSize(self):
+        doc = makeContent(self.folder, portal_type='SimpleType', id='doc')
+        doc.setTitle('abc')
+        doc._setFieldSize('title', 1000)
+        # Values stored without the field are measured again
+        field = doc.getField('title')
+        field.getStorage(doc).set('title', doc, 'abcdef')
+        self.failIf('title' in doc._field_sizes)
+        expected = 0
+        for field in doc.Schema().fields():
+            expected += field.get_size(doc)
+        self.assertEqual(doc.get_size(), expected)
+        field = doc.getField('title')
+        field.getStorage(doc).unset('title', doc)
+        self.failIf('title' in doc._field_sizes)
+
     def test_authenticatedContentType(self):
         """See https://dev.plone.org/archetypes/ticket/712
 
@@ -37,7 +37,15 @@ from Products.Archetypes.ExtensibleMetadata import FLOOR_DATE
 from Products.Archetypes.ExtensibleMetadata import CEILING_DATE
 from Products.validation import ValidationChain
 
+from Acquisition import aq_base
 from DateTime import DateTime
+from zope.component import adapter
+from zope.component import getSiteManager
+from zope.interface import Interface
+from zope.interface import alsoProvides
+from zope.interface import implementer
+from zope.interface import noLongerProvides
+from Products.Archetypes.interfaces import ISchema
 
 Dummy.schema = BaseSchema
 
@@ -402,8 +410,43 @@ class BaseSchemaTest(ATSiteTestCase):
         self.failUnless(dummy.expiration_date.tzoffset() == 7200)
 
 
+class ISchemaMarker(Interface):
+    pass
+
+
+class SchemaLookupTest(ATSiteTestCase):
+
+    def afterSetUp(self):
+        self.calls = []
+        def factory(context):
+            self.calls.append(context)
+            return BaseSchema + Schema((StringField('extra'),))
+        self.factory = implementer(ISchema)(adapter(ISchemaMarker)(factory))
+        getSiteManager().registerAdapter(self.factory)
+        self.dummy = Dummy(oid='dummy').__of__(self.portal)
+
+    def beforeTearDown(self):
+        getSiteManager().unregisterAdapter(self.factory)
+
+    def test_default_schema(self):
+        self.failUnless(aq_base(self.dummy.Schema()) is Dummy.schema)
+        self.assertEquals(self.calls, [])
+
+    def test_adapted_schema(self):
+        dummy = self.dummy
+        alsoProvides(dummy, ISchemaMarker)
+        schema = dummy.Schema()
+        self.failUnless('extra' in schema)
+        self.failUnless(aq_base(dummy.Schema()) is aq_base(schema))
+        self.assertEquals(len(self.calls), 1)
+
+        noLongerProvides(dummy, ISchemaMarker)
+        self.failIf('extra' in dummy.Schema())
+
+
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
     suite.addTest(makeSuite(BaseSchemaTest))
+    suite.addTest(makeSuite(SchemaLookupTest))
     return suite
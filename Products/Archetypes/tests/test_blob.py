@@ -0,0 +1,162 @@
+import shutil
+import struct
+import tempfile
+from cStringIO import StringIO
+
+import transaction
+from Acquisition import aq_base
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
+from ZODB.blob import BlobStorage
+from ZPublisher.Iterators import filestream_iterator
+
+from Products.Archetypes.atapi import BaseContent
+from Products.Archetypes.atapi import BaseSchema
+from Products.Archetypes.atapi import Schema
+from Products.Archetypes.blob import BlobChunk
+from Products.Archetypes.blob import BlobFile
+from Products.Archetypes.blob import BlobFileField
+from Products.Archetypes.blob import BlobImage
+from Products.Archetypes.blob import CHUNK_SIZE
+from Products.Archetypes.blob import HEAD_SIZE
+from Products.Archetypes.utils import iterData
+from Products.Archetypes.tests.attestcase import ATTestCase
+from Products.Archetypes.tests.atsitetestcase import ATSiteTestCase
+from Products.Archetypes.tests.utils import gen_class
+
+DATA = ''.join([chr(i % 256) for i in range(CHUNK_SIZE * 2 + 10)])
+GIF = 'GIF89a\x10\x00\x20\x00' + '\x00' * 20
+# A 16x32 JPEG whose size comes after HEAD_SIZE bytes of EXIF data
+EXIF = '\xff\xe1' + struct.pack('>H', 40002) + 'x' * 40000
+JPEG = ('\xff\xd8' + EXIF * 2 + '\xff\xc0' + struct.pack('>HBHH', 17, 8, 32, 16)
+        + '\x00' * 10 + '\xff\xd9')
+
+
+class CountingBlob:
+    """Counts how often the data is opened."""
+
+    def __init__(self, data):
+        self.data = data
+        self.opened = 0
+
+    def open(self, mode='r'):
+        self.opened += 1
+        return StringIO(self.data)
+
+
+class BlobDatabase:
+
+    def afterSetUp(self):
+        self.blob_dir = tempfile.mkdtemp()
+        self.db = DB(BlobStorage(self.blob_dir, MappingStorage()))
+        self.tm = transaction.TransactionManager()
+        self.conn = self.db.open(transaction_manager=self.tm)
+        self.root = self.conn.root()
+
+    def beforeTearDown(self):
+        self.tm.abort()
+        self.conn.close()
+        self.db.close()
+        shutil.rmtree(self.blob_dir)
+
+
+class BlobFileTest(BlobDatabase, ATTestCase):
+
+    def test_data(self):
+        f = BlobFile('file', '', DATA, 'application/octet-stream')
+        self.assertEquals(f.get_size(), len(DATA))
+        self.assertEquals(str(f.data), DATA)
+        self.assertEquals(len(f.data), len(DATA))
+        chunks = list(iterData(f.data))
+        self.assertEquals(len(chunks), 3)
+        self.assertEquals(''.join(chunks), DATA)
+
+    def test_upload_from_file(self):
+        f = BlobFile('file', '', '')
+        self.assertEquals(f.get_size(), 0)
+        f.manage_upload(StringIO(DATA))
+        self.assertEquals(f.get_size(), len(DATA))
+        self.assertEquals(str(f.data), DATA)
+        # Copy from another file
+        other = BlobFile('other', '', f)
+        self.assertEquals(str(other.data), DATA)
+
+    def test_iterator(self):
+        f = BlobFile('file', '', DATA)
+        # Not committed yet
+        self.assertEquals(f.getIterator(), DATA)
+        self.root['file'] = f
+        self.tm.commit()
+        iterator = f.getIterator()
+        self.failUnless(isinstance(iterator, filestream_iterator))
+        self.assertEquals(''.join(list(iterator)), DATA)
+
+    def test_image_size(self):
+        image = BlobImage('image', '', GIF)
+        self.assertEquals(image.content_type, 'image/gif')
+        self.assertEquals((image.width, image.height), (16, 32))
+        self.failUnless(len(JPEG) > HEAD_SIZE)
+        image = BlobImage('image', '', JPEG)
+        self.assertEquals(image.content_type, 'image/jpeg')
+        self.assertEquals((image.width, image.height), (16, 32))
+
+    def test_chunks_share_file(self):
+        blob = CountingBlob(DATA)
+        data = BlobChunk(blob)
+        self.assertEquals(''.join(list(iterData(data))), DATA)
+        self.assertEquals(blob.opened, 1)
+        # Walking again opens the file again, once
+        self.assertEquals(''.join(list(iterData(data))), DATA)
+        self.assertEquals(blob.opened, 2)
+        self.assertEquals(str(data.next), DATA[CHUNK_SIZE:])
+
+
+class BlobDocument(BaseContent):
+    schema = BaseSchema + Schema((
+        BlobFileField('file'),
+        ))
+
+
+class BlobFileFieldTest(BlobDatabase, ATSiteTestCase):
+    """A blob file field on content stored in a blob enabled database,
+    used from the test site."""
+
+    def afterSetUp(self):
+        ATSiteTestCase.afterSetUp(self)
+        BlobDatabase.afterSetUp(self)
+        gen_class(BlobDocument)
+        self.root['doc'] = BlobDocument(oid='doc')
+        self.tm.commit()
+        self.doc = self.root['doc'].__of__(self.folder)
+        self.doc.initializeArchetype()
+        self.field = self.doc.getField('file')
+
+    def beforeTearDown(self):
+        BlobDatabase.beforeTearDown(self)
+        ATSiteTestCase.beforeTearDown(self)
+
+    def test_set_and_read(self):
+        text = 'Some text in a blob.\n' * (CHUNK_SIZE / 10)
+        self.field.set(self.doc, text, mimetype='text/plain',
+                       filename='text.txt')
+        self.tm.commit()
+        stored = self.field.get(self.doc, raw=True)
+        self.failUnless(isinstance(aq_base(stored), BlobFile))
+        self.assertEquals(self.field.get_size(self.doc), len(text))
+        self.assertEquals(self.field.getContentType(self.doc), 'text/plain')
+
+        request = self.app.REQUEST
+        body = self.field.download(self.doc, request, request.RESPONSE)
+        self.assertEquals(''.join(list(body)), text)
+        self.assertEquals(int(request.RESPONSE.getHeader('Content-Length')),
+                          len(text))
+
+        self.assertEquals(self.field.getIndexable(self.doc), text)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(BlobFileTest))
+    suite.addTest(makeSuite(BlobFileFieldTest))
+    return suite
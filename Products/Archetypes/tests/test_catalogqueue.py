@@ -0,0 +1,101 @@
+from Products.CMFCore.utils import getToolByName
+
+from Products.Archetypes import config
+from Products.Archetypes.catalogqueue import CatalogQueue
+from Products.Archetypes.catalogqueue import getQueue
+from Products.Archetypes.catalogqueue import processQueue
+from Products.Archetypes.tests.attestcase import ATTestCase
+from Products.Archetypes.tests.atsitetestcase import ATSiteTestCase
+from Products.Archetypes.tests.utils import makeContent
+
+
+class DummyContent(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def _indexObject(self, url):
+        self.calls.append(('index', url))
+
+    def _reindexObject(self, url, idxs=[]):
+        self.calls.append(('reindex', url, idxs))
+
+
+class CatalogQueueTest(ATTestCase):
+
+    def test_reindex_merges_idxs(self):
+        queue = CatalogQueue()
+        ob = DummyContent()
+        queue.reindex(ob, '/a', ['Title'])
+        queue.reindex(ob, '/a', ['Title', 'Description'])
+        self.assertEquals(len(queue), 1)
+        self.assertEquals(queue.process(), 1)
+        self.assertEquals(ob.calls,
+                          [('reindex', '/a', ['Title', 'Description'])])
+
+    def test_full_reindex_wins(self):
+        queue = CatalogQueue()
+        ob = DummyContent()
+        queue.reindex(ob, '/a', ['Title'])
+        queue.reindex(ob, '/a')
+        queue.reindex(ob, '/a', ['Description'])
+        queue.process()
+        self.assertEquals(ob.calls, [('reindex', '/a', [])])
+
+    def test_index_absorbs_partial_reindex(self):
+        queue = CatalogQueue()
+        ob = DummyContent()
+        queue.index(ob, '/a')
+        queue.reindex(ob, '/a', ['Title'])
+        queue.process()
+        self.assertEquals(ob.calls, [('index', '/a')])
+
+    def test_discard(self):
+        queue = CatalogQueue()
+        ob = DummyContent()
+        queue.index(ob, '/a')
+        queue.reindex(ob, '/b')
+        queue.discard('/a')
+        queue.process()
+        self.assertEquals(ob.calls, [('reindex', '/b', [])])
+
+
+class QueuedIndexingTest(ATSiteTestCase):
+
+    def afterSetUp(self):
+        self.setRoles(['Manager'])
+        self._old = config.QUEUE_CATALOG_OPERATIONS
+        config.QUEUE_CATALOG_OPERATIONS = True
+        self.inst = makeContent(self.portal,
+                                portal_type='SimpleType',
+                                id='simple_type')
+        processQueue()
+        self.ct = getToolByName(self.portal, 'portal_catalog')
+
+    def beforeTearDown(self):
+        config.QUEUE_CATALOG_OPERATIONS = self._old
+
+    def test_reindex_is_deferred(self):
+        ct = self.ct
+        self.inst.edit(title='Mosquito')
+        self.inst.reindexObject(idxs=['Title'])
+        self.assertEquals(len(getQueue()), 1)
+        self.assertEquals(len(ct(SearchableText='Mosquito')), 0)
+        processQueue()
+        self.assertEquals(len(getQueue()), 0)
+        self.assertEquals(len(ct(SearchableText='Mosquito')), 1)
+
+    def test_unindex_drops_pending(self):
+        ct = self.ct
+        self.inst.reindexObject()
+        self.inst.unindexObject()
+        self.assertEquals(len(getQueue()), 0)
+        self.assertEquals(len(ct(getId='simple_type')), 0)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(CatalogQueueTest))
+    suite.addTest(makeSuite(QueuedIndexingTest))
+    return suite
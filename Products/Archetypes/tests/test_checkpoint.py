@@ -0,0 +1,158 @@
+import time
+
+import transaction
+from OFS.Folder import Folder
+from OFS.SimpleItem import SimpleItem
+from Testing import ZopeTestCase
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
+
+from Products.Archetypes.checkpoint import CLAIM_TIMEOUT
+from Products.Archetypes.checkpoint import Checkpoint
+from Products.Archetypes.checkpoint import iterPartition
+from Products.Archetypes.checkpoint import processPartitions
+from Products.Archetypes.checkpoint import walk
+from Products.Archetypes.tests.attestcase import ATTestCase
+
+
+class Item(SimpleItem):
+
+    meta_type = 'Item'
+
+    def __init__(self, id):
+        self.id = id
+
+
+class WalkTest(ATTestCase):
+
+    def afterSetUp(self):
+        self.folder._setObject('root', Folder('root'))
+        self.root = root = self.folder.root
+        root._setObject('a', Folder('a'))
+        root.a._setObject('b', Folder('b'))
+        root.a.b._setObject('c', Item('c'))
+        root.a._setObject('d', Item('d'))
+        root._setObject('a-z', Item('a-z'))
+        root._setObject('e', Item('e'))
+
+    def paths(self, **kw):
+        return [p for p, obj in walk(self.root, **kw)]
+
+    def test_walk_order(self):
+        self.assertEquals(self.paths(),
+                          [('a',), ('a', 'b'), ('a', 'b', 'c'), ('a', 'd'),
+                           ('a-z',), ('e',)])
+
+    def test_walk_after(self):
+        self.assertEquals(self.paths(after=('a', 'b')),
+                          [('a', 'b', 'c'), ('a', 'd'), ('a-z',), ('e',)])
+        self.assertEquals(self.paths(after=('a', 'd')),
+                          [('a-z',), ('e',)])
+
+    def test_walk_predicate(self):
+        isItem = lambda obj: obj.meta_type == 'Item'
+        self.assertEquals(self.paths(predicate=isItem),
+                          [('a', 'b', 'c'), ('a', 'd'), ('a-z',), ('e',)])
+
+    def test_iter_partition(self):
+        paths = [p for p, obj in iterPartition(self.root, 'a')]
+        self.assertEquals(paths, [('a',), ('a', 'b'), ('a', 'b', 'c'),
+                                  ('a', 'd')])
+        paths = [p for p, obj in iterPartition(self.root, 'a', ('a', 'b'))]
+        self.assertEquals(paths, [('a', 'b', 'c'), ('a', 'd')])
+
+
+class CheckpointTest(ATTestCase):
+
+    def test_claim(self):
+        cp = Checkpoint('test', ['a', 'b'])
+        self.assertEquals(cp.claim('w1'), 'a')
+        # a worker resumes its own partition first
+        self.assertEquals(cp.claim('w1'), 'a')
+        self.assertEquals(cp.claim('w2'), 'b')
+        self.assertEquals(cp.claim('w3'), None)
+
+        cp.advance('a', ('a', 'x'), 10)
+        cp.finish('a')
+        self.assertEquals(cp.position('a'), ('a', 'x'))
+        self.assertEquals(cp.progress(), (1, 2, 10))
+        self.failIf(cp.isDone())
+
+        cp.release('w2')
+        self.assertEquals(cp.claim('w3'), 'b')
+        cp.finish('b')
+        self.failUnless(cp.isDone())
+
+    def test_stale_claim(self):
+        cp = Checkpoint('test', ['a'])
+        self.assertEquals(cp.claim('w1'), 'a')
+        self.assertEquals(cp.claim('w2'), None)
+        # No sign of life from w1 for too long
+        cp._claims['a'] = ('w1', time.time() - CLAIM_TIMEOUT - 1)
+        self.assertEquals(cp.claim('w2'), 'a')
+        self.assertEquals(cp.owner('a'), 'w2')
+        # Committing a batch keeps the claim alive
+        cp.advance('a', 1, 1)
+        self.assertEquals(cp.claim('w1', timeout=60), None)
+        self.assertEquals(cp.claim('w1', timeout=0), 'a')
+
+
+class Crash(Exception):
+    pass
+
+
+class ProcessPartitionsTest(ZopeTestCase.Sandboxed, ATTestCase):
+    """processPartitions commits, so the checkpoint lives in a database
+    of its own."""
+
+    def afterSetUp(self):
+        self.db = DB(MappingStorage())
+        self.conn = self.db.open()
+        self.cp = self.conn.root()['cp'] = Checkpoint('test', ['a', 'b'])
+        transaction.commit()
+        self.seen = []
+
+    def beforeTearDown(self):
+        transaction.abort()
+        self.conn.close()
+        self.db.close()
+
+    def items(self, partition, after):
+        for i in range(5):
+            if after is None or i > after:
+                yield i, (partition, i)
+
+    def apply(self, obj, position):
+        if obj == self.crash_at:
+            raise Crash()
+        self.seen.append(obj)
+
+    def test_resume_after_crash(self):
+        self.crash_at = ('a', 3)
+        self.assertRaises(Crash, processPartitions, self.cp, self.items,
+                          self.apply, batch_size=2, worker='host:1')
+        transaction.abort()
+        self.crash_at = None
+        del self.seen[:]
+        # The restarted worker has a new name; the claim is still fresh
+        count = processPartitions(self.cp, self.items, self.apply,
+                                  batch_size=2, worker='host:2')
+        self.assertEquals(count, 5)
+        self.failIf(self.cp.isDone())
+        # Once the claim is stale the partition is taken over and resumed
+        count = processPartitions(self.cp, self.items, self.apply,
+                                  batch_size=2, worker='host:2',
+                                  claim_timeout=0)
+        self.assertEquals(count, 3)
+        self.assertEquals(self.seen[5:], [('a', 2), ('a', 3), ('a', 4)])
+        self.failUnless(self.cp.isDone())
+        self.assertEquals(self.cp.processed(), 10)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(WalkTest))
+    suite.addTest(makeSuite(CheckpointTest))
+    suite.addTest(makeSuite(ProcessPartitionsTest))
+    return suite
@@ -0,0 +1,138 @@
+import sys
+from cStringIO import StringIO
+
+import transaction
+from OFS.Image import File
+from OFS.Image import Pdata
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
+from ZPublisher.HTTPRequest import HTTPRequest
+from ZPublisher.HTTPResponse import HTTPResponse
+
+from Products.Archetypes.download import sendData
+from Products.Archetypes.download import storedETag
+from Products.Archetypes.tests.attestcase import ATTestCase
+
+DATA = '0123456789' * 3
+
+
+def makeRequest(**headers):
+    environ = {'SERVER_NAME': 'foo',
+               'SERVER_PORT': '80',
+               'REQUEST_METHOD': 'GET'}
+    for name, value in headers.items():
+        environ['HTTP_' + name.upper()] = value
+    response = HTTPResponse(stdout=sys.stdout)
+    return HTTPRequest(StringIO(), environ, response)
+
+
+def chain(data, size=7):
+    start = pdata = Pdata(data[:size])
+    for i in range(size, len(data), size):
+        pdata.next = Pdata(data[i:i + size])
+        pdata = pdata.next
+    return start
+
+
+class DownloadTest(ATTestCase):
+
+    def send(self, data, etag=None, mtime=None, **headers):
+        request = makeRequest(**headers)
+        self.response = request.RESPONSE
+        self.loaded = False
+        def getData():
+            self.loaded = True
+            return data
+        body = sendData(request, self.response, getData, 'text/plain',
+                        len(DATA), etag=etag, mtime=mtime)
+        if not isinstance(body, str):
+            body = ''.join(list(body))
+        return body
+
+    def test_full(self):
+        self.assertEquals(self.send(DATA), DATA)
+        self.assertEquals(self.response.getStatus(), 200)
+        self.assertEquals(self.response.getHeader('Accept-Ranges'), 'bytes')
+        self.assertEquals(self.send(chain(DATA)), DATA)
+
+    def test_not_modified(self):
+        body = self.send(DATA, etag='"1.2"', if_none_match='"1.1", "1.2"')
+        self.assertEquals(body, '')
+        self.assertEquals(self.response.getStatus(), 304)
+        self.failIf(self.loaded)
+        self.assertEquals(self.send(DATA, etag='"1.3"',
+                                    if_none_match='"1.2"'), DATA)
+        self.failUnless(self.loaded)
+
+        mtime = 1000000000
+        self.send(DATA, mtime=mtime,
+                  if_modified_since='Sun, 09 Sep 2001 01:46:40 GMT')
+        self.assertEquals(self.response.getStatus(), 304)
+        self.failIf(self.loaded)
+        self.send(DATA, mtime=mtime + 60,
+                  if_modified_since='Sun, 09 Sep 2001 01:46:40 GMT')
+        self.assertEquals(self.response.getStatus(), 200)
+
+    def test_single_range(self):
+        for data in (DATA, chain(DATA)):
+            self.assertEquals(self.send(data, range='bytes=5-14'),
+                              DATA[5:15])
+            self.assertEquals(self.response.getStatus(), 206)
+            self.assertEquals(self.response.getHeader('Content-Range'),
+                              'bytes 5-14/30')
+            self.assertEquals(self.send(data, range='bytes=-4'), DATA[-4:])
+
+    def test_unsatisfiable_range(self):
+        self.assertEquals(self.send(DATA, range='bytes=40-50'), '')
+        self.assertEquals(self.response.getStatus(), 416)
+        self.assertEquals(self.response.getHeader('Content-Range'),
+                          'bytes */30')
+
+    def test_if_range(self):
+        body = self.send(DATA, etag='"1.2"', range='bytes=0-1',
+                         if_range='"1.1"')
+        self.assertEquals(body, DATA)
+        body = self.send(DATA, etag='"1.2"', range='bytes=0-1',
+                         if_range='"1.2"')
+        self.assertEquals(body, DATA[:2])
+
+    def test_multiple_ranges(self):
+        for data in (DATA, chain(DATA)):
+            body = self.send(data, range='bytes=0-1,20-24')
+            self.assertEquals(self.response.getStatus(), 206)
+            content_type = self.response.getHeader('Content-Type')
+            self.failUnless(content_type.startswith('multipart/byteranges'))
+            boundary = content_type.split('boundary=')[1]
+            self.assertEquals(int(self.response.getHeader('Content-Length')),
+                              len(body))
+            parts = body.split('--' + boundary)
+            self.assertEquals(len(parts), 4)
+            self.failUnless(parts[1].endswith('\r\n\r\n01\r\n'))
+            self.failUnless('Content-Range: bytes 20-24/30' in parts[2])
+            self.failUnless(parts[2].endswith('\r\n\r\n01234\r\n'))
+
+    def test_stored_etag(self):
+        db = DB(MappingStorage())
+        tm = transaction.TransactionManager()
+        conn = db.open(transaction_manager=tm)
+        try:
+            f = conn.root()['file'] = File('file', '', DATA)
+            self.assertEquals(storedETag(f), None)
+            tm.commit()
+            etag = storedETag(f)
+            self.failIf(etag is None)
+            self.assertEquals(storedETag(f), etag)
+            f.update_data('other')
+            tm.commit()
+            self.failIf(storedETag(f) in (None, etag))
+        finally:
+            tm.abort()
+            conn.close()
+            db.close()
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(DownloadTest))
+    return suite
@@ -27,7 +27,9 @@
 
 import time
 from Testing import ZopeTestCase
+from Acquisition import aq_base
 from Products.Archetypes.atapi import *
+from Products.Archetypes import config
 from Products.Archetypes.tests.atsitetestcase import ATSiteTestCase
 from Products.CMFCore.utils import getToolByName
 from Products.Archetypes.tests.utils import makeContent
@@ -90,6 +92,74 @@ class ReindexTest(ATSiteTestCase):
         self.assertEquals(len(ct(SearchableText='Mosquito')), 0)
 
 
+class ChangeDetectionTest(ATSiteTestCase):
+
+    def afterSetUp(self):
+        self.setRoles(['Manager'])
+        self._old = config.CATALOG_CHANGE_DETECTION
+        config.CATALOG_CHANGE_DETECTION = True
+        self.inst = makeContent(self.portal,
+                                portal_type='SimpleType',
+                                id='simple_type')
+        self.ct = getToolByName(self.portal, 'portal_catalog')
+        self.calls = calls = []
+        original = self.ct.catalog_object
+        def catalog_object(obj, uid=None, idxs=None, update_metadata=1,
+                           **kw):
+            calls.append((idxs, update_metadata))
+            return original(obj, uid, idxs=idxs,
+                            update_metadata=update_metadata, **kw)
+        self.ct.catalog_object = catalog_object
+
+    def beforeTearDown(self):
+        del self.ct.catalog_object
+        config.CATALOG_CHANGE_DETECTION = self._old
+
+    def test_changed_value_is_indexed(self):
+        ct = self.ct
+        self.inst.edit(title='Mosquito')
+        self.assertEquals(len(ct(SearchableText='Mosquito')), 1)
+        self.inst.edit(title='Libido')
+        self.assertEquals(len(ct(SearchableText='Mosquito')), 0)
+        self.assertEquals(len(ct(SearchableText='Libido')), 1)
+
+    def test_unchanged_indexes_are_skipped(self):
+        self.inst.reindexObject(idxs=['Title'])
+        del self.calls[:]
+        self.inst.reindexObject(idxs=['Title'])
+        self.assertEquals(self.calls, [])
+
+        self.inst.setTitle('Mosquito')
+        self.inst.reindexObject(idxs=['Title', 'getId'])
+        self.assertEquals(self.calls, [(['Title'], True)])
+
+    def test_security_reindex_forgets_fingerprints(self):
+        ct = self.ct
+        inst = self.inst
+        index = ct._catalog.getIndex('allowedRolesAndUsers')
+        rid = ct._catalog.uids['/'.join(inst.getPhysicalPath())]
+        inst.reindexObject()
+        before = index.getEntryForObject(rid)
+
+        roles = [r['name'] for r in inst.rolesOfPermission('View')
+                 if r['selected']]
+        inst.manage_permission('View', ['Manager'], acquire=0)
+        inst.reindexObjectSecurity()
+        self.failIf(index.getEntryForObject(rid) == before)
+
+        # Back to the original value, which must be written again
+        inst.manage_permission('View', roles, acquire=1)
+        inst.reindexObject(idxs=['allowedRolesAndUsers'])
+        self.assertEquals(index.getEntryForObject(rid), before)
+
+    def test_recatalog_after_uncatalog(self):
+        ct = self.ct
+        self.inst.reindexObject()
+        ct.uncatalog_object('/'.join(self.inst.getPhysicalPath()))
+        self.inst.reindexObject()
+        self.assertEquals(len(ct(getId='simple_type')), 1)
+
+
 class MultiplexTest(ATSiteTestCase):
 
     def afterSetUp(self):
@@ -148,11 +218,40 @@ class MultiplexTest(ATSiteTestCase):
         self.failUnlessEqual(len(results), 1)
         self.failUnlessEqual(results[0].getObject(), inst)
 
+    def test_cached_catalogs(self):
+        ids = lambda: [c.getId() for c in
+                       self.tool.getCatalogsByType('SimpleType')]
+        self.failUnlessEqual(ids(), ['portal_catalog'])
+        self.failUnless('SimpleType' in self.tool._v_catalogs_by_type)
+        # cached lookups are wrapped in the current context
+        self.failUnlessEqual(self.tool.getCatalogsByType('SimpleType')[0],
+                             self.pc)
+
+        self.tool.setCatalogsByType('SimpleType', ['zope_catalog'])
+        self.failUnlessEqual(ids(), ['zope_catalog'])
+
+        # a replaced catalog is looked up again
+        old = aq_base(self.zc)
+        self.portal._delObject('zope_catalog')
+        manage_addZCatalog(self.portal, 'zope_catalog', 'Zope Catalog')
+        catalog = self.tool.getCatalogsByType('SimpleType')[0]
+        self.failIf(aq_base(catalog) is old)
+        self.failUnless(aq_base(catalog) is aq_base(self.portal.zope_catalog))
+        # and so is a removed one
+        self.portal._delObject('zope_catalog')
+        self.failUnlessEqual(ids(), [])
+
+    def test_missing_catalog_not_cached(self):
+        self.tool.setCatalogsByType('SimpleType', ['other_catalog'])
+        self.failUnlessEqual(self.tool.getCatalogsByType('SimpleType'), [])
+        self.failIf('SimpleType' in self.tool._v_catalogs_by_type)
+
 
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
     suite.addTest(makeSuite(ETagTest))
     suite.addTest(makeSuite(ReindexTest))
+    suite.addTest(makeSuite(ChangeDetectionTest))
     suite.addTest(makeSuite(MultiplexTest))
     return suite
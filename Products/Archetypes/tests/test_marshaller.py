@@ -29,14 +29,21 @@ $Id$
 """
 
 import os
+from cStringIO import StringIO
 from unittest import TestCase
+
+import transaction
+from Acquisition import aq_base
 from OFS.Image import Pdata
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
 from Products.Archetypes.tests.atsitetestcase import ATSiteTestCase
 from Products.Archetypes.tests.utils import makeContent
 from Products.Archetypes.tests.utils import aputrequest
 from Products.Archetypes.tests.utils import PACKAGE_HOME
 from Products.Archetypes.atapi import *
 from Products.Archetypes.WebDAVSupport import PdataStreamIterator
+from Products.Archetypes.WebDAVSupport import _loadChain
 from Products.Archetypes.examples.DDocument import DDocument
 
 class MarshallerTests(ATSiteTestCase):
@@ -100,6 +107,29 @@ class MarshallerTests(ATSiteTestCase):
         self.assertEqual(word.getContentType('body'), 'application/msword')
         self.assertEqual(str(word.getRawBody()), data)
 
+    def test_rfc822FileDemarshall(self):
+        obj = makeContent(self.folder, portal_type='SimpleFile', id='obj1')
+        body = 'x' * (1 << 18)
+        data = StringIO('title: a title\n'
+                        'Content-Type: text/plain\n\n' + body)
+        marshaller = RFC822Marshaller()
+        marshaller.demarshall(obj, '', file=data)
+        self.assertEqual(obj.Title(), 'a title')
+        self.assertEqual(obj.getContentType('body'), 'text/plain')
+        self.assertEqual(str(obj.getRawBody()), body)
+
+    def test_uploadInChunks(self):
+        obj = makeContent(self.folder, portal_type='SimpleFile', id='obj1')
+        transaction.savepoint(optimistic=True)
+        field = obj.getField('body')
+        data = 'x' * (1 << 18)
+        field.set(obj, StringIO(data), _initializing_=True)
+        pdata = aq_base(field.get(obj, raw=True)).data
+        # Written to the database chunk by chunk
+        self.failUnless(isinstance(pdata, Pdata))
+        self.failIf(pdata.next is None)
+        self.assertEqual(str(pdata), data)
+
     def setupCTR(self):
         #Modify the CTR to point to SimpleType
         ctr = self.portal.content_type_registry
@@ -154,6 +184,79 @@ class PdataStreamTests(TestCase):
         expected = ['blobbl', 'ablabl', 'ablabl', 'a']
         self.assertEquals(list(iterator), expected)
 
+    def test_range(self):
+        start = pdata = Pdata('blob')
+        for i in range(0, 5):
+            pdata.next = Pdata('bla')
+            pdata = pdata.next
+        iterator = PdataStreamIterator(start, size=19, streamsize=4,
+                                       start=3, end=11)
+        self.assertEquals(len(iterator), 8)
+        self.assertEquals(list(iterator), ['bbla', 'blab'])
+
+    def test_committed(self):
+        db = DB(MappingStorage())
+        tm = transaction.TransactionManager()
+        conn = db.open(transaction_manager=tm)
+        start = pdata = Pdata('blob')
+        for i in range(0, 5):
+            pdata.next = Pdata('bla')
+            pdata = pdata.next
+        conn.root()['data'] = start
+        tm.commit()
+        iterator = PdataStreamIterator(start, size=19, streamsize=6)
+        # The request connection is gone when the iterator is consumed
+        conn.close()
+        try:
+            expected = ['blobbl', 'ablabl', 'ablabl', 'a']
+            self.assertEquals(list(iterator), expected)
+        finally:
+            db.close()
+
+    def test_committed_windows(self):
+        db = DB(MappingStorage())
+        tm = transaction.TransactionManager()
+        conn = db.open(transaction_manager=tm)
+        start = pdata = Pdata('blob')
+        for i in range(0, 5):
+            pdata.next = Pdata('bla')
+            pdata = pdata.next
+        conn.root()['data'] = start
+        tm.commit()
+        oid = start._p_oid
+        conn.close()
+        counter = ConnectionCounter(db)
+        try:
+            chunks = []
+            for chunk in _loadChain(counter, oid, 3, 17, window=6):
+                # No connection is held while a window is sent
+                self.assertEquals(counter.open_connections, 0)
+                chunks.append(chunk)
+            self.assertEquals(''.join(chunks), 'bblablablablab')
+            self.assertEquals(counter.opened, 3)
+        finally:
+            db.close()
+
+
+class ConnectionCounter(object):
+    """Counts the connections opened to db and those still open."""
+
+    def __init__(self, db):
+        self.db = db
+        self.opened = 0
+        self.open_connections = 0
+
+    def open(self, **kw):
+        conn = self.db.open(**kw)
+        self.opened += 1
+        self.open_connections += 1
+        close = conn.close
+        def closed(*args, **kw):
+            self.open_connections -= 1
+            close(*args, **kw)
+        conn.close = closed
+        return conn
+
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
@@ -0,0 +1,64 @@
+from Products.Archetypes.mimetype_utils import classifyMimetype
+from Products.Archetypes.mimetype_utils import clearMimetypeCache
+from Products.Archetypes.mimetype_utils import sniffMimetype
+from Products.Archetypes.tests.attestcase import ATTestCase
+
+
+class DummyRegistry:
+
+    def __init__(self):
+        self.classified = []
+
+    def lookupExtension(self, filename):
+        if filename.endswith('.txt'):
+            return 'text/plain'
+        return None
+
+    def classify(self, data, mimetype=None, filename=None):
+        self.classified.append(data)
+        return 'application/octet-stream'
+
+
+class MimetypeClassificationTest(ATTestCase):
+
+    def afterSetUp(self):
+        clearMimetypeCache()
+        self.mtr = DummyRegistry()
+
+    def beforeTearDown(self):
+        clearMimetypeCache()
+
+    def test_sniff(self):
+        self.assertEquals(sniffMimetype('%PDF-1.4\n'), 'application/pdf')
+        self.assertEquals(sniffMimetype('\x89PNG\r\n\x1a\n\x00'), 'image/png')
+        self.assertEquals(sniffMimetype('GIF89a\x10\x00'), 'image/gif')
+        self.assertEquals(sniffMimetype('\xff\xd8\xff\xe0'), 'image/jpeg')
+        self.assertEquals(sniffMimetype('just text'), None)
+
+    def test_magic_before_registry(self):
+        self.assertEquals(classifyMimetype(self.mtr, '%PDF-1.4', 'doc'),
+                          'application/pdf')
+        self.assertEquals(self.mtr.classified, [])
+
+    def test_extension_wins(self):
+        self.assertEquals(classifyMimetype(self.mtr, '%PDF-1.4', 'doc.txt'),
+                          'text/plain')
+
+    def test_cache(self):
+        data = '\x00\x01 some data'
+        for i in range(3):
+            self.assertEquals(classifyMimetype(self.mtr, data, 'a.bin'),
+                              'application/octet-stream')
+        self.assertEquals(self.mtr.classified, [data])
+        # The extension is part of the key
+        classifyMimetype(self.mtr, data, 'a.dat')
+        self.assertEquals(len(self.mtr.classified), 2)
+        classifyMimetype(self.mtr, 'other data', 'a.bin')
+        self.assertEquals(len(self.mtr.classified), 3)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(MimetypeClassificationTest))
+    return suite
@@ -39,6 +39,7 @@ from Products.Archetypes.tests.utils import makeContent
 
 from Products.Archetypes import config
 from Products.Archetypes.references import HoldingReference, CascadeReference
+from Products.Archetypes.exceptions import ReferenceException
 from OFS.ObjectManager import BeforeDeleteException
 import transaction
 
@@ -173,6 +174,157 @@ class ReferenceCatalogTests(ATSiteTestCase):
         self.verifyBrains()
 
 
+    def test_rebuildReferences(self):
+        rc = getattr(self.portal, config.REFERENCE_CATALOG)
+        obj1 = makeContent(self.folder, portal_type='Fact', id='obj1')
+        obj2 = makeContent(self.folder, portal_type='Fact', id='obj2')
+        obj3 = makeContent(self.folder, portal_type='Fact', id='obj3')
+        obj1.addReference(obj2, 'rel')
+        obj1.addReference(obj3, 'rel')
+        obj2.addReference(obj3, 'rel')
+
+        # everything is up to date
+        self.assertEquals(rc.rebuildReferences(), (0, 2))
+
+        # lose a reference
+        brain = rc(sourceUID=obj1.UID(), targetUID=obj2.UID())[0]
+        rc.uncatalog_object(brain.getPath())
+        self.assertEquals(len(rc(sourceUID=obj1.UID())), 1)
+        self.assertEquals(rc.rebuildReferences(), (2, 1))
+        self.assertEquals(len(rc(sourceUID=obj1.UID())), 2)
+
+        # rebuild from scratch
+        self.assertEquals(rc.rebuildReferences(clear=True), (3, 0))
+        self.assertEquals(len(rc()), 3)
+        self.assertEquals(rc.rebuildReferences(walk_site=True), (0, 2))
+        self.verifyBrains()
+
+    def test_rebuildReferencesWalkingSite(self):
+        rc = getattr(self.portal, config.REFERENCE_CATALOG)
+        uc = getattr(self.portal, config.UID_CATALOG)
+        obj1 = makeContent(self.folder, portal_type='Fact', id='obj1')
+        obj2 = makeContent(self.folder, portal_type='Fact', id='obj2')
+        obj1.addReference(obj2, 'rel')
+
+        # the reference is missing in both catalogs, walking the site
+        # rebuilds it and keeps it although the uid_catalog lacks it
+        path = rc(sourceUID=obj1.UID())[0].getPath()
+        rc.uncatalog_object(path)
+        uc.uncatalog_object(path)
+        self.assertEquals(rc.rebuildReferences(walk_site=True), (1, 0))
+        self.assertEquals(len(rc(sourceUID=obj1.UID())), 1)
+
+    def test_bulkReferences(self):
+        rc = getattr(self.portal, config.REFERENCE_CATALOG)
+        obj1 = makeContent(self.folder, portal_type='Fact', id='obj1')
+        obj2 = makeContent(self.folder, portal_type='Fact', id='obj2')
+        obj3 = makeContent(self.folder, portal_type='Fact', id='obj3')
+        obj4 = makeContent(self.folder, portal_type='Fact', id='obj4')
+
+        added = rc.addReferences(obj1, [obj2, obj3.UID(), obj4, obj2], 'rel')
+        self.assertEquals(len(added), 3)
+        self.assertEquals(len(rc(sourceUID=obj1.UID())), 3)
+        # an invalid target is found before anything is changed
+        obj5 = makeContent(self.folder, portal_type='Fact', id='obj5')
+        self.assertRaises(ReferenceException, rc.addReferences, obj1,
+                          [obj5, 'no-such-uid'], 'rel')
+        self.assertEquals(len(rc(sourceUID=obj1.UID())), 3)
+        self.failIf(obj5 in obj1.getRefs('rel'))
+        # adding again replaces the existing references
+        rc.addReferences(obj1, [obj2], 'rel')
+        self.assertEquals(len(rc(sourceUID=obj1.UID())), 3)
+
+        rc.deleteReferences(obj1, 'rel', targets=[obj2, obj4.UID()])
+        self.assertEquals(obj1.getRefs('rel'), [obj3])
+        self.verifyBrains()
+
+    def test_adjacency(self):
+        rc = getattr(self.portal, config.REFERENCE_CATALOG)
+        rc.rebuildAdjacency()
+        obj1 = makeContent(self.folder, portal_type='Fact', id='obj1')
+        obj2 = makeContent(self.folder, portal_type='Fact', id='obj2')
+        obj3 = makeContent(self.folder, portal_type='Fact', id='obj3')
+        obj1.addReference(obj2, 'alpha')
+        obj1.addReference(obj3, 'beta')
+        obj2.addReference(obj3, 'beta')
+
+        self.assertEquals(rc.getTargetUIDs(obj1, 'alpha'), [obj2.UID()])
+        self.assertEquals(sorted(rc.getSourceUIDs(obj3)),
+                          sorted([obj1.UID(), obj2.UID()]))
+        self.assertEquals(sorted(rc.getRelationships(obj1)),
+                          ['alpha', 'beta'])
+        self.assertEquals(rc.getBackRelationships(obj3), ['beta'])
+        self.failUnless(rc.hasRelationshipTo(obj1, obj3, 'beta'))
+        self.failIf(rc.hasRelationshipTo(obj1, obj3, 'alpha'))
+
+        obj1.deleteReference(obj3, 'beta')
+        self.assertEquals(rc.getRelationships(obj1), ['alpha'])
+        self.assertEquals(obj3.getBRefs('beta'), [obj2])
+
+        # the index can be rebuilt from the catalog
+        self.assertEquals(rc.rebuildAdjacency(), 2)
+        self.assertEquals(obj1.getRefs(), [obj2])
+        rc.manage_catalogClear()
+        self.assertEquals(obj1.getRefs(), [])
+
+    def test_adjacency_keys(self):
+        rc = getattr(self.portal, config.REFERENCE_CATALOG)
+        rc.rebuildAdjacency()
+        obj1 = makeContent(self.folder, portal_type='Fact', id='obj1')
+        obj2 = makeContent(self.folder, portal_type='Fact', id='obj2')
+        obj1.addReference(obj2, 'alpha')
+        # keyed like the catalog, relative to the portal
+        paths = list(rc._catalog.paths.values())
+        self.assertEquals(sorted(rc._adjacency._refs.keys()), sorted(paths))
+        for path in paths:
+            self.failIf(path.startswith('/'))
+        # recataloging doesn't add another reference
+        for brain in rc():
+            rc.catalog_object(brain.getObject(), brain.getPath())
+        self.assertEquals(rc.getTargetUIDs(obj1), [obj2.UID()])
+
+    def test_adjacency_fallback(self):
+        rc = getattr(self.portal, config.REFERENCE_CATALOG)
+        rc._adjacency = None
+        obj1 = makeContent(self.folder, portal_type='Fact', id='obj1')
+        obj2 = makeContent(self.folder, portal_type='Fact', id='obj2')
+        obj3 = makeContent(self.folder, portal_type='Fact', id='obj3')
+        obj1.addReference(obj2, 'alpha')
+        obj2.addReference(obj3, 'beta')
+
+        # Without an index the catalog is queried, nothing is built
+        self.assertEquals(rc.getTargetUIDs(obj1, 'alpha'), [obj2.UID()])
+        self.assertEquals(rc.getSourceUIDs(obj3), [obj2.UID()])
+        self.assertEquals(rc.getRelationships(obj1), ['alpha'])
+        self.assertEquals(rc.getBackRelationships(obj3), ['beta'])
+        self.failUnless(rc.hasRelationshipTo(obj1, obj2, 'alpha'))
+        self.assertEquals(rc.traverseReferences(obj1),
+                          [obj2.UID(), obj3.UID()])
+        self.assertEquals(obj3.getBRefs(), [obj2])
+        self.failUnless(rc._adjacency is None)
+
+        self.assertEquals(rc.rebuildAdjacency(), 2)
+        self.assertEquals(rc.getTargetUIDs(obj2), [obj3.UID()])
+
+    def test_traverseReferences(self):
+        rc = getattr(self.portal, config.REFERENCE_CATALOG)
+        obj1 = makeContent(self.folder, portal_type='Fact', id='obj1')
+        obj2 = makeContent(self.folder, portal_type='Fact', id='obj2')
+        obj3 = makeContent(self.folder, portal_type='Fact', id='obj3')
+        obj1.addReference(obj2, 'rel')
+        obj2.addReference(obj3, 'rel')
+        obj3.addReference(obj1, 'rel')
+
+        self.assertEquals(rc.traverseReferences(obj1, 'rel'),
+                          [obj2.UID(), obj3.UID()])
+        self.assertEquals(list(rc.traverseReferences(obj1, depth=1,
+                                                     objects=True)),
+                          [obj2])
+        self.assertEquals(list(rc.findReferencePath(obj1, obj3,
+                                                    objects=True)),
+                          [obj1, obj2, obj3])
+        self.assertEquals(rc.findReferencePath(obj1, obj3, depth=1), None)
+
     def test_holdingref(self):
         rc = getattr(self.portal, config.REFERENCE_CATALOG)
         uc = getattr(self.portal, config.UID_CATALOG)
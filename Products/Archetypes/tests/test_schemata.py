@@ -27,6 +27,7 @@
 
 import operator
 
+from Products.Archetypes.tests.attestcase import ATTestCase
 from Products.Archetypes.tests.atsitetestcase import ATSiteTestCase
 from Products.Archetypes.atapi import *
 from Products.Archetypes.config import PKG_NAME
@@ -214,8 +215,85 @@ class SchemataTest( ATSiteTestCase ):
         self.failUnless('f2' in editable_field_ids)
         self.failUnless('f3' not in editable_field_ids)
 
+class CompiledSchemaTest(ATTestCase):
+
+    def afterSetUp(self):
+        self.schema = Schema((
+            StringField('a', searchable=True),
+            StringField('b', schemata='other'),
+            ReferenceField('c', relationship='c'),
+            ))
+
+    def test_groupings(self):
+        schema = self.schema
+        compiled = schema.compiled()
+        self.failUnless(schema.compiled() is compiled)
+        self.assertEquals(schema.searchable(), ['a'])
+        self.assertEquals(schema.getSchemataNames(), ['default', 'other'])
+        self.assertEquals(getNames(schema), ['a', 'b', 'c'])
+        self.assertEquals([f.getName() for f in
+                           schema.filterFields(type='reference')], ['c'])
+        self.assertEquals([f.getName() for f in
+                           schema.getSchemataFields('other')], ['b'])
+        self.assertEquals([f.getName() for f in
+                           compiled.byType()['string']], ['a', 'b'])
+        # results are copies
+        schema.fields().append(None)
+        self.assertEquals(len(schema.fields()), 3)
+
+    def test_invalidation(self):
+        schema = self.schema
+        schema.compiled()
+        schema.addField(StringField('d', searchable=True))
+        self.assertEquals(schema.searchable(), ['a', 'd'])
+        schema.moveField('d', pos='top')
+        self.assertEquals(getNames(schema), ['d', 'a', 'b', 'c'])
+        schema.changeSchemataForField('d', 'other')
+        self.assertEquals([f.getName() for f in
+                           schema.getSchemataFields('other')], ['b', 'd'])
+        schema.replaceField('b', StringField('e'))
+        self.assertEquals(getNames(schema), ['a', 'e', 'c', 'd'])
+        del schema['e']
+        self.assertEquals(getNames(schema), ['a', 'c', 'd'])
+        self.failIf('_v_compiled' in schema.__getstate__())
+
+    def test_field_changes(self):
+        schema = self.schema
+        compiled = schema.compiled()
+        # changes of other fields don't invalidate the view
+        StringField('x').searchable = True
+        self.failUnless(schema.compiled() is compiled)
+        # in place changes of our fields are seen
+        schema['b'].searchable = True
+        self.assertEquals(schema.searchable(), ['a', 'b'])
+        schema['a'].schemata = 'other'
+        self.assertEquals(schema.getSchemataNames(), ['other'])
+        schema['b'].primary = True
+        self.failUnless(schema.hasPrimary())
+        self.assertEquals([f.getName() for f in
+                           schema.filterFields(searchable=True)], ['a', 'b'])
+        # the version is not stored
+        self.failIf('_version' in schema['a'].__getstate__())
+
+    def test_signature(self):
+        schema = self.schema
+        signature = schema.signature()
+        structure = schema.structureSignature()
+        self.failUnless(schema.toString() is schema.toString())
+        self.assertEquals(signature, schema.copy().signature())
+        toString = schema.toString()
+        schema['a'].searchable = False
+        # in place changes of fields are seen, as they used to be
+        self.failIfEqual(schema.toString(), toString)
+        self.failIfEqual(schema.signature(), signature)
+        self.assertEquals(schema.structureSignature(), structure)
+        schema.changeSchemataForField('a', 'other')
+        self.failIfEqual(schema.structureSignature(), structure)
+
+
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
     suite.addTest(makeSuite(SchemataTest))
+    suite.addTest(makeSuite(CompiledSchemaTest))
     return suite
@@ -0,0 +1,66 @@
+import transaction
+from OFS.Image import File
+from Persistence import Persistent
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
+
+from Products.Archetypes import textcache
+from Products.Archetypes.Field import FileField
+from Products.Archetypes.Field import StringField
+from Products.Archetypes.tests.attestcase import ATTestCase
+
+
+class Content(Persistent):
+    pass
+
+
+class TextCacheTest(ATTestCase):
+
+    def afterSetUp(self):
+        self.db = DB(MappingStorage())
+        self.tm = transaction.TransactionManager()
+        self.conn = self.db.open(transaction_manager=self.tm)
+        self.root = self.conn.root()
+        self.field = FileField('file', searchable=True)
+        textcache.clear()
+
+    def beforeTearDown(self):
+        self.tm.abort()
+        self.conn.close()
+        self.db.close()
+        textcache.clear()
+
+    def test_cacheable(self):
+        self.failUnless(textcache.isCacheable(self.field))
+        self.failIf(textcache.isCacheable(StringField('title')))
+        field = FileField('file', index_method='customIndexable')
+        self.failIf(textcache.isCacheable(field))
+
+    def test_revision_key(self):
+        content = self.root['content'] = Content()
+        self.assertEquals(textcache.revisionKey(self.field, content), None)
+        content.file = File('file', '', 'data')
+        # Not committed yet
+        self.assertEquals(textcache.revisionKey(self.field, content), None)
+        self.tm.commit()
+        key = textcache.revisionKey(self.field, content)
+        self.failIf(key is None)
+        self.assertEquals(textcache.revisionKey(self.field, content), key)
+
+        textcache.setText(key, 'text')
+        self.assertEquals(textcache.getText(key), 'text')
+
+        content.file.update_data('other data')
+        self.assertEquals(textcache.revisionKey(self.field, content), None)
+        self.tm.commit()
+        other = textcache.revisionKey(self.field, content)
+        self.failIf(other is None)
+        self.failIf(other == key)
+        self.assertEquals(textcache.getText(other), None)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TextCacheTest))
+    return suite
@@ -0,0 +1,110 @@
+import transaction
+
+from Products.Archetypes import uidcache
+from Products.Archetypes.config import UID_CATALOG
+from Products.Archetypes.utils import LRUCache
+from Products.Archetypes.tests.attestcase import ATTestCase
+from Products.Archetypes.tests.atsitetestcase import ATSiteTestCase
+from Products.Archetypes.tests.utils import makeContent
+
+
+class LRUCacheTest(ATTestCase):
+
+    def test_lru(self):
+        cache = LRUCache(10)
+        for i in range(10):
+            cache.set(i, str(i))
+        # touch the oldest key, so it survives
+        self.assertEquals(cache.get(0), '0')
+        # the least recently used tenth is dropped
+        cache.set(10, '10')
+        self.assertEquals(len(cache), 9)
+        self.failIf(1 in cache)
+        self.failIf(2 in cache)
+        self.failUnless(0 in cache)
+        cache.invalidate(0)
+        self.assertEquals(cache.get(0, 'x'), 'x')
+
+    def test_maxbytes(self):
+        cache = LRUCache(10, 100)
+        for i in range(4):
+            cache.set(i, str(i) * 30)
+        # the oldest texts are dropped to stay below 90 bytes
+        self.assertEquals(len(cache), 3)
+        self.failIf(0 in cache)
+        cache.set(1, 'x')
+        cache.set(4, 'y' * 101)
+        self.failIf(4 in cache)
+        cache.set(5, 'z' * 80)
+        self.assertEquals(sorted(cache._data.keys()), [1, 5])
+        cache.set(6, None)
+        self.failUnless(6 in cache)
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.set(1, 1)
+        self.assertEquals(len(cache), 0)
+
+
+class UIDCacheTest(ATSiteTestCase):
+
+    def afterSetUp(self):
+        self.uc = getattr(self.portal, UID_CATALOG)
+        self.obj = makeContent(self.folder, portal_type='Fact', id='obj')
+        self.uid = self.obj.UID()
+
+    def test_cached_object(self):
+        obj = uidcache.resolveUID(self.uc, self.uid)
+        self.assertEquals(obj.getPhysicalPath(), self.obj.getPhysicalPath())
+        self.failUnless(uidcache.resolveUID(self.uc, self.uid) is obj)
+        self.assertEquals(uidcache.resolveUID(self.uc, 'nonexisting'), None)
+
+    def test_rename_invalidates(self):
+        uidcache.resolveUID(self.uc, self.uid)
+        transaction.savepoint(optimistic=True)
+        self.folder.manage_renameObject(id='obj', new_id='renamed')
+        obj = uidcache.resolveUID(self.uc, self.uid)
+        self.assertEquals(obj.getId(), 'renamed')
+
+    def test_stale_path(self):
+        uidcache.resolveUID(self.uc, self.uid)
+        # a path cached by another process may point to a different object
+        other = makeContent(self.folder, portal_type='Fact', id='other')
+        uidcache._paths.set(self.uid, other._getURL())
+        uidcache._local.objects.clear()
+        obj = uidcache.resolveUID(self.uc, self.uid)
+        self.assertEquals(obj.getId(), 'obj')
+
+    def test_brain_checks_path(self):
+        brain = self.uc(UID=self.uid)[0]
+        obj = brain.getObject()
+        self.assertEquals(obj.getPhysicalPath(), self.obj.getPhysicalPath())
+        self.failUnless(brain.getObject() is obj)
+        # an object cached for the UID at another path isn't used
+        other = makeContent(self.folder, portal_type='Fact', id='other')
+        uidcache.cacheObject(self.uc, self.uid, other)
+        self.assertEquals(brain.getObject().getId(), 'obj')
+
+    def test_resolveUIDs(self):
+        sub = makeContent(self.folder, portal_type='SimpleFolder', id='sub')
+        obj1 = makeContent(sub, portal_type='Fact', id='obj1')
+        obj2 = makeContent(sub, portal_type='Fact', id='obj2')
+        uids = [obj2.UID(), self.uid, 'nonexisting', obj1.UID()]
+        result = self.uc.resolveUIDs(uids)
+        self.assertEquals(len(result), 4)
+        self.assertEquals(result['nonexisting'], None)
+        self.assertEquals(result[obj1.UID()].getPhysicalPath(),
+                          obj1.getPhysicalPath())
+        self.assertEquals(result[obj2.UID()].getPhysicalPath(),
+                          obj2.getPhysicalPath())
+        # the objects are cached for the transaction
+        self.failUnless(uidcache.resolveUID(self.uc, self.uid)
+                        is result[self.uid])
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(LRUCacheTest))
+    suite.addTest(makeSuite(UIDCacheTest))
+    return suite
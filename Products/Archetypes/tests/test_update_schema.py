@@ -26,8 +26,10 @@
 import os
 import sys
 
+import transaction
 from ZPublisher.HTTPRequest import HTTPRequest
 from Testing import ZopeTestCase
+from Acquisition import aq_base
 
 from Products.Archetypes.tests.atsitetestcase import ATSiteTestCase
 from Products.Archetypes.tests.utils import makeContent
@@ -170,6 +172,31 @@ class TestUpdateSchema(ZopeTestCase.Sandboxed, ATSiteTestCase):
         dummy._updateSchema()
         self.failUnless(dummy._isSchemaCurrent())
 
+    def test_incremental_update(self):
+        dummy = self._dummy1
+        dummy.setTEXTFIELD1('X')
+        # The tool has to know the fields of the old schema
+        self.attool.recordSchema(dummy.Schema())
+        dummy.__class__.schema = schema2.copy()
+        registerType(Dummy1, 'Archetypes')
+        self.failIf(dummy._isSchemaCurrent())
+        self.assertEqual(dummy._schemaDiff(dummy.Schema()),
+                         (['TEXTFIELD2'], [], []))
+        self.failIf(hasattr(aq_base(dummy), 'TEXTFIELD2'))
+        dummy._updateSchema()
+        self.failUnless(dummy._isSchemaCurrent())
+        # Only the new field was initialized
+        self.failUnless(hasattr(aq_base(dummy), 'TEXTFIELD2'))
+        self.assertEqual(dummy.getTEXTFIELD2(), 'B')
+        self.assertEqual(dummy.getTEXTFIELD1(), 'X')
+
+    def test_unknown_signature_updates_all_fields(self):
+        dummy = self._dummy1
+        dummy._signature = 'bogus'
+        self.assertEqual(dummy._schemaDiff(dummy.Schema()), None)
+        dummy._updateSchema()
+        self.failUnless(dummy._isSchemaCurrent())
+
     def test_remove_instance_schemas(self):
         dummy = self._dummy1
         dummy.schema = schema2.copy()
@@ -255,10 +282,67 @@ An rst Document
         self.assertEqual(mimetype, 'text/x-rst')
 
 
+class TestUpdateSchemas(ZopeTestCase.Sandboxed, ATSiteTestCase):
+    """Tests for the batched updateSchemas, which commits transactions."""
+
+    def afterSetUp(self):
+        ATSiteTestCase.afterSetUp(self)
+        self.attool = self.portal.archetype_tool
+        self.folder.invokeFactory('DDocument', 'doc1')
+        self.folder.invokeFactory('DDocument', 'doc2')
+        self.folder.invokeFactory('SimpleType', 'other')
+
+    def test_dry_run(self):
+        stats = self.attool.updateSchemas(types=['Archetypes.DDocument'],
+                                          update_all=True, dry_run=True)
+        self.assertEqual(stats.keys(), ['DDocument'])
+        self.assertEqual(stats['DDocument'][:2], (2, 2))
+        stats = self.attool.updateSchemas(types=['Archetypes.DDocument'],
+                                          dry_run=True)
+        self.assertEqual(stats['DDocument'][:2], (2, 0))
+        self.assertEqual(self.attool.schemaUpdateProgress(), None)
+
+    def test_update(self):
+        doc = self.folder.doc1
+        doc._signature = 'bogus'
+        self.attool._types['Archetypes.DDocument'] = 'cheat'
+        stats = self.attool.updateSchemas(batch_size=1)
+        self.assertEqual(stats['DDocument'][:2], (2, 1))
+        self.failUnless(self.folder.doc1._isSchemaCurrent())
+        self.assertEqual(self.attool.schemaUpdateProgress(), None)
+        self.failIf('Archetypes.DDocument' in
+                    [t for t, changed in self.attool.getChangedSchema()
+                     if changed])
+
+    def test_takeover(self):
+        from Products.Archetypes.examples.DDocument import DDocument
+        def crash(self, *args, **kw):
+            raise RuntimeError('crash')
+        original = DDocument._updateSchema
+        DDocument._updateSchema = crash
+        try:
+            self.assertRaises(RuntimeError, self.attool.updateSchemas,
+                              types=['Archetypes.DDocument'],
+                              update_all=True, worker='host:1')
+        finally:
+            DDocument._updateSchema = original
+        transaction.abort()
+
+        # A restarted worker can't take over a fresh claim
+        stats = self.attool.updateSchemas(worker='host:2')
+        self.failIf('DDocument' in stats)
+        self.failIf(self.attool.schemaUpdateProgress() is None)
+        # but a stale one
+        stats = self.attool.updateSchemas(worker='host:2', claim_timeout=0)
+        self.assertEqual(stats['DDocument'][:2], (2, 2))
+        self.assertEqual(self.attool.schemaUpdateProgress(), None)
+
+
 
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
     suite.addTest(makeSuite(TestUpdateSchema))
     suite.addTest(makeSuite(TestBasicSchemaUpdate))
+    suite.addTest(makeSuite(TestUpdateSchemas))
     return suite
@@ -26,9 +26,13 @@
 """
 
 
+from cStringIO import StringIO
+
 from Products.Archetypes.tests.attestcase import ATTestCase
 from Products.Archetypes.utils import DisplayList
 from Products.Archetypes.utils import make_uuid
+from Products.Archetypes.utils import iterData
+from Products.Archetypes.utils import readData
 
 class UidGeneratorTest(ATTestCase):
     """Some ppl have reported problems with uids. This test isn't mathematical
@@ -138,9 +142,38 @@ class DisplayListTest(ATTestCase):
         assert dlc_s.values() == ['Z', 'X', 'Y']
 
 
+class FileDataTest(ATTestCase):
+
+    def makePdata(self, chunks):
+        from OFS.Image import Pdata
+        first = None
+        for chunk in reversed(chunks):
+            pdata = Pdata(chunk)
+            pdata.next = first
+            first = pdata
+        return first
+
+    def test_iter_data(self):
+        self.assertEqual(list(iterData('abc')), ['abc'])
+        data = self.makePdata(['abc', 'def', 'g'])
+        self.assertEqual(list(iterData(data)), ['abc', 'def', 'g'])
+
+    def test_read_data(self):
+        data = self.makePdata(['abc', 'def', 'g'])
+        self.assertEqual(readData(data), 'abcdefg')
+        self.assertEqual(readData(data, 3), 'abc')
+        self.assertEqual(readData(data, 5), 'abcde')
+        self.assertEqual(readData(data, 100), 'abcdefg')
+        self.assertEqual(readData('abcdefg', 2), 'ab')
+        f = StringIO('abcdefg')
+        self.assertEqual(readData(f, 3), 'abc')
+        self.assertEqual(readData(f), 'defg')
+
+
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
     suite.addTest(makeSuite(DisplayListTest))
     suite.addTest(makeSuite(UidGeneratorTest))
+    suite.addTest(makeSuite(FileDataTest))
     return suite
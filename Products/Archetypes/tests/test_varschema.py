@@ -55,6 +55,42 @@ class VarSchemataTest( ATTestCase ):
         #check if we can read the new field using the new schema
         self.assertEqual(dummy.getAdditionalField(),'flurb')
 
+    def test_schema_cache(self):
+        self.folder.dummy = Dummy(oid='dummy')
+        dummy = self.folder.dummy
+        dummy.schema = schema1.copy()
+        prepared = dummy.getAndPrepareSchema()
+        self.failUnless(dummy.getAndPrepareSchema() is prepared)
+
+        # an equal schema shares the prepared one
+        dummy.schema = schema1.copy()
+        self.failUnless(dummy.getAndPrepareSchema() is prepared)
+
+        # changes to the schema are picked up
+        dummy.schema.addField(StringField('otherField'))
+        self.failIf(dummy.getAndPrepareSchema() is prepared)
+        dummy.setOtherField('flurb')
+        self.assertEqual(dummy.getOtherField(), 'flurb')
+
+        # and so are in place changes of its fields
+        prepared = dummy.getAndPrepareSchema()
+        dummy.schema['otherField'].accessor = 'fetchOtherField'
+        self.failIf(dummy.getAndPrepareSchema() is prepared)
+        self.assertEqual(dummy.fetchOtherField(), 'flurb')
+
+    def test_schema_cache_keys(self):
+        from Products.Archetypes.VariableSchemaSupport import _schemas
+        self.folder.dummy = Dummy(oid='dummy')
+        dummy = self.folder.dummy
+        dummy.schema = schema1.copy()
+        prepared = dummy.getAndPrepareSchema()
+        size = len(_schemas)
+        # new but equal schemas don't add entries
+        for i in range(3):
+            dummy.schema = schema1.copy()
+            self.failUnless(dummy.getAndPrepareSchema() is prepared)
+        self.assertEqual(len(_schemas), size)
+
 
 def test_suite():
     from unittest import TestSuite, makeSuite
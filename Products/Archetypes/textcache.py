@@ -0,0 +1,71 @@
+"""Cache of the searchable text extracted from file and text fields.
+
+``BaseObject.SearchableText`` asks the index accessor of every searchable
+field for a text/plain version of its value. For text and file fields this
+means running ``portal_transforms`` over the whole body, e.g. converting a
+PDF or an Office document, every time the object is reindexed, even if only
+its title changed.
+
+The stored value of these fields is a persistent object (a BaseUnit or an
+OFS File) which gets a new serial whenever it is changed. The extracted
+text is kept in a per-process LRU cache keyed by the database, oid and
+serial of the stored value, so a reindex of an object whose file did not
+change skips the conversion. Values that were not committed yet are never
+cached. The cache is bounded by the number of texts as well as by their
+total size (``config.SEARCHABLE_TEXT_CACHE_BYTES``).
+"""
+
+from Acquisition import aq_base
+from ZODB.utils import z64
+
+from Products.Archetypes import config
+from Products.Archetypes.interfaces.field import IFileField
+from Products.Archetypes.utils import LRUCache
+
+_texts = LRUCache(config.SEARCHABLE_TEXT_CACHE_SIZE,
+                  config.SEARCHABLE_TEXT_CACHE_BYTES)
+
+
+def isCacheable(field):
+    """Only the text of file fields indexed through their own accessor is
+    cached: custom index methods may depend on anything.
+    """
+    if not IFileField.providedBy(field):
+        return False
+    return field.getIndexAccessorName() in (field.accessor,
+                                            field.edit_accessor)
+
+
+def revisionKey(field, instance):
+    """Return a key for the stored revision of the value of field or None.
+    """
+    try:
+        value = field.getStorage(instance).get(field.getName(), instance)
+    except (AttributeError, KeyError):
+        return None
+    value = aq_base(value)
+    jar = getattr(value, '_p_jar', None)
+    oid = getattr(value, '_p_oid', None)
+    if jar is None or oid is None:
+        return None
+    # The serial of a ghost is only known after loading it
+    value._p_activate()
+    if value._p_changed or value._p_serial == z64:
+        return None
+    return (jar.db().database_name, oid, value._p_serial,
+            field.getName())
+
+
+def getText(key, default=None):
+    if key is None:
+        return default
+    return _texts.get(key, default)
+
+
+def setText(key, text):
+    if key is not None:
+        _texts.set(key, text)
+
+
+def clear():
+    _texts.clear()
@@ -0,0 +1,161 @@
+"""Caches for resolving UIDs to objects.
+
+Resolving a UID means looking it up in the UID index of the uid_catalog,
+reading the path of the record and traversing to it from the portal. Two
+caches save most of this work for UIDs that are resolved over and over:
+
+- a per-process LRU cache of uid -> path relative to the portal. It is
+  shared by all threads and may be stale, e.g. after an object was moved
+  by another ZEO client, so an object found through it is only used if its
+  UID matches; otherwise the uid_catalog is asked.
+
+- a per-transaction cache of uid -> object. In Zope a request is handled
+  in one transaction, so this makes repeated lookups within one request
+  free.
+
+Referenceable invalidates both caches when an object is (un)cataloged in
+the uid_catalog or gets a new UID.
+"""
+
+import threading
+
+import transaction
+from Acquisition import aq_base, aq_inner, aq_parent
+from plone.uuid.interfaces import IUUID
+
+from Products.Archetypes import config
+from Products.Archetypes.utils import LRUCache
+
+_paths = LRUCache(config.UID_PATH_CACHE_SIZE)
+_local = threading.local()
+
+
+def _objects():
+    """Return the uid -> object cache of the current transaction.
+    """
+    txn = transaction.get()
+    if getattr(_local, 'txn', None) is not txn:
+        _local.txn = txn
+        _local.objects = {}
+    return _local.objects
+
+
+def invalidate(uid):
+    """Forget everything cached about uid.
+    """
+    if uid is None:
+        return
+    _paths.invalidate(uid)
+    objects = getattr(_local, 'objects', None)
+    if objects:
+        for key in [key for key in objects if key[1] == uid]:
+            del objects[key]
+
+
+def cachedObject(uc, uid, default=None):
+    """Return the object cached for uid in this transaction.
+    """
+    return _objects().get((id(aq_base(uc)), uid), default)
+
+
+def cacheObject(uc, uid, obj):
+    _objects()[(id(aq_base(uc)), uid)] = obj
+
+
+def resolveUID(uc, uid):
+    """Return the object with the given uid using uid_catalog uc, or None.
+    """
+    key = (id(aq_base(uc)), uid)
+    objects = _objects()
+    obj = objects.get(key)
+    if obj is not None:
+        return obj
+
+    uc = aq_inner(uc)
+    traverse = aq_parent(uc).unrestrictedTraverse
+    path = _paths.get(uid)
+    if path is not None:
+        obj = traverse(path, None)
+        if obj is None or IUUID(obj, None) != uid:
+            _paths.invalidate(uid)
+            obj = None
+
+    if obj is None:
+        _catalog = uc._catalog
+        rids = _catalog.indexes['UID']._index.get(uid, ())
+        if isinstance(rids, int):
+            rids = (rids, )
+        for rid in rids:
+            path = _catalog.paths[rid]
+            obj = traverse(path, None)
+            if obj is not None:
+                _paths.set(uid, path)
+                break
+
+    if obj is not None:
+        objects[key] = obj
+    return obj
+
+
+def resolveUIDs(uc, uids):
+    """Resolve many uids at once, returns a dict of uid -> object or None.
+
+    The uids are looked up in the UID index in one pass. The paths are then
+    traversed in sorted order, so containers shared by consecutive paths are
+    traversed only once.
+    """
+    result = {}
+    ucid = id(aq_base(uc))
+    objects = _objects()
+    uc = aq_inner(uc)
+    _catalog = uc._catalog
+    index = _catalog.indexes['UID']._index
+    pending = []
+    for uid in uids:
+        if uid in result:
+            continue
+        obj = objects.get((ucid, uid))
+        result[uid] = obj
+        if obj is not None:
+            continue
+        rids = index.get(uid, ())
+        if isinstance(rids, int):
+            rids = (rids, )
+        for rid in rids:
+            pending.append((_catalog.paths[rid], uid))
+    pending.sort()
+
+    root = aq_parent(uc)
+    stack = []
+    for path, uid in pending:
+        if result[uid] is not None:
+            continue
+        obj = _traverseShared(root, path.split('/'), stack)
+        if obj is not None:
+            result[uid] = obj
+            objects[(ucid, uid)] = obj
+            _paths.set(uid, path)
+    return result
+
+
+def _traverseShared(root, names, stack):
+    """Traverse names from root, reusing the objects on stack.
+
+    stack holds (name, object) pairs of the previously traversed path and
+    is updated to the path of names.
+    """
+    common = 0
+    while common < len(stack) and common < len(names) and \
+          stack[common][0] == names[common]:
+        common += 1
+    del stack[common:]
+    if stack:
+        obj = stack[-1][1]
+    else:
+        obj = root
+    for name in names[common:]:
+        obj = obj.unrestrictedTraverse(name, None)
+        if obj is None:
+            return None
+        stack.append((name, obj))
+    return obj
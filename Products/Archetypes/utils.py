@@ -1,6 +1,7 @@
 import logging
 import os
 import sys
+import threading
 from inspect import getargs, getmro
 from itertools import islice, count
 from types import ClassType, MethodType
@@ -636,6 +637,161 @@ class OrderedDict(BaseDict):
 InitializeClass(OrderedDict)
 
 
+class LRUCache(object):
+    """A thread safe mapping that keeps the maxsize most recently used keys.
+
+    When the cache grows beyond maxsize the least recently used tenth of
+    the keys is dropped at once. A maxsize of 0 disables the cache.
+
+    If maxbytes is given the total length of the string values is kept
+    below maxbytes the same way. Values longer than maxbytes are not cached
+    at all.
+    """
+
+    def __init__(self, maxsize, maxbytes=0):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._bytes = 0
+        self._data = {}
+        self._lock = threading.Lock()
+        self._tick = count().next
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        # Not locked, a lost update of the access time doesn't matter
+        item[0] = self._tick()
+        return item[1]
+
+    def set(self, key, value):
+        if not self.maxsize:
+            return
+        size = 0
+        if self.maxbytes and isinstance(value, basestring):
+            size = len(value)
+            if size > self.maxbytes:
+                self.invalidate(key)
+                return
+        self._lock.acquire()
+        try:
+            old = self._data.get(key)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = [self._tick(), value, size]
+            self._bytes += size
+            if len(self._data) > self.maxsize or \
+               (self.maxbytes and self._bytes > self.maxbytes):
+                self._shrink()
+        finally:
+            self._lock.release()
+
+    def _shrink(self):
+        items = [(item[0], key) for key, item in self._data.items()]
+        items.sort()
+        keep = self.maxsize * 9 / 10
+        keep_bytes = self.maxbytes * 9 / 10
+        dropped = 0
+        for tick, key in items:
+            if dropped and len(self._data) <= keep and \
+               (not self.maxbytes or self._bytes <= keep_bytes):
+                break
+            self._bytes -= self._data.pop(key)[2]
+            dropped += 1
+
+    def invalidate(self, key):
+        self._lock.acquire()
+        try:
+            item = self._data.pop(key, None)
+            if item is not None:
+                self._bytes -= item[2]
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._data.clear()
+            self._bytes = 0
+        finally:
+            self._lock.release()
+
+
+def iterData(data):
+    """Yield the data of an OFS File in chunks.
+
+    data is a string or a Pdata chain. Pdata objects that were read are
+    turned into ghosts again, so iterating over a big file doesn't keep
+    all of it in memory.
+    """
+    if isinstance(data, basestring):
+        yield data
+        return
+    while data is not None:
+        yield data.data
+        next = data.next
+        if getattr(data, '_p_jar', None) is not None and not data._p_changed:
+            data._p_deactivate()
+        data = next
+
+
+def readData(data, limit=None):
+    """Return the data of an OFS File as a string, at most limit bytes.
+
+    data may also be an open file, which is read from its position.
+    """
+    if isinstance(data, basestring):
+        return limit and data[:limit] or data
+    if shasattr(data, 'read'):
+        if limit:
+            return data.read(limit)
+        return data.read()
+    chunks = []
+    size = 0
+    for chunk in iterData(data):
+        if limit and size + len(chunk) >= limit:
+            chunks.append(chunk[:limit - size])
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    return ''.join(chunks)
+
+
+class OffsetFile(object):
+    """A read-only view of the part of a seekable file after offset.
+
+    Used to hand the body of a request to a field without copying it,
+    e.g. after the headers were parsed.
+    """
+
+    def __init__(self, file, offset):
+        self.file = file
+        self.offset = offset
+        file.seek(offset)
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def readline(self, size=-1):
+        return self.file.readline(size)
+
+    def seek(self, pos, whence=0):
+        if whence == 0:
+            pos += self.offset
+        self.file.seek(pos, whence)
+        if self.file.tell() < self.offset:
+            self.file.seek(self.offset)
+
+    def tell(self):
+        return self.file.tell() - self.offset
+
+
 def getRelPath(self, ppath):
     """take something with context (self) and a physical path as a
     tuple, return the relative path for the portal"""